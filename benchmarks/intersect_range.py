@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+compares queries of IntersectRangeFilter with null open bounds and with sentinel bounds
+
+Fills two collections with the same random intervals, part of them open-ended,
+stored as nulls in one and as sentinels in another, both with compound index on (beg, end),
+and reports time and explain stats of the same interval queries.
+
+Requires running mongodb server:
+    python benchmarks/intersect_range.py [--url mongodb://localhost:27017/bench] [--docs 200000] [--open 0.2] [--runs 20]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+# run from checkout, without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+settings.configure()
+
+from mongoengine import connect, Document, fields as db_fields
+from mongoengine.queryset.visitor import QNode
+from rest_framework import fields
+
+from drf_mongo_filters import filters
+
+LOW, HIGH = -2**63, 2**63-1
+
+
+class NullInterval(Document):
+    beg = db_fields.IntField()
+    end = db_fields.IntField()
+    meta = { 'indexes': [ ('beg', 'end') ] }
+
+class SentinelInterval(Document):
+    beg = db_fields.IntField()
+    end = db_fields.IntField()
+    meta = { 'indexes': [ ('beg', 'end') ] }
+
+
+def populate(count, open_rate, span):
+    NullInterval.drop_collection()
+    SentinelInterval.drop_collection()
+    rows = []
+    for i in range(count):
+        beg = random.randrange(span)
+        end = beg + random.randrange(span // 100)
+        rows.append((None if random.random() < open_rate else beg, None if random.random() < open_rate else end))
+    NullInterval._get_collection().insert_many([ { 'beg': beg, 'end': end } for beg, end in rows ])
+    SentinelInterval._get_collection().insert_many([ { 'beg': LOW if beg is None else beg, 'end': HIGH if end is None else end } for beg, end in rows ])
+    NullInterval.ensure_indexes()
+    SentinelInterval.ensure_indexes()
+
+
+def measure(document, filt, value, runs):
+    params = filt.filter_params(value)
+    queryset = document.objects.filter(params) if isinstance(params, QNode) else document.objects.filter(**params)
+    query = queryset._query
+    collection = document._get_collection()
+    timings = []
+    for i in range(runs):
+        started = time.perf_counter()
+        found = collection.count_documents(query)
+        timings.append(time.perf_counter() - started)
+    stats = collection.find(query).explain()['executionStats']
+    return found, statistics.median(timings), stats['totalKeysExamined'], stats['totalDocsExamined']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='mongodb://localhost:27017/drf_mongo_filters_bench')
+    parser.add_argument('--docs', type=int, default=200000)
+    parser.add_argument('--open', type=float, default=0.2, help="fraction of open bounds")
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    connect(host=args.url)
+    span = 10 ** 6
+    populate(args.docs, args.open, span)
+
+    null_filter = filters.IntersectRangeFilter(('beg', 'end'), child=fields.IntegerField())
+    sentinel_filter = filters.IntersectRangeFilter(('beg', 'end'), sentinels=(LOW, HIGH), child=fields.IntegerField())
+
+    print("%-24s %-9s %8s %10s %10s %10s" % ("query", "form", "found", "ms", "keys", "docs"))
+    for width in (100, 10000, 100000):
+        start = random.randrange(span - width)
+        value = { 'min': start, 'max': start + width }
+        for form, document, filt in (("nulls", NullInterval, null_filter), ("sentinels", SentinelInterval, sentinel_filter)):
+            found, median, keys, docs = measure(document, filt, value, args.runs)
+            print("%-24s %-9s %8d %10.2f %10d %10d" % ("%d..%d" % (value['min'], value['max']), form, found, median * 1000, keys, docs))
+
+    NullInterval.drop_collection()
+    SentinelInterval.drop_collection()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,4 +3,6 @@ from . import filters
 from . filtersets import *
 from .backend import MongoFilterBackend
 
+default_app_config = 'drf_mongo_filters.apps.MongoFiltersConfig'
+
 __version__ = "1.0"
@@ -0,0 +1,20 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.utils.module_loading import autodiscover_modules
+
+from .registry import registry
+
+
+class MongoFiltersConfig(AppConfig):
+    """ compiles all filtersets at startup
+
+    Imports modules listed in settings.MONGO_FILTERS_MODULES (default: filtersets) from each installed app,
+    to declare filtersets, and compiles them all.
+    """
+    name = 'drf_mongo_filters'
+    verbose_name = "DRF Mongo Filters"
+
+    def ready(self):
+        modules = getattr(settings, 'MONGO_FILTERS_MODULES', ('filtersets',))
+        autodiscover_modules(*modules)
+        registry.compile_all()
@@ -1,7 +1,27 @@
 from rest_framework.filters import BaseFilterBackend
 from drf_mongo_filters.filtersets import BaseFilterset, ModelFilterset
+from drf_mongo_filters.singleflight import SingleFlight
 
 class MongoFilterBackend(BaseFilterBackend):
+    """
+    class attrs:
+    - coalesce: make concurrent identical fetches and counts in the process share single query
+    - coalesce_timeout: max seconds to wait for shared query before running own
+    - slow_query_log: SlowQueryLog to record slow fetches and counts, None to disable
+    - query_stats: QueryStats to count shapes of filtered querysets, None to disable;
+      shapes are recorded with ordering of later backends (like OrderingFilter) when paginated with FilteredLimitOffsetPagination
+      or fetched with fetch, or right away if this is the last of view filter_backends
+
+    Filterset used to filter queryset is set as view.filterset.
+    If filterset has prefetch set, documents fetched through backend (with fetch, as by FilteredLimitOffsetPagination)
+    have listed references loaded in batch, other references are dereferenced lazily as usual.
+    """
+    coalesce = False
+    coalesce_timeout = 5
+    single_flight = SingleFlight()
+    slow_query_log = None
+    query_stats = None
+
     def filter_queryset(self, request, queryset, view):
         filter_class = getattr(view,'filter_class', None)
 
@@ -20,5 +40,81 @@ class MongoFilterBackend(BaseFilterBackend):
             if not issubclass(qs_model, fs_model):
                 raise TypeError("filter and view document class mismatch: %s vs %s " % (fs_model.__qualname__, qs_model.__qualname__))
 
-        filterset = filter_class(request.query_params)
-        return filterset.filter_queryset(queryset)
+        filterset = filter_class.for_request(request.query_params, request)
+        view.filterset = filterset
+        queryset = filterset.filter_queryset(queryset)
+        if self.query_stats is not None and self.is_last_backend(view):
+            self.record_stats(queryset, filterset)
+        return queryset
+
+    def is_last_backend(self, view):
+        """ if no other backends (like OrderingFilter) are applied to queryset after this one """
+        backends = getattr(view, 'filter_backends', None)
+        if not isinstance(backends, (list, tuple)) or not backends:
+            return True
+        return isinstance(self, backends[-1])
+
+    def record_stats(self, queryset, filterset=None):
+        """ count shape of queryset in query_stats, if enabled, once per filterset """
+        if self.query_stats is None or filterset is None or getattr(filterset, '_stats_recorded', False):
+            return
+        filterset._stats_recorded = True
+        self.query_stats.record(queryset, filterset)
+
+    def coalesced(self, key, func):
+        """ call func, sharing the call with concurrent callers with the same key if coalescing is enabled """
+        if not self.coalesce:
+            return func()
+        return self.single_flight.do(key, func, self.coalesce_timeout)
+
+    def timed(self, func, queryset, filterset=None, operation='fetch'):
+        """ call func evaluating queryset, recording slow calls if slow_query_log is set """
+        if self.slow_query_log is None:
+            return func()
+        return self.slow_query_log.timed(func, queryset, filterset, operation)
+
+    def prefetch(self, documents, filterset=None):
+        """ load references listed in filterset prefetch for documents """
+        if filterset is None or not filterset.prefetch:
+            return documents
+        return filterset.prefetch_references(documents)
+
+    def fetch(self, queryset, offset=0, limit=None, filterset=None):
+        """ evaluate slice of queryset to list
+
+        identical fetches are keyed by query, ordering, projection, result format and slice
+        """
+        if limit is None:
+            func = lambda: self.prefetch(list(queryset[offset:]), filterset)
+        else:
+            func = lambda: self.prefetch(list(queryset[offset:offset + limit]), filterset)
+        self.record_stats(queryset, filterset)
+        key = ('fetch', BaseFilterset.fingerprint(queryset), repr(queryset._ordering), repr(queryset._loaded_fields.as_dict()),
+               repr(queryset._scalar), queryset._as_pymongo, queryset._auto_dereference, offset, limit,
+               repr(getattr(filterset, 'prefetch', ())))
+        return self.coalesced(key, lambda: self.timed(func, queryset, filterset, 'fetch'))
+
+
+class SamplingFilterBackend(MongoFilterBackend):
+    """ approximate filtering for exploratory queries on huge collections
+
+    If filterset has sample_size set, returns list of randomly sampled documents matching the filters,
+    sampled with filterset sample_strategy, and sets view.sample_estimate to estimated count of all matching documents
+    (as returned by BaseFilterset.estimate_count).
+    Otherwise filters queryset as usual.
+
+    class attrs:
+    - sample_param: query param enabling sampling (when truthy), None to always sample
+    """
+    sample_param = None
+
+    def filter_queryset(self, request, queryset, view):
+        filtered = super().filter_queryset(request, queryset, view)
+        filterset = getattr(view, 'filterset', None)
+        if filterset is None or not filterset.sample_size:
+            return filtered
+        if self.sample_param is not None and request.query_params.get(self.sample_param, '') in ('', '0', 'false'):
+            return filtered
+
+        documents, view.sample_estimate = self.timed(lambda: filterset.sample_queryset(filtered), filtered, filterset, 'sample')
+        return self.prefetch(documents, filterset)
@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from pymongo.errors import OperationFailure
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
+
+from . import queries
+
+
+class BatchMixin():
+    """ several filtering queries in single aggregation, for BaseFilterset """
+    # error codes of results exceeding max size of document: BSONObjectTooLarge, and of $facet output
+    DOCUMENT_TOO_LARGE = (10334, 4031700)
+
+    @staticmethod
+    def page_stages(offset, limit):
+        """
+        stages to append to pipeline to fetch page of results and total count in single $facet
+
+        Result is single document { 'results': [...], 'count': [{ 'count': N }] }
+        """
+        return [ { '$facet': {
+            'results': [ { '$skip': offset }, { '$limit': limit } ],
+            'count': [ { '$count': 'count' } ] } } ]
+
+    @classmethod
+    def batch_queries(cls, queryset, batch, request=None):
+        """
+        evaluate several filtering queries of queryset in single aggregation
+
+        Each valid query is compiled with filter_pipeline into two sub-pipelines of single $facet,
+        fetching page of results, sorted by ordering of queryset, and total count.
+        The $facet is preceded by $match of any of the queries, so that only matching documents are scanned, using indexes.
+        If output of $facet exceeds max size of document, queries are run with separate aggregations.
+        Queries that cannot match are answered without database.
+        References listed in prefetch are loaded for results of all queries at once.
+
+        Args:
+        - queryset: queryset to filter
+        - batch: mapping of names to (params, offset, limit)
+        - request: request to get scope values from
+
+        Returns mapping of names to { 'results': [documents], 'count': N },
+        or to { 'errors': details } for queries with invalid params.
+        """
+        results = OrderedDict()
+        pages = OrderedDict()
+        sort = [ { '$sort': dict(queryset._ordering) } ] if queryset._ordering else []
+        for name, (params, offset, limit) in batch.items():
+            filterset = cls.for_request(params, request)
+            try:
+                pipeline = filterset.filter_pipeline(queryset)
+                if pipeline and '$geoNear' in pipeline[0]:
+                    raise ValidationError({ api_settings.NON_FIELD_ERRORS_KEY: ["geo near queries cannot be batched"] })
+            except ValidationError as e:
+                results[name] = { 'errors': e.detail }
+                continue
+            # checked on pipeline, since queryset cannot express $lookup of references exceeding max_ids
+            match = pipeline[0]['$match'] if pipeline and '$match' in pipeline[0] else {}
+            if getattr(filterset.simplify_queryset(queryset.filter(__raw__=match)), '_none', False):
+                results[name] = { 'results': [], 'count': 0 }
+                continue
+            results[name] = None
+            pages[name] = (pipeline, offset, limit)
+
+        if not pages:
+            return results
+
+        facets = {}
+        matches = []
+        for i, (pipeline, offset, limit) in enumerate(pages.values()):
+            facets['results%d' % i] = pipeline + sort + [ { '$skip': offset }, { '$limit': limit } ]
+            facets['count%d' % i] = pipeline + [ { '$count': 'count' } ]
+            matches.append(pipeline[0]['$match'] if pipeline and '$match' in pipeline[0] else {})
+        # sub-pipelines of $facet cannot use indexes
+        match = queries.any_of(matches)
+        stages = [ { '$match': match } ] if match else []
+
+        collection = queryset._collection
+        try:
+            facet = next(collection.aggregate(stages + [ { '$facet': facets } ]))
+            outputs = [ (facet['results%d' % i], facet['count%d' % i]) for i in range(len(pages)) ]
+        except OperationFailure as e:
+            if e.code not in cls.DOCUMENT_TOO_LARGE:
+                raise
+            outputs = []
+            for pipeline, offset, limit in pages.values():
+                page = next(collection.aggregate(pipeline + sort + cls.page_stages(offset, limit)))
+                outputs.append((page['results'], page['count']))
+
+        document = queryset._document
+        fetched = []
+        for name, (sons, count) in zip(pages.keys(), outputs):
+            documents = [ document._from_son(son, _auto_dereference=queryset._auto_dereference) for son in sons ]
+            fetched.extend(documents)
+            results[name] = { 'results': documents, 'count': count[0]['count'] if count else 0 }
+        if cls.prefetch:
+            cls.prefetch_references(fetched)
+        return results
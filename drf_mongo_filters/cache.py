@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache():
+    """ in-process LRU cache with expiring entries
+
+    Shared by filters and filtersets to memoize results of auxiliary queries.
+    Thread safe.
+
+    Args:
+    - maxsize: max number of entries, least recently used are evicted
+    - ttl: default lifetime of entries in seconds, None to keep until evicted
+    """
+    def __init__(self, maxsize=128, ttl=None, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ return cached value, or default if missing or expired """
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires is not None and expires <= self.timer():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """ store value, with ttl overriding default lifetime """
+        if ttl is None:
+            ttl = self.ttl
+        expires = self.timer() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __deepcopy__(self, memo):
+        # caches are shared, not copied along with filters
+        return self
@@ -0,0 +1,284 @@
+""" in-memory filtering of small collections
+
+Keeps columnar snapshot of filterable fields of a collection in numpy arrays
+and evaluates compiled queries as vectorized masks, with the same semantics as mongodb.
+Queries and values not supported by the snapshot raise Unsupported, to be run in database instead.
+
+Requires numpy.
+"""
+import re
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+from mongoengine import signals
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .backend import MongoFilterBackend
+from .queries import kind_of
+
+
+class Unsupported(Exception):
+    """ query cannot be evaluated with snapshot """
+    pass
+
+
+class Column():
+    """ values of a field in all documents
+
+    - present: mask of documents having the field
+    - null: mask of documents having null in the field
+    - has: mask of documents having not null value
+    - kind: type bracket of all values, None if there are no values
+    - values: array of values, float64 for numbers, datetime64 for dates, objects for others
+    """
+    MAX_EXACT_INT = 2 ** 53
+
+    def __init__(self, docs, name):
+        size = len(docs)
+        self.present = np.zeros(size, dtype=bool)
+        self.null = np.zeros(size, dtype=bool)
+        self.supported = True
+        raw = [None] * size
+        kinds = set()
+
+        for i, doc in enumerate(docs):
+            if name not in doc:
+                continue
+            self.present[i] = True
+            value = doc[name]
+            if value is None:
+                self.null[i] = True
+                continue
+            kinds.add(kind_of(value))
+            raw[i] = value
+
+        self.has = self.present & ~self.null
+        self.kind = None
+        if None in kinds or len(kinds) > 1:
+            # unsupported or mixed types
+            self.supported = False
+            return
+        if not kinds:
+            return
+        self.kind = kinds.pop()
+
+        if self.kind == 'number':
+            if any(isinstance(val, int) and abs(val) > self.MAX_EXACT_INT for val in raw if val is not None):
+                self.supported = False
+                return
+            self.values = np.array([ val if val is not None else np.nan for val in raw ], dtype='float64')
+        elif self.kind == 'date':
+            self.values = np.array([ val if val is not None else datetime(1970, 1, 1) for val in raw ], dtype='datetime64[ms]')
+        else:
+            self.values = np.empty(size, dtype=object)
+            self.values[:] = raw
+
+    def coerce(self, value):
+        """ convert value to match with column, or raise Unsupported """
+        if isinstance(value, datetime) and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        kind = kind_of(value)
+        if kind is None:
+            raise Unsupported(repr(value))
+        if kind == 'number':
+            if isinstance(value, int) and abs(value) > self.MAX_EXACT_INT:
+                raise Unsupported(repr(value))
+            value = float(value)
+        elif kind == 'date':
+            value = np.datetime64(value, 'ms')
+        return kind, value
+
+    def equal(self, value):
+        if value is None:
+            return ~self.has
+        kind, value = self.coerce(value)
+        if kind != self.kind:
+            return np.zeros(len(self.has), dtype=bool)
+        return self.has & (self.values == value).astype(bool)
+
+    def compare(self, op, value):
+        if value is None:
+            raise Unsupported("comparision with null")
+        kind, value = self.coerce(value)
+        mask = np.zeros(len(self.has), dtype=bool)
+        if kind != self.kind:
+            return mask
+        values = self.values[self.has]
+        if op == '$gt':
+            mask[self.has] = values > value
+        elif op == '$gte':
+            mask[self.has] = values >= value
+        elif op == '$lt':
+            mask[self.has] = values < value
+        else:
+            mask[self.has] = values <= value
+        return mask
+
+    def match(self, op, arg):
+        if not self.supported:
+            raise Unsupported("field of unsupported type")
+        if op == '$exists':
+            return self.present.copy() if arg else ~self.present
+        if op == '$eq':
+            return self.equal(arg)
+        if op == '$ne':
+            return ~self.equal(arg)
+        if op in ('$in', '$nin'):
+            if not isinstance(arg, (list, tuple)):
+                raise Unsupported(op + " with " + repr(arg))
+            mask = np.zeros(len(self.has), dtype=bool)
+            for value in arg:
+                mask |= self.equal(value)
+            return mask if op == '$in' else ~mask
+        if op in ('$gt', '$gte', '$lt', '$lte'):
+            return self.compare(op, arg)
+        raise Unsupported("operator " + op)
+
+
+class ColumnarSnapshot():
+    """ snapshot of fields of all documents in collection
+
+    Reloaded when older than ttl seconds, or after documents are saved or deleted (if mongoengine signals are available).
+    Updates bypassing signals are seen after ttl expires.
+
+    Args:
+    - document: document class
+    - fields: db names of top-level fields to load
+    - ttl: max age of snapshot in seconds
+    - documents: keep whole documents, to return them without database queries
+    """
+    def __init__(self, document, fields, ttl=60, documents=False, timer=time.monotonic):
+        if np is None:
+            raise ImportError("numpy is required for columnar snapshots")
+        self.document = document
+        self.fields = sorted(set(fields) | set(['_id']))
+        self.ttl = ttl
+        self.documents = documents
+        self.timer = timer
+        self._state = None
+        self._lock = threading.Lock()
+        for signal in (signals.post_save, signals.post_delete, signals.post_bulk_insert):
+            signal.connect(self.invalidate, sender=document)
+
+    def invalidate(self, *args, **kwargs):
+        self._state = None
+
+    def load(self):
+        projection = None if self.documents else dict.fromkeys(self.fields, 1)
+        docs = list(self.document._get_collection().find({}, projection))
+        columns = dict([ (name, Column(docs, name)) for name in self.fields ])
+        return { 'loaded': self.timer(), 'size': len(docs), 'columns': columns, 'docs': docs if self.documents else None }
+
+    @property
+    def state(self):
+        state = self._state
+        if state is None or state['loaded'] + self.ttl <= self.timer():
+            with self._lock:
+                state = self._state
+                if state is None or state['loaded'] + self.ttl <= self.timer():
+                    state = self._state = self.load()
+        return state
+
+    def evaluate(self, query, state=None):
+        """ return mask of documents matching query, raise Unsupported if cannot """
+        if state is None:
+            state = self.state
+        mask = np.ones(state['size'], dtype=bool)
+        for key, cond in query.items():
+            if key == '$and':
+                for sub in cond:
+                    mask &= self.evaluate(sub, state)
+            elif key in ('$or', '$nor'):
+                alt = np.zeros(state['size'], dtype=bool)
+                for sub in cond:
+                    alt |= self.evaluate(sub, state)
+                mask &= alt if key == '$or' else ~alt
+            elif key.startswith('$') or key not in state['columns']:
+                raise Unsupported("condition on " + key)
+            elif isinstance(cond, dict) and cond and all(op.startswith('$') for op in cond.keys()):
+                for op, arg in cond.items():
+                    mask &= state['columns'][key].match(op, arg)
+            elif isinstance(cond, (dict, list, tuple, re.Pattern)):
+                raise Unsupported("condition on " + key)
+            else:
+                mask &= state['columns'][key].match('$eq', cond)
+        return mask
+
+    def filter(self, query):
+        """ return list of ids, or list of raw documents in documents mode, matching query """
+        state = self.state
+        mask = self.evaluate(query, state)
+        if self.documents:
+            return [ doc for doc, matched in zip(state['docs'], mask) if matched ]
+        ids = state['columns']['_id'].values
+        return list(ids[mask])
+
+
+class ColumnarFilterBackend(MongoFilterBackend):
+    """ filters small, frequently read collections in memory
+
+    Keeps snapshot of fields filtered by filterset, per document class and filterset class,
+    and evaluates queries against it.
+    In documents mode returns list of documents without database queries,
+    otherwise filters queryset by matching ids.
+    Documents mode is used only if this is the last of view filter_backends (so that following backends, like OrderingFilter, get queryset)
+    and queryset has no projection (only, exclude, scalar, as_pymongo) or hint, otherwise matching ids are used.
+    Queries not supported by snapshot, and querysets with ordering, skip, limit or collation, are run in database.
+
+    class attrs:
+    - columnar_ttl: max age of snapshot in seconds
+    - columnar_documents: keep and return whole documents
+    """
+    columnar_ttl = 60
+    columnar_documents = True
+
+    # filterset classes, weakly referenced, to their snapshots
+    snapshots = weakref.WeakKeyDictionary()
+    _snapshots_lock = threading.Lock()
+
+    def get_snapshot(self, document, filter_class):
+        key = (document, self.columnar_ttl, self.columnar_documents)
+        snapshot = self.snapshots.get(filter_class, {}).get(key, None)
+        if snapshot is None:
+            with self._snapshots_lock:
+                class_snapshots = self.snapshots.setdefault(filter_class, {})
+                snapshot = class_snapshots.get(key, None)
+                if snapshot is None:
+                    fields = ['_cls'] if document._meta.get('allow_inheritance') else []
+                    for flt in filter_class.compile().values():
+                        targets = flt.target if isinstance(flt.target, (tuple, list)) else (flt.target,)
+                        for target in targets:
+                            attr = target.replace('.', '__').split('__')[0]
+                            if attr in document._fields:
+                                fields.append(document._fields[attr].db_field)
+                    snapshot = class_snapshots[key] = ColumnarSnapshot(document, fields, self.columnar_ttl, self.columnar_documents)
+        return snapshot
+
+    def filter_queryset(self, request, queryset, view):
+        filtered = super().filter_queryset(request, queryset, view)
+        filter_class = getattr(view, 'filter_class', None)
+        if filter_class is None:
+            return filtered
+
+        document = filtered._document
+        if (filtered._ordering or filtered._skip or filtered._limit is not None or getattr(filtered, '_none', False)
+                or document._meta.get('ordering') or filtered._where_clause or filtered._collation):
+            return filtered
+
+        try:
+            result = self.get_snapshot(document, filter_class).filter(filtered._query)
+        except Unsupported:
+            return filtered
+
+        if not self.columnar_documents:
+            return queryset.filter(pk__in=result)
+        if (not self.is_last_backend(view) or filtered._hint != -1
+                or filtered._loaded_fields or filtered._scalar or filtered._as_pymongo):
+            return queryset.filter(pk__in=[ son['_id'] for son in result ])
+        documents = [ document._from_son(son, _auto_dereference=filtered._auto_dereference) for son in result ]
+        return self.prefetch(documents, getattr(view, 'filterset', None))
@@ -0,0 +1,45 @@
+from bson import json_util
+
+from .cache import TTLCache
+
+
+class CountingMixin():
+    """ counting of filtered querysets, for BaseFilterset
+
+    class attrs:
+    - count_ttl: seconds to cache counts, 0 (default) to disable, as cached counts miss changes made meanwhile
+    """
+    count_ttl = 0
+    count_cache = TTLCache(maxsize=1024)
+
+    @classmethod
+    def count_queryset(cls, queryset, limit=None):
+        """
+        count documents in filtered queryset
+
+        Unfiltered collections are counted with estimated count from metadata.
+        With limit, counts no more than limit+1 documents, greater result means 'more than limit'.
+        With count_ttl set, counts are cached by fingerprint and hint of queryset for count_ttl seconds.
+        """
+        key = (cls.fingerprint(queryset), json_util.dumps(queryset._hint), limit)
+        if cls.count_ttl:
+            count = cls.count_cache.get(key, None)
+            if count is not None:
+                return count
+
+        collection = queryset._collection
+        if not queryset._query and not getattr(queryset, '_none', False):
+            if hasattr(collection, 'estimated_document_count'):
+                count = collection.estimated_document_count()
+            else:
+                count = collection.count()
+            if limit is not None:
+                count = min(count, limit + 1)
+        elif limit is not None:
+            count = queryset.limit(limit + 1).count(with_limit_and_skip=True)
+        else:
+            count = queryset.count()
+
+        if cls.count_ttl:
+            cls.count_cache.set(key, count, ttl=cls.count_ttl)
+        return count
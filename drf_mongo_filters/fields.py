@@ -1,17 +1,29 @@
 import re
+import uuid
+from datetime import date, datetime, time, timedelta
 from bson import ObjectId
 from bson.dbref import DBRef
 from bson.errors import InvalidId
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.utils.encoding import smart_str
 from django.utils.datastructures import MultiValueDict
-from rest_framework import fields
+from rest_framework import fields, ISO_8601
 from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
+
+EARTH_RADIUS = 6378100.0 # meters, as used by mongodb
 
 
 class DateTime000Field(fields.DateTimeField):
     """ discards microseconds """
     def to_internal_value(self, value):
         value = super().to_internal_value(value)
+        return self.discard_microseconds(value)
+
+    @staticmethod
+    def discard_microseconds(value):
         return value.replace(microsecond=value.microsecond//1000*1000)
 
 
@@ -121,3 +133,230 @@ class GeoPointField(DictField):
     def to_internal_value(self, data):
         value = super().to_internal_value(data)
         return { 'type': 'Point', 'coordinates': [ value['lng'], value['lat'] ] }
+
+def localize_datetime(value):
+    """ make naive datetime aware in current timezone, if timezones are used """
+    if settings.USE_TZ and timezone.is_naive(value):
+        return timezone.make_aware(value, timezone.get_current_timezone())
+    return value
+
+class DateRangeField(DictField):
+    """ range of datetimes, absolute or relative to current time
+    parses ?foo=today, ?foo=yesterday, ?foo=2015-01-02, ?foo.last=7d, ?foo.min=2015-01-01&foo.max=2015-02-01
+    to { 'min': datetime, 'max': datetime } for half-open interval [min, max).
+    Dates in max include whole day.
+    Relative values are calculated from current time truncated to bucket (minute, hour or day),
+    so that repeated requests produce identical queries.
+    """
+    valid_keys = ('on', 'last', 'min', 'max')
+    buckets = ('minute', 'hour', 'day')
+    units = { 'm': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks' }
+    period_regex = re.compile(r"^(\d+)([mhdw])$")
+
+    def __init__(self, bucket='minute', **kwargs):
+        if bucket not in self.buckets:
+            raise TypeError("invalid bucket: " + repr(bucket))
+        self.bucket = bucket
+        kwargs['child'] = fields.CharField()
+        super().__init__(**kwargs)
+
+    def get_value(self, data):
+        ret = super().get_value(data)
+        if isinstance(data, MultiValueDict):
+            named = data.get(self.field_name, '')
+            if named != '':
+                ret = dict(ret, on=named) if ret is not fields.empty else { 'on': named }
+        return ret
+
+    def now(self):
+        now = timezone.now()
+        if timezone.is_aware(now):
+            now = timezone.localtime(now)
+        if self.bucket == 'day':
+            return now.replace(hour=0, minute=0, second=0, microsecond=0)
+        if self.bucket == 'hour':
+            return now.replace(minute=0, second=0, microsecond=0)
+        return now.replace(second=0, microsecond=0)
+
+    def parse_day(self, value):
+        if value == 'today':
+            return self.now().date()
+        if value == 'yesterday':
+            return self.now().date() - timedelta(days=1)
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise ValidationError("invalid date: " + repr(value))
+        return day
+
+    def start_of(self, day):
+        return localize_datetime(datetime.combine(day, time()))
+
+    def parse_bound(self, value, is_max):
+        try:
+            day = self.parse_day(value)
+        except ValidationError:
+            day = None
+        if day is not None:
+            return self.start_of(day + timedelta(days=1) if is_max else day)
+        try:
+            parsed = parse_datetime(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValidationError("invalid date or datetime: " + repr(value))
+        return localize_datetime(parsed)
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = { 'on': data }
+        value = super().to_internal_value(data)
+
+        mins, maxs = [], []
+        if 'on' in value:
+            day = self.parse_day(value['on'])
+            mins.append(self.start_of(day))
+            maxs.append(self.start_of(day + timedelta(days=1)))
+        if 'last' in value:
+            match = self.period_regex.match(value['last'])
+            if not match:
+                raise ValidationError("invalid period: " + repr(value['last']))
+            count, unit = match.groups()
+            mins.append(self.now() - timedelta(**{ self.units[unit]: int(count) }))
+        if 'min' in value:
+            mins.append(self.parse_bound(value['min'], False))
+        if 'max' in value:
+            maxs.append(self.parse_bound(value['max'], True))
+
+        ret = {}
+        if mins:
+            ret['min'] = max(mins)
+        if maxs:
+            ret['max'] = min(maxs)
+        return ret
+
+class GeoNearField(GeoPointField):
+    """ geo coordinates with optional max distance """
+    valid_keys = ('lng', 'lat', 'max_distance')
+
+    def to_internal_value(self, data):
+        value = DictField.to_internal_value(self, data)
+        point = { 'type': 'Point', 'coordinates': [ value['lng'], value['lat'] ] }
+        return { 'point': point, 'max_distance': value.get('max_distance', None) }
+
+class GeoCircleField(DictField):
+    """ circle on sphere with center and radius in meters, as in ?foo.lng=1&foo.lat=2&foo.radius=3
+    converts to [ [lng, lat], radians ]
+    """
+    valid_keys = ('lng', 'lat', 'radius')
+    required_keys = ('lng', 'lat', 'radius')
+
+    def __init__(self, **kwargs):
+        kwargs['child'] = fields.FloatField()
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        if value['radius'] < 0:
+            raise ValidationError("negative radius: " + str(value['radius']))
+        return [ [ value['lng'], value['lat'] ], value['radius'] / EARTH_RADIUS ]
+
+class GeoBoxField(DictField):
+    """ box with bounds given in degrees, as in ?foo.west=1&foo.south=2&foo.east=3&foo.north=4
+    converts to GeoJSON Polygon
+    """
+    valid_keys = ('west', 'south', 'east', 'north')
+    required_keys = ('west', 'south', 'east', 'north')
+
+    def __init__(self, **kwargs):
+        kwargs['child'] = fields.FloatField()
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        west, south, east, north = value['west'], value['south'], value['east'], value['north']
+        if south >= north or west >= east:
+            raise ValidationError("empty box: " + str(value))
+        ring = [ [west, south], [east, south], [east, north], [west, north], [west, south] ]
+        return { 'type': 'Polygon', 'coordinates': [ ring ] }
+
+class GeoCoordsField(fields.Field):
+    """ parses 'lng,lat' to [lng, lat] """
+    def to_internal_value(self, data):
+        try:
+            lng, lat = [ float(val) for val in smart_str(data).split(',') ]
+        except ValueError:
+            raise ValidationError("invalid coordinates: " + repr(data))
+        return [ lng, lat ]
+
+class GeoPolygonField(DictField):
+    """ polygon with numbered vertices, as in ?foo.0=1,2&foo.1=3,4&foo.2=5,6
+    converts to GeoJSON Polygon
+    """
+    def __init__(self, **kwargs):
+        kwargs['child'] = GeoCoordsField()
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        try:
+            keys = sorted(value.keys(), key=int)
+        except ValueError:
+            raise ValidationError("invalid keys in dict: " + str(set(value.keys())))
+        ring = [ value[key] for key in keys ]
+        if len(ring) < 3:
+            raise ValidationError("polygon needs at least 3 vertices")
+        if ring[0] != ring[-1]:
+            ring.append(ring[0])
+        return { 'type': 'Polygon', 'coordinates': [ ring ] }
+
+
+# fast parsers
+# Parse common values of primitive fields directly, bypassing machinery of serializer fields.
+# Raise ValueError or TypeError for anything unusual, to let the field itself parse the value or report error.
+
+def parse_integer(field, data):
+    if type(data) is int:
+        return data
+    if type(data) is not str or len(data) > field.MAX_STRING_LENGTH:
+        raise TypeError(data)
+    return int(data)
+
+def parse_float(field, data):
+    if type(data) not in (str, int, float) or (type(data) is str and len(data) > field.MAX_STRING_LENGTH):
+        raise TypeError(data)
+    return float(data)
+
+def parse_uuid(field, data):
+    if type(data) is not str:
+        raise TypeError(data)
+    return uuid.UUID(hex=data)
+
+def parse_objectid(field, data):
+    try:
+        return ObjectId(data)
+    except InvalidId as e:
+        raise ValueError(e)
+
+def parse_datetime_iso(field, data):
+    input_formats = getattr(field, 'input_formats', api_settings.DATETIME_INPUT_FORMATS)
+    if type(data) is not str or not input_formats or input_formats[0].lower() != ISO_8601:
+        raise TypeError(data)
+    value = parse_datetime(data)
+    if value is None:
+        raise ValueError(data)
+    return field.enforce_timezone(value)
+
+def parse_datetime000(field, data):
+    return field.discard_microseconds(parse_datetime_iso(field, data))
+
+FAST_PARSERS = {
+    fields.IntegerField: parse_integer,
+    fields.FloatField: parse_float,
+    fields.UUIDField: parse_uuid,
+    fields.DateTimeField: parse_datetime_iso,
+    DateTime000Field: parse_datetime000,
+    ObjectIdField: parse_objectid,
+}
@@ -1,7 +1,17 @@
+import re
+from datetime import datetime, time, timedelta
+from mongoengine.errors import LookUpError
 from mongoengine.queryset import transform, Q
 from rest_framework import fields
+from rest_framework.exceptions import ValidationError
 
-from .fields import  DateTime000Field, ListField, RangeField, GeoPointField,  ObjectIdField
+from . import queries
+from .cache import TTLCache
+from .fields import  DateTime000Field, ListField, DictField, RangeField, DateRangeField, ObjectIdField
+from .fields import localize_datetime
+from .fields import GeoNearField, GeoCircleField, GeoBoxField, GeoPolygonField
+from .fields import FAST_PARSERS
+from .versions import versions
 
 COMPARISION_OPERATORS = ('ne', 'gt', 'gte', 'lt', 'lte')
 
@@ -11,6 +21,7 @@ class Filter():
     Binding name (name of filterset attribute) is used as key in query_params.
     Source of field (defaults to binding name) is used as model attribute to filter.
     Defined in class or provided lookup is used as operator to use for mathing. None (default) is to do not use operator.
+    Values for common primitive fields are parsed with fast parsers, unless field is customized with kwargs.
 
     class attrs:
     - field_class: class of serializer field
@@ -42,6 +53,10 @@ class Filter():
         self.parent = None
         self.field = self.make_field(**kwargs)
 
+        self.fast_parser = None
+        if set(kwargs.keys()) <= set(['source']):
+            self.fast_parser = FAST_PARSERS.get(self.field.__class__, None)
+
         self._creation_order = Filter._creation_counter
         Filter._creation_counter += 1
 
@@ -73,6 +88,11 @@ class Filter():
         value = self.field.get_value(querydict)
         if value in (None, fields.empty, ''):
             return None
+        if self.fast_parser is not None:
+            try:
+                return self.fast_parser(self.field, value)
+            except (TypeError, ValueError):
+                pass
         return self.field.to_internal_value(value)
 
     def filter_params(self, value):
@@ -85,6 +105,14 @@ class Filter():
             key += '__' + self.lookup_type
         return { key: value }
 
+    def filter_stages(self, value):
+        """ return aggregation stages
+
+        for conditions which cannot be expressed as filtering params.
+        Used by Filterset.filter_pipeline instead of filter_params when not empty.
+        """
+        return []
+
     def __repr__(self):
         return "%s(name='%s',lookup='%s')" % (self.__class__.__qualname__, self.name, self.lookup_type)
 
@@ -115,6 +143,17 @@ class FloatFilter(Filter):
 class DateTimeFilter(Filter):
     field_class = DateTime000Field
 
+class DateFilter(Filter):
+    " parses date, filters datetimes with gte/lt to match whole day "
+    VALID_LOOKUPS = (None,)
+    field_class = fields.DateField
+
+    def filter_params(self, value):
+        if value is None:
+            return {}
+        start = localize_datetime(datetime.combine(value, time()))
+        return { self.target + '__gte': start, self.target + '__lt': start + timedelta(days=1) }
+
 
 class ObjectIdFilter(Filter):
     field_class = ObjectIdField
@@ -130,6 +169,219 @@ class ReferenceFilter(ObjectIdFilter):
         target = ".".join(self.field.source_attrs)
         return { '__raw__': { target + ".$id": value } }
 
+class ReferenceAttrFilter(ReferenceFilter):
+    """ filters by attributes of referenced documents
+    takes foo.bar=1&foo.baz=2, finds ids of referenced documents matching bar=1,baz=2
+    and filters with foo__in=[ids]
+
+    Only keys listed in valid_keys are accepted, so that clients cannot query other fields of referenced documents.
+    Ids are resolved with single query, and cached by fingerprint of it (covering database, condition and collation)
+    for cache_ttl seconds, if set.
+    If more than max_ids documents match, filtering queryset fails with ValidationError;
+    only Filterset.filter_pipeline falls back to $lookup stage instead.
+    $lookup expects references stored as ObjectId (mongoengine default, dbref=False).
+    """
+    VALID_LOOKUPS = (None,)
+    VALID_KEY_LOOKUPS = COMPARISION_OPERATORS + transform.STRING_OPERATORS
+    field_class = DictField
+
+    max_ids = 1000
+    cache_ttl = 0
+    cache = TTLCache(maxsize=1024)
+
+    def __init__(self, document, lookup=None, name=None, max_ids=None, cache_ttl=None, valid_keys=None, **kwargs):
+        """
+        Args:
+        - document: referenced document class
+        - valid_keys: allowed conditions, as field names of referenced document, optionally with lookup, like ('name', 'rank__gte')
+        - max_ids: max number of ids to pass in $in
+        - cache_ttl: seconds to cache resolved ids, 0 (default) to disable caching, as cached ids miss changes made meanwhile
+        - kwargs: args to pass to DictField, like child
+        """
+        self.document = document
+        if not valid_keys:
+            raise TypeError("%s expects valid_keys" % (self.__class__.__qualname__,))
+        for key in valid_keys:
+            self.check_key(key)
+        if max_ids is not None:
+            self.max_ids = max_ids
+        if cache_ttl is not None:
+            self.cache_ttl = cache_ttl
+        super().__init__(lookup=lookup, name=name, valid_keys=valid_keys, **kwargs)
+
+    def check_key(self, key):
+        """ raise TypeError if key is not a field of referenced document with optional valid lookup """
+        parts = key.split('__')
+        if parts[-1] in transform.MATCH_OPERATORS and len(parts) > 1:
+            if parts.pop() not in self.VALID_KEY_LOOKUPS:
+                raise TypeError("invalid lookup of key: " + key)
+        try:
+            self.document._lookup_field(parts)
+        except LookUpError:
+            raise TypeError("key is not a field of %s: %s" % (self.document.__qualname__, key))
+
+    def resolve_ids(self, value):
+        """ return list of ids of referenced documents matching value, or None if there are too many """
+        queryset = self.document.objects.filter(**value)
+        key = (queries.fingerprint(queryset), self.max_ids)
+        if self.cache_ttl:
+            ids = self.cache.get(key, fields.empty)
+            if ids is not fields.empty:
+                return ids
+
+        ids = list(queryset.limit(self.max_ids + 1).scalar('id'))
+        if len(ids) > self.max_ids:
+            ids = None
+
+        if self.cache_ttl:
+            self.cache.set(key, ids, ttl=self.cache_ttl)
+        return ids
+
+    def filter_params(self, value):
+        if value is None:
+            return {}
+        ids = self.resolve_ids(value)
+        if ids is None:
+            raise ValidationError("too many referenced documents match: " + repr(value))
+        return { self.target + '__in': ids }
+
+    def filter_stages(self, value):
+        if value is None or self.resolve_ids(value) is not None:
+            return []
+        target = ".".join(self.field.source_attrs)
+        joined = "_" + "_".join(self.field.source_attrs) + "_ref"
+        condition = transform.query(self.document, **value)
+        return [
+            { '$lookup': {
+                'from': self.document._get_collection_name(),
+                'localField': target,
+                'foreignField': '_id',
+                'as': joined } },
+            { '$match': dict([ (joined + "." + key, cond) for key, cond in condition.items() ]) },
+            { '$project': { joined: 0 } }
+        ]
+
+class EmbeddedFilter(Filter):
+    """ filters by fields of embedded document
+    takes foo.bar=1&foo.baz=2, parses each value with corresponding subfilter
+    and filters with foo__bar=1,foo__baz=2
+
+    Subfilters should have sources relative to embedded document.
+    """
+    VALID_LOOKUPS = (None,)
+
+    def __init__(self, subfilters, lookup=None, name=None, **kwargs):
+        """
+        Args:
+        - subfilters: mapping of names to filters for fields of embedded document
+        """
+        self.subfilters = subfilters
+        super().__init__(lookup=lookup, name=name, **kwargs)
+
+    def bind(self, name, filterset):
+        super().bind(name, filterset)
+        for subname, flt in self.subfilters.items():
+            flt.bind(self.field.field_name + "." + subname, filterset)
+
+    def parse_value(self, querydict):
+        values = {}
+        for subname, flt in self.subfilters.items():
+            val = flt.parse_value(querydict)
+            if val is not None:
+                values[subname] = val
+        return values or None
+
+    def subfilter_params(self, value):
+        """ merge filtering params of subfilters, relative to embedded document """
+        params = {}
+        for subname, val in value.items():
+            flt_params = self.subfilters[subname].filter_params(val)
+            if not isinstance(flt_params, dict):
+                raise TypeError("%s expects subfilters to return dict params: %s" % (self.__class__.__qualname__, repr(self.subfilters[subname])))
+            for key, val in flt_params.items():
+                if key == '__raw__':
+                    params.setdefault('__raw__', {}).update(val)
+                else:
+                    params[key] = val
+        return params
+
+    def filter_params(self, value):
+        if value is None:
+            return {}
+        params = {}
+        for key, val in self.subfilter_params(value).items():
+            if key == '__raw__':
+                prefix = ".".join(self.field.source_attrs) + "."
+                params['__raw__'] = dict([ (prefix + k, v) for k, v in val.items() ])
+            else:
+                params[self.target + "__" + key] = val
+        return params
+
+class ElemMatchFilter(EmbeddedFilter):
+    """ filters by fields of embedded documents in list
+    takes foo.bar=1&foo.baz=2, and filters with foo__match={bar: 1, baz: 2},
+    so that all conditions match the same element of list
+
+    If some of subfilters give raw params, all conditions are compiled to raw $elemMatch.
+    """
+    def __init__(self, subfilters, lookup=None, name=None, document=None, **kwargs):
+        """
+        Args:
+        - subfilters: mapping of names to filters for fields of embedded document
+        - document: embedded document class, to compile conditions with raw params, field names are used as is without it
+        """
+        self.document = document
+        super().__init__(subfilters, lookup=lookup, name=name, **kwargs)
+
+    def filter_params(self, value):
+        if value is None:
+            return {}
+        params = self.subfilter_params(value)
+        if '__raw__' not in params:
+            return { self.target + "__match": params }
+        target = ".".join(self.field.source_attrs)
+        return { '__raw__': { target: { '$elemMatch': transform.query(self.document, **params) } } }
+
+class MapFilter(Filter):
+    """ filters by values under keys of MapField or DictField
+    takes foo.bar=1&foo.baz=2 and filters with foo.bar=1,foo.baz=2, with lookup (if given) applied to each key
+
+    Keys are validated against allow-list of valid_keys, or, without it, should be plain names (letters, digits, '_', '-'),
+    so that they cannot reach nested fields or operators.
+    Conditions on dynamic keys are best served by wildcard index (foo.$**).
+    """
+    field_class = DictField
+    KEY_PATTERN = re.compile(r"^[\w-]+$")
+
+    def __init__(self, lookup=None, name=None, valid_keys=None, child=None, **kwargs):
+        """
+        Args:
+        - valid_keys: allowed keys
+        - child: serializer field to parse values, by default they are kept as strings
+        """
+        if valid_keys is not None:
+            kwargs['valid_keys'] = valid_keys
+        if child is not None:
+            kwargs['child'] = child
+        super().__init__(lookup=lookup, name=name, **kwargs)
+
+    def parse_value(self, querydict):
+        value = super().parse_value(querydict)
+        if value is not None and self.field.valid_keys is None:
+            invalid = [ key for key in value.keys() if not self.KEY_PATTERN.match(key) ]
+            if invalid:
+                raise ValidationError("invalid keys: " + ", ".join(sorted(invalid)))
+        return value
+
+    def filter_params(self, value):
+        if value is None:
+            return {}
+        target = ".".join(self.field.source_attrs)
+        conditions = {}
+        for key, val in value.items():
+            conditions[target + "." + key] = val if self.lookup_type is None else { '$' + self.lookup_type: val }
+        return { '__raw__': conditions }
+
 class ListFilter(Filter):
     " base filter to compare with list of values "
     VALID_LOOKUPS = ('in', 'nin', 'all')
@@ -179,16 +431,49 @@ class RangeFilter(Filter):
         return params
 
 
+class DateRangeFilter(Filter):
+    """ takes foo=today, foo.last=7d, foo.min&foo.max and compares with gte/lt
+    relative ranges are truncated to bucket ('minute', 'hour', 'day') to produce cacheable queries
+    """
+    VALID_LOOKUPS = (None,)
+    lookup_types = ('gte', 'lt')
+    field_class = DateRangeField
+
+    def filter_params(self, value):
+        if value is None:
+            return {}
+        params = {}
+        key = self.target + "__"
+        if 'min' in value:
+            params[key+self.lookup_types[0]] = value['min']
+        if 'max' in value:
+            params[key+self.lookup_types[1]] = value['max']
+        return params
+
+
 class IntersectRangeFilter(Filter):
     """ range intersection
     test for intersection of range given in query with range defined by pair of model attrs,
     specified in sources param
+
+    Open bounds of model ranges are null by default, making query of two $or clauses, that cannot use single index.
+    With sentinels given, open bounds are expected to be stored as the sentinel values (see fill_sentinels),
+    and query is plain two-sided range, served by single compound index on the pair of attrs.
     """
     lookup_types = ('gte', 'lte')
     field_class = RangeField
+    sentinels = None
 
-    def __init__(self, sources, name=None, **kwargs):
+    def __init__(self, sources, name=None, sentinels=None, **kwargs):
+        """
+        Args:
+        - sources: pair of model attrs holding bounds of range
+        - sentinels: pair of values (lowest, highest) stored for open lower and upper bounds,
+          like (-2**63, 2**63-1) for IntField or (datetime.min, datetime.max) for DateTimeField
+        """
         self.sources=sources
+        if sentinels is not None:
+            self.sentinels = sentinels
         super().__init__(name=name, **kwargs)
 
     @property
@@ -202,16 +487,99 @@ class IntersectRangeFilter(Filter):
         val_min = value.get('min', None)
         val_max = value.get('max', None)
         attr_min, attr_max = self.target
+        if self.sentinels is not None:
+            params = {}
+            if val_max is not None:
+                params[attr_min+"__lte"] = val_max
+            if val_min is not None:
+                params[attr_max+"__gte"] = val_min
+            return params
         return (Q(**{attr_min:None})|Q(**{attr_min+"__lte": val_max}))&(Q(**{attr_max:None})|Q(**{attr_max+"__gte": val_min}))
 
+    def fill_sentinels(self, queryset):
+        """
+        migrate documents to sentinel mode, replacing null or missing bounds with sentinels
+
+        Runs update of all documents of queryset per bound, bypassing signals, and bumps change version of the document.
+        Returns number of updated documents per bound.
+        """
+        if self.sentinels is None:
+            raise TypeError("%s has no sentinels" % (self.__class__.__qualname__,))
+        counts = []
+        for attr, sentinel in zip(self.target, self.sentinels):
+            counts.append(queryset.filter(**{attr: None}).update(**{'set__'+attr: sentinel}))
+        versions.bump(queryset._document)
+        return tuple(counts)
+
+
+# filters of targets with ordered values, for range statistics
+RANGE_FILTERS = (RangeFilter, DateRangeFilter, DateTimeFilter, DateFilter, IntegerFilter, FloatFilter)
+
 
 class GeoFilter(Filter):
     VALID_LOOKUPS = transform.GEO_OPERATORS
 
 class GeoNearFilter(GeoFilter):
-    field_class = GeoPointField
+    """ takes foo.lng&foo.lat and optional foo.max_distance (meters)
+    filters with single $near with $maxDistance, results are sorted by distance
+
+    With distance_field given, Filterset.filter_pipeline compiles the filter into leading $geoNear stage,
+    which outputs calculated distance in that field and takes other conditions as its query.
+    """
+    field_class = GeoNearField
     lookup_type = 'near'
+    distance_field = None
+
+    def __init__(self, lookup=None, name=None, distance_field=None, **kwargs):
+        """
+        Args:
+        - distance_field: output field for distance in pipeline
+        """
+        if distance_field is not None:
+            self.distance_field = distance_field
+        super().__init__(lookup=lookup, name=name, **kwargs)
+
+    def filter_params(self, value):
+        if value is None:
+            return {}
+        params = { self.target + '__near': value['point'] }
+        if value['max_distance'] is not None:
+            params[self.target + '__max_distance'] = value['max_distance']
+        return params
+
+    def filter_stages(self, value):
+        if value is None or self.distance_field is None:
+            return []
+        stage = {
+            'near': value['point'],
+            'distanceField': self.distance_field,
+            'key': ".".join(self.field.source_attrs),
+            'spherical': True
+        }
+        if value['max_distance'] is not None:
+            stage['maxDistance'] = value['max_distance']
+        return [ { '$geoNear': stage } ]
 
 class GeoDistanceFilter(GeoFilter):
+    """ parses float and filters with max_distance
+    only valid together with GeoNearFilter on the same target, use foo.max_distance of GeoNearFilter instead
+    """
     field_class = fields.FloatField
     lookup_type = 'max_distance'
+
+class GeoWithinCircleFilter(GeoFilter):
+    """ takes foo.lng&foo.lat&foo.radius (meters) and filters with $geoWithin $centerSphere
+    unlike near, does not sort, so can be counted and combined with other sorting
+    """
+    field_class = GeoCircleField
+    lookup_type = 'geo_within_sphere'
+
+class GeoWithinBoxFilter(GeoFilter):
+    """ takes foo.west&foo.south&foo.east&foo.north and filters with $geoWithin box polygon """
+    field_class = GeoBoxField
+    lookup_type = 'geo_within'
+
+class GeoWithinPolygonFilter(GeoFilter):
+    """ takes foo.0=lng,lat&foo.1=lng,lat&... and filters with $geoWithin polygon """
+    field_class = GeoPolygonField
+    lookup_type = 'geo_within'
@@ -1,14 +1,28 @@
 import copy
+import re
 from collections import OrderedDict
+from bson import Regex
+from django.utils.datastructures import MultiValueDict
 from mongoengine import fields as mongo_fields
-from mongoengine.queryset.visitor import QNode
+from mongoengine.base import BaseDocument
+from mongoengine.errors import LookUpError
+from mongoengine.queryset import transform
+from mongoengine.queryset.visitor import Q, QNode
+from rest_framework.exceptions import PermissionDenied, ValidationError
 
 from . import filters
+from . import queries
+from .batching import BatchMixin
+from .counting import CountingMixin
+from .prefetching import PrefetchMixin
+from .registry import registry
+from .sampling import SamplingMixin
+from .stats import StatsMixin
 
 
 class FiltersetMeta(type):
     """
-    Sets _declared_filters
+    Sets _declared_filters, registers class in registry
     """
     @classmethod
     def _get_declared_filters(cls, bases, attrs):
@@ -25,19 +39,136 @@ class FiltersetMeta(type):
 
     def __new__(cls, name, bases, attrs):
         attrs['_declared_filters'] = cls._get_declared_filters(bases, attrs)
-        return super(FiltersetMeta, cls).__new__(cls, name, bases, attrs)
+        new_class = super(FiltersetMeta, cls).__new__(cls, name, bases, attrs)
+        registry.register(new_class)
+        return new_class
 
 
-class BaseFilterset(metaclass=FiltersetMeta):
-    def __init__(self, query=None):
+def param_head(key):
+    """ part of param name before first dot """
+    return key.split('.', 1)[0]
+
+def iter_params(query):
+    """ iterate over (key, value) pairs of query, including all values of multivalued keys """
+    if isinstance(query, MultiValueDict):
+        for key, values in query.lists():
+            for value in values:
+                yield key, value
+    else:
+        for key, value in query.items():
+            yield key, value
+
+
+class BaseFilterset(CountingMixin, SamplingMixin, PrefetchMixin, StatsMixin, BatchMixin, metaclass=FiltersetMeta):
+    """
+    Params with negation_suffix (foo!=1) negate conditions of filters,
+    params with or_prefix and group name (or.g.foo=1&or.g.bar=2) match any of conditions in the group.
+    Each of them is parsed separately, so only filters reading single param can be used.
+    Counting, sampling, prefetching, statistics and batching come from mixins, with their own class attrs.
+
+    class attrs:
+    - shared_filters: copy filters compiled once per class to instances instead of building them for each,
+      for get_filters not depending on query or request
+    - targeted_in_limit: max number of values of $in condition on shard key to consider query targeted
+    - negation_suffix: suffix of params to negate
+    - or_prefix: prefix of params of or-groups
+    - simplify_queries: merge conditions of filtered querysets and detect ones that cannot match
+
+    class Meta attrs:
+    - scope: mapping of model fields to request attributes (dotted path, like 'user.tenant_id')
+      or to callables taking request, giving values to always filter by
+    """
+    shared_filters = False
+    targeted_in_limit = 10
+    negation_suffix = '!'
+    or_prefix = 'or.'
+    simplify_queries = True
+
+    def __init__(self, query=None, request=None, scope=None):
+        """
+        Args:
+        - query: QueryDict or dict containing filtering params
+        - request: request to get scope values from
+        - scope: explicit scope values, instead of taken from request
+        """
         self.query = query if query else {}
+        self.request = request
+        if scope is not None:
+            self._scope = scope
+
+    @classmethod
+    def for_request(cls, query, request):
+        """ construct filterset for request
+
+        request is set after construction, so that subclasses overriding __init__(self, query) keep working
+        """
+        filterset = cls(query)
+        filterset.request = request
+        return filterset
+
+    @classmethod
+    def is_abstract(cls):
+        """ if the class is not to be compiled or used """
+        return not hasattr(cls, 'get_filters')
+
+    @classmethod
+    def compile(cls):
+        """
+        build, bind and validate filters
+
+        Done once per class, on a filterset without query and request, to check configuration at startup.
+        With shared_filters, compiled filters are copied to instances instead of building them for each.
+        """
+        if '_compiled_filters' not in cls.__dict__:
+            compiled = cls().build_filters()
+            cls.validate_filters(compiled)
+            cls._param_dispatch = cls.dispatch_filters(compiled)
+            cls._compiled_filters = compiled
+        return cls._compiled_filters
+
+    def build_filters(self):
+        """ get filters and bind them to this filterset """
+        filters = self.get_filters()
+        for name, flt in filters.items():
+            flt.bind(name, self)
+        return filters
+
+    @staticmethod
+    def dispatch_filters(filters):
+        """
+        mapping of params to names of filters reading them
+
+        filters read params named as their binding name, or prefixed with it (like foo.min),
+        so params are mapped by part before first dot
+        """
+        dispatch = {}
+        for name, flt in filters.items():
+            dispatch.setdefault(param_head(flt.field.field_name), []).append(name)
+        return dispatch
+
+    @property
+    def dispatch(self):
+        """ mapping of params to names of filters of this filterset reading them """
+        if not hasattr(self, '_dispatch'):
+            if self.shared_filters:
+                self.compile()
+                self._dispatch = self._param_dispatch
+            else:
+                self._dispatch = self.dispatch_filters(self.filters)
+        return self._dispatch
+
+    @classmethod
+    def validate_filters(cls, filters):
+        """ check compiled filters, raise TypeError for invalid """
+        pass
 
     @property
     def filters(self):
         if not hasattr(self, '_filters'):
-            self._filters = self.get_filters()
-            for name, flt in self._filters.items():
-                flt.bind(name, self)
+            if self.shared_filters:
+                self._filters = copy.deepcopy(self.compile())
+            else:
+                self._filters = self.build_filters()
         return self._filters
 
     @property
@@ -46,34 +177,270 @@ class BaseFilterset(metaclass=FiltersetMeta):
             self._values = self.parse_values(self.query)
         return self._values
 
+    @property
+    def scope(self):
+        if not hasattr(self, '_scope'):
+            self._scope = self.get_scope()
+        return self._scope
+
+    def get_scope(self):
+        """
+        resolve values of scope declared in Meta from request
+
+        raises PermissionDenied if any is missing
+        """
+        declared = getattr(getattr(self, 'Meta', None), 'scope', None)
+        if not declared:
+            return {}
+        values = {}
+        for field, getter in declared.items():
+            value = None
+            if self.request is not None:
+                if callable(getter):
+                    value = getter(self.request)
+                else:
+                    value = self.request
+                    for attr in getter.split('.'):
+                        value = getattr(value, attr, None)
+            if value is None:
+                raise PermissionDenied("query scope is not defined: " + field)
+            values[field] = value
+        return values
+
+    def positive_query(self, query):
+        """ query without negated and or-group params, which are parsed separately by logical_query """
+        def positive(key):
+            return not key.endswith(self.negation_suffix) and not key.startswith(self.or_prefix)
+        if all(positive(key) for key in query.keys()):
+            return query
+        if isinstance(query, MultiValueDict):
+            return MultiValueDict(dict([ (key, query.getlist(key)) for key in query.keys() if positive(key) ]))
+        return dict([ (key, value) for key, value in query.items() if positive(key) ])
+
     def parse_values(self, query):
         """
         extract values from query
+
+        only filters reading params present in query are parsed,
+        negated and or-group params are left for logical_query
         """
+        query = self.positive_query(query)
         values = {}
-        for name, filt in self.filters.items():
-            val = filt.parse_value(query)
-            if val is None:
-                continue
-            values[name] = val
+        dispatch = self.dispatch
+        for head in set(param_head(key) for key in query.keys()):
+            for name in dispatch.get(head, ()):
+                val = self.filters[name].parse_value(query)
+                if val is None:
+                    continue
+                values[name] = val
         return values
 
-    def filter_queryset(self, queryset):
+    def parse_param(self, key, value):
+        """
+        parse single param with the filter reading it
+
+        returns (name, value), or None for empty value
+        raises ValidationError if no filter reads the param
+        """
+        if value in (None, ''):
+            return None
+        if isinstance(self.query, MultiValueDict):
+            querydict = MultiValueDict({ key: [ value ] })
+        else:
+            querydict = { key: value }
+        for name in self.dispatch.get(param_head(key), ()):
+            val = self.filters[name].parse_value(querydict)
+            if val is not None:
+                return name, val
+        raise ValidationError({ key: "unknown filter parameter" })
+
+    def param_query(self, key, value, document, exclude=(), grouped=False):
+        """
+        raw query for single param, negated for key with negation_suffix, None for empty value or excluded filter
+
+        raises ValidationError for geo near conditions negated or in or-group (grouped)
+        """
+        original = key
+        negated = key.endswith(self.negation_suffix)
+        if negated:
+            key = key[:-len(self.negation_suffix)]
+        parsed = self.parse_param(key, value)
+        if parsed is None:
+            return None
+        name, val = parsed
+        if name in exclude:
+            return None
+        params = self.filters[name].filter_params(val)
+        if isinstance(params, QNode):
+            query = params.to_query(document)
+        else:
+            query = transform.query(document, **params)
+        if (negated or grouped) and queries.uses_operators(query, queries.GEO_NEAR):
+            raise ValidationError({ original: "geo near conditions cannot be negated or used in or-groups" })
+        if negated and query:
+            query = queries.negate(query)
+        return query
+
+    def logical_query(self, document, exclude=()):
+        """
+        compile negated params and or-groups to raw query
+
+        alternatives of equalities of a field are compiled to $in, negated equalities to $ne/$nin,
+        $or and $nor are used only for conditions of different fields
+        """
+        required = []
+        groups = OrderedDict()
+        for key, value in iter_params(self.query):
+            if key.startswith(self.or_prefix):
+                group, sep, param = key[len(self.or_prefix):].partition('.')
+                if not sep or not param:
+                    raise ValidationError({ key: "expected %s<group>.<param>" % self.or_prefix })
+                query = self.param_query(param, value, document, exclude, grouped=True)
+                if query is not None:
+                    groups.setdefault(group, []).append(query)
+            elif key.endswith(self.negation_suffix):
+                query = self.param_query(key, value, document, exclude)
+                if query is not None:
+                    required.append(query)
+        for alternatives in groups.values():
+            required.append(queries.any_of(alternatives))
+        return queries.all_of(required)
+
+    def apply_logical(self, queryset, exclude=()):
+        """ filter queryset by negated params and or-groups, except of excluded filters """
+        query = self.logical_query(queryset._document, exclude)
+        if not query:
+            return queryset
+        return queryset.filter(__raw__=query)
+
+    def simplify_queryset(self, queryset):
+        """
+        merge conditions of queryset
+
+        bounds of a field are merged into tightest interval, redundant conditions are removed.
+        Returns queryset.none() if conditions contradict, to skip database round trip.
+        Querysets with collation are returned unchanged, since it may make different strings equal.
+        """
+        if not self.simplify_queries or getattr(queryset, '_none', False) or queryset._collation:
+            return queryset
+        query = queryset._query_obj.to_query(queryset._document)
+        try:
+            simplified = queries.simplify(query, queryset._document)
+        except queries.Unsatisfiable:
+            return queryset.none()
+        if simplified == query:
+            return queryset
+        queryset = queryset.clone()
+        queryset._query_obj = Q(__raw__=simplified)
+        queryset._mongo_query = None
+        return queryset
+
+    @staticmethod
+    def apply_params(queryset, params):
+        if not params:
+            return queryset
+        if isinstance(params, dict):
+            queryset = queryset.filter(**params)
+        if isinstance(params, QNode):
+            queryset = queryset.filter(params)
+        return queryset
+
+    def filter_queryset(self, queryset, exclude=()):
         """
         convert values to filtering params and apply to queryset
+
+        Args:
+        - exclude: names of filters to skip
         """
+        queryset = self.apply_params(queryset, self.scope)
+        queryset = self.apply_logical(queryset, exclude)
         for name, filt in self.filters.items():
             val = self.values.get(name, None)
-            if name is None:
+            if name is None or name in exclude:
                 continue
-            params = filt.filter_params(val)
-            if not params:
-                continue
-            if isinstance(params, dict):
-                queryset = queryset.filter(**params)
-            if isinstance(params, QNode):
-                queryset = queryset.filter(params)
-        return queryset
+            queryset = self.apply_params(queryset, filt.filter_params(val))
+        return self.simplify_queryset(queryset)
+
+    def filter_pipeline(self, queryset):
+        """
+        convert values to aggregation pipeline
+
+        starts with $match of filtering params and query of queryset,
+        followed by stages of filters not expressible as params.
+        $geoNear stage, if any, is moved to the head and takes the query to match.
+        Returns list of stages, to run with queryset._collection.aggregate
+        """
+        queryset = self.apply_params(queryset, self.scope)
+        queryset = self.apply_logical(queryset)
+        stages = []
+        for name, filt in self.filters.items():
+            val = self.values.get(name, None)
+            flt_stages = filt.filter_stages(val)
+            if flt_stages:
+                stages.extend(flt_stages)
+            else:
+                queryset = self.apply_params(queryset, filt.filter_params(val))
+        query = queryset._query
+
+        for i, stage in enumerate(stages):
+            if '$geoNear' in stage:
+                stages.pop(i)
+                if query:
+                    stage['$geoNear']['query'] = query
+                return [ stage ] + stages
+
+        if query:
+            stages.insert(0, { '$match': query })
+        return stages
+
+    @classmethod
+    def is_targeted(cls, queryset):
+        """
+        if query of queryset can be routed to single shard, or to few of them
+
+        that is, has equality conditions for all fields of shard_key of the document:
+        scalar values, $eq of them, or $in lists of no more than targeted_in_limit of them.
+        Unsharded documents are always targeted.
+        """
+        document = queryset._document
+        shard_key = document._meta.get('shard_key', None)
+        if not shard_key:
+            return True
+
+        conditions = {}
+        def collect(query):
+            for key, cond in query.items():
+                if key == '$and':
+                    for sub in cond:
+                        collect(sub)
+                elif not key.startswith('$'):
+                    conditions.setdefault(key, []).append(cond)
+        collect(queryset._query)
+
+        def scalar(value):
+            return not isinstance(value, (dict, list, tuple, re.Pattern, Regex))
+
+        def equal(cond):
+            if not isinstance(cond, dict):
+                return scalar(cond)
+            if list(cond.keys()) == ['$eq']:
+                return scalar(cond['$eq'])
+            if list(cond.keys()) == ['$in']:
+                return 0 < len(cond['$in']) <= cls.targeted_in_limit and all(scalar(val) for val in cond['$in'])
+            return False
+
+        for name in shard_key:
+            db_name = document._translate_field_name(name)
+            if not any(equal(cond) for cond in conditions.get(db_name, [])):
+                return False
+        return True
+
+    @staticmethod
+    def fingerprint(queryset):
+        """
+        canonical hash of database, collection, query and collation of queryset
+        """
+        return queries.fingerprint(queryset)
 
 class Filterset(BaseFilterset):
     """ declarative queryset
@@ -90,9 +457,11 @@ class ModelFilterset(Filterset):
 
     class Meta attrs:
     - model: model to examine
-    - fields: model fields to scan
+    - fields: model fields to scan, or mapping of fields to lists of lookups,
+      creating filters named as field for 'exact' and field__lookup for others
     - exclude: model fields or inherited filters to exclude
     - kwargs: map of customized filter kwargs for each field
+    - strict: validate that all filters target existing fields of model
 
     class attr:
     - _filter_mapping: mapping field classes to filter classes
@@ -109,6 +478,7 @@ class ModelFilterset(Filterset):
 
         if fields is None:
             fields = model._fields_ordered
+        lookups = fields if isinstance(fields, dict) else {}
 
         docfilters = {} # unordered
         for name in set(declared_filters.keys()) | set(fields) | set(['id']):
@@ -116,11 +486,35 @@ class ModelFilterset(Filterset):
                 continue
             if name in declared_filters:
                 docfilters[name] = declared_filters[name]
+            elif name in lookups:
+                docfilters.update(self.filters_for_lookups(name, model._fields[name], lookups[name], fltargs.get(name,None)))
             else:
                 docfilters[name] = self.filter_for_field(name, model._fields[name], fltargs.get(name,None))
 
         return docfilters
 
+    @classmethod
+    def is_abstract(cls):
+        return not hasattr(getattr(cls, 'Meta', None), 'model')
+
+    @classmethod
+    def validate_filters(cls, filters):
+        """ check model, and with Meta.strict that targets of filters exist in model """
+        model = cls.Meta.model
+        if not (isinstance(model, type) and issubclass(model, BaseDocument)):
+            raise TypeError("%s expects Meta.model to be a document class: %s" % (cls.__qualname__, repr(model)))
+
+        if not getattr(cls.Meta, 'strict', False):
+            return
+
+        for name, flt in filters.items():
+            targets = flt.target if isinstance(flt.target, (tuple, list)) else (flt.target,)
+            for target in targets:
+                try:
+                    model._lookup_field(target.replace('.', '__').split('__'))
+                except LookUpError as e:
+                    raise TypeError("filter %s targets unknown field of %s: %s" % (name, model.__qualname__, e))
+
     default_filters_mapping = {
         mongo_fields.StringField: filters.CharFilter,
         mongo_fields.URLField: filters.CharFilter,
@@ -132,15 +526,15 @@ class ModelFilterset(Filterset):
         mongo_fields.BooleanField: filters.BooleanFilter,
         mongo_fields.DateTimeField: filters.DateTimeFilter,
         # mongo_fields.ComplexDateTimeField: filters.DateTimeFilter, #### its' a string!
-        # mongo_fields.EmbeddedDocumentField: filters.Filter,
+        mongo_fields.EmbeddedDocumentField: filters.EmbeddedFilter,
         mongo_fields.ObjectIdField: filters.ObjectIdFilter,
         mongo_fields.ReferenceField: filters.ReferenceFilter,
         # mongo_fields.GenericEmbeddedDocumentField: filters.Filter,
         # mongo_fields.DynamicField: filters.Filter,
         # mongo_fields.ListField: filters.Filter,
         # mongo_fields.SortedListField: filters.Filter,
-        # mongo_fields.DictField: filters.Filter,
-        # mongo_fields.MapField: filters.Filter,
+        mongo_fields.DictField: filters.MapFilter,
+        mongo_fields.MapField: filters.MapFilter,
         # mongo_fields.GenericReferenceField: filters.Filter,
         # mongo_fields.BinaryField: filters.Filter,
         # mongo_fields.GridFSError: filters.Filter,
@@ -160,6 +554,13 @@ class ModelFilterset(Filterset):
 
     filters_mapping = {}
 
+    lookup_filters_mapping = {
+        'in': filters.AnyFilter,
+        'nin': filters.NoneFilter,
+        'all': filters.AllFilter,
+        'exists': filters.ExistsFilter,
+    }
+
     @classmethod
     def find_flt_class(cls, field):
         mapping = {}
@@ -171,15 +572,73 @@ class ModelFilterset(Filterset):
                 return mapping[fld_cls]
 
     @classmethod
-    def filter_for_field(cls, name, field, args):
+    def filters_for_document(cls, document):
+        """ create filters for mapped fields of embedded document """
+        docfilters = OrderedDict()
+        for name in document._fields_ordered:
+            field = document._fields[name]
+            if name.startswith('_'):
+                continue
+            if isinstance(field, mongo_fields.ListField):
+                field = field.field
+            if cls.find_flt_class(field) is None:
+                continue
+            docfilters[name] = cls.filter_for_field(name, document._fields[name], { 'source': name })
+        return docfilters
+
+    @classmethod
+    def filters_for_lookups(cls, name, field, lookups, args):
+        """ create filters for field with each of lookups, named as field for 'exact' and field__lookup for others """
+        if args is None:
+            args = {}
+        docfilters = OrderedDict()
+        for lookup in lookups:
+            if lookup == 'exact':
+                docfilters[name] = cls.filter_for_field(name, field, args)
+                continue
+
+            flt_args = dict(args)
+            flt_args.setdefault('source', name)
+            flt_cls = cls.lookup_filters_mapping.get(lookup, None)
+            if flt_cls is None:
+                docfilters[name + '__' + lookup] = cls.filter_for_field(name, field, flt_args, lookup)
+                continue
+
+            if issubclass(flt_cls, filters.ListFilter) and 'child' not in flt_args:
+                # parse items as the filter for type of field would
+                item_field = field.field if isinstance(field, mongo_fields.ListField) else field
+                item_flt_cls = cls.find_flt_class(item_field)
+                if item_flt_cls is not None and not issubclass(item_flt_cls, (filters.EmbeddedFilter, filters.MapFilter)):
+                    flt_args['child'] = item_flt_cls.field_class()
+            docfilters[name + '__' + lookup] = flt_cls(**flt_args)
+        return docfilters
+
+    @classmethod
+    def filter_for_field(cls, name, field, args, lookup=None):
         if args is None:
             args = {}
 
-        if isinstance(field, mongo_fields.ListField):
+        is_list = isinstance(field, mongo_fields.ListField)
+        if is_list:
             field = field.field
 
         flt_cls = cls.find_flt_class(field)
 
+        if flt_cls is not None and issubclass(flt_cls, filters.MapFilter) and 'child' not in args:
+            # parse values as the filter for type of values would
+            val_flt_cls = cls.find_flt_class(field.field) if field.field is not None else None
+            if val_flt_cls is not None and not issubclass(val_flt_cls, (filters.EmbeddedFilter, filters.MapFilter)):
+                args = dict(args, child=val_flt_cls.field_class())
+
+        if flt_cls is not None and issubclass(flt_cls, filters.EmbeddedFilter):
+            if is_list and not issubclass(flt_cls, filters.ElemMatchFilter):
+                flt_cls = filters.ElemMatchFilter
+            args = dict(args)
+            if 'subfilters' not in args:
+                args['subfilters'] = cls.filters_for_document(field.document_type)
+            if issubclass(flt_cls, filters.ElemMatchFilter):
+                args.setdefault('document', field.document_type)
+
         assert flt_cls is not None, (
             'no filter mapping for %(fld_cls)s %(fld_name)s. please exclude the field, define filter, or adjust %(self_cls)s.filter_mapping' % {
                 'fld_cls': str(field.__class__),
@@ -188,4 +647,6 @@ class ModelFilterset(Filterset):
                 'self_cls': str(cls)
             })
 
+        if lookup is not None:
+            return flt_cls(lookup=lookup, **args)
         return flt_cls(**args)
@@ -0,0 +1,122 @@
+from bson import ObjectId, DBRef
+from django.http import QueryDict
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import GenericAPIView, ListAPIView
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .mixins import FilteredBulkUpdateMixin, FilteredBulkDestroyMixin, ConditionalListMixin
+
+
+class FilteredBulkAPIView(FilteredBulkUpdateMixin, FilteredBulkDestroyMixin, ListAPIView):
+    """ list documents matching filterset, update them with PATCH, delete with DELETE """
+    def patch(self, request, *args, **kwargs):
+        return self.bulk_update(request, *args, **kwargs)
+
+    def delete(self, request, *args, **kwargs):
+        return self.bulk_destroy(request, *args, **kwargs)
+
+
+class ConditionalListAPIView(ConditionalListMixin, ListAPIView):
+    """ list documents matching filterset, answering 304 to clients having current version """
+    pass
+
+
+class FilterValuesAPIView(GenericAPIView):
+    """ distinct values of target of a filter, to fill options of filter in UI
+
+    takes ?field=<filter name> along with filter params, and returns { 'values': [...], 'capped': bool }
+    with values found in documents matching all other active filters.
+    Uses view's filter_class and get_queryset, values are limited and cached by filterset.
+
+    class attrs:
+    - field_param: name of param specifying filter
+    """
+    field_param = 'field'
+
+    def to_representation(self, value):
+        if isinstance(value, DBRef):
+            value = value.id
+        if isinstance(value, ObjectId):
+            return str(value)
+        return value
+
+    def get(self, request, *args, **kwargs):
+        name = request.query_params.get(self.field_param, '')
+        if not name:
+            raise ValidationError({ self.field_param: ["filter name is required"] })
+        filterset = self.filter_class.for_request(request.query_params, request)
+        values, capped = filterset.distinct_values(self.get_queryset(), name)
+        return Response({ 'values': [ self.to_representation(value) for value in values ], 'capped': capped })
+
+
+class FilteredBatchAPIView(GenericAPIView):
+    """ several filtering queries of view's filter_class, evaluated in single aggregation
+
+    takes POST with mapping of query names to mappings of filter params (values or lists of values),
+    along with offset and limit params of page, and returns mapping of query names
+    to { 'count': N, 'results': [...] }, serialized with view's serializer,
+    or to { 'errors': ... } for queries with invalid params.
+
+    class attrs:
+    - batch_limit: max number of queries in batch
+    - limit_param, offset_param: names of page params
+    - default_limit, max_limit: page size if not given, and max of given ones
+    """
+    batch_limit = 10
+    limit_param = 'limit'
+    offset_param = 'offset'
+    default_limit = 10
+    max_limit = 100
+
+    def get_page(self, params):
+        """ pop offset and limit from params, raise ValidationError if invalid """
+        page = {}
+        for param, default in ((self.offset_param, 0), (self.limit_param, self.default_limit)):
+            value = params.pop(param, default)
+            try:
+                page[param] = int(value)
+            except (TypeError, ValueError):
+                raise ValidationError({ param: ["expected integer"] })
+        if page[self.offset_param] < 0:
+            raise ValidationError({ self.offset_param: ["expected non-negative integer"] })
+        if page[self.limit_param] < 1:
+            raise ValidationError({ self.limit_param: ["expected positive integer"] })
+        return page[self.offset_param], min(page[self.limit_param], self.max_limit)
+
+    def to_querydict(self, params):
+        querydict = QueryDict(mutable=True)
+        for key, value in params.items():
+            values = value if isinstance(value, (list, tuple)) else [ value ]
+            querydict.setlist(key, [ str(val) for val in values ])
+        return querydict
+
+    def post(self, request, *args, **kwargs):
+        if not isinstance(request.data, dict) or not request.data:
+            raise ValidationError({ api_settings.NON_FIELD_ERRORS_KEY: ["expected mapping of query names to params"] })
+        if len(request.data) > self.batch_limit:
+            raise ValidationError({ api_settings.NON_FIELD_ERRORS_KEY: [
+                "batch has %d queries, limit is %d" % (len(request.data), self.batch_limit) ] })
+
+        queries = {}
+        errors = {}
+        for name, params in request.data.items():
+            if not isinstance(params, dict):
+                errors[name] = { 'errors': { api_settings.NON_FIELD_ERRORS_KEY: ["expected mapping of params"] } }
+                continue
+            params = dict(params)
+            try:
+                offset, limit = self.get_page(params)
+            except ValidationError as e:
+                errors[name] = { 'errors': e.detail }
+                continue
+            queries[name] = (self.to_querydict(params), offset, limit)
+
+        results = self.filter_class.batch_queries(self.get_queryset(), queries, request=request) if queries else {}
+        data = {}
+        for name in request.data.keys():
+            result = errors.get(name, None) or results[name]
+            if 'results' in result:
+                result = { 'count': result['count'], 'results': self.get_serializer(result['results'], many=True).data }
+            data[name] = result
+        return Response(data)
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from drf_mongo_filters.monitoring import load_stats, document_indexes, dynamic_fields, index_covers, recommend_indexes, wildcard_prefix
+
+
+class Command(BaseCommand):
+    help = "Ranks query shapes exported by QueryStats, showing ones not covered by indexes, and recommends compound indexes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('dumps', nargs='+', help="json files exported by QueryStats")
+        parser.add_argument('--coverage', type=float, default=90, help="percent of traffic to cover by recommended indexes")
+        parser.add_argument('--live', action='store_true', default=False, help="use indexes existing in database instead of declared in meta, including wildcard indexes")
+
+    def handle(self, *args, **options):
+        try:
+            entries = load_stats(options['dumps'])
+        except (IOError, ValueError) as e:
+            raise CommandError("cannot read stats: %s" % e)
+
+        by_document = {}
+        for entry in entries:
+            by_document.setdefault(entry['document'], []).append(entry)
+
+        for path, doc_entries in sorted(by_document.items()):
+            try:
+                document = import_string(path)
+            except ImportError as e:
+                raise CommandError("cannot import document %s: %s" % (path, e))
+            indexes = document_indexes(document, options['live'])
+            total = sum(entry['count'] for entry in doc_entries)
+
+            self.stdout.write("%s (%s):" % (path, document._get_collection_name()))
+            for entry in doc_entries:
+                covering = [ keys for keys in indexes if index_covers(keys, entry) ]
+                if not covering:
+                    status = "  NOT COVERED"
+                elif all(wildcard_prefix(keys[0]) is not None for keys in covering):
+                    status = "  WILDCARD %s" % covering[0][0]
+                else:
+                    status = ""
+                if entry.get('targeted', True) is False:
+                    status += "  UNTARGETED"
+                self.stdout.write("  %6d %5.1f%% %s eq=%s range=%s sort=%s%s" % (
+                    entry['count'], 100.0 * entry['count'] / total, entry['filterset'],
+                    entry['equality'], entry['range'], [ ('-' if direction < 0 else '') + name for name, direction in entry['sort'] ],
+                    status))
+
+            recommended = recommend_indexes(doc_entries, indexes, options['coverage'] / 100.0, dynamic_fields(document))
+            if recommended:
+                self.stdout.write("  recommended indexes (db field names):")
+                for index in recommended:
+                    self.stdout.write("    %s" % [ ('-' if direction < 0 else '') + name for name, direction in index ])
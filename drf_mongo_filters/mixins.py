@@ -0,0 +1,206 @@
+import hashlib
+from bson import json_util
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import BasePermission
+from rest_framework.response import Response
+from rest_framework.serializers import Serializer
+from rest_framework.settings import api_settings
+
+from .filtersets import BaseFilterset, iter_params
+from .versions import versions
+
+
+class FilteredBulkMixin():
+    """ base for mass operations on documents selected by filterset
+
+    Uses view's filter_class and get_queryset, like MongoFilterBackend.
+    Refuses requests with no active filters, or matching more than bulk_limit documents.
+    Ids of matching documents are selected first and operation is restricted to them, so that documents starting to match
+    concurrently are not touched and bulk_limit holds. If view's permissions check objects, matching documents are loaded
+    and checked with check_object_permissions.
+    With dry_run param set, only reports number of matching documents, checking bulk_limit as well.
+
+    class attrs:
+    - bulk_limit: max number of documents to operate on, None for unlimited
+    - dry_run_param: name of query param to request dry run
+    - change_versions: ChangeVersions to bump after operations, as they bypass signals
+    """
+    bulk_limit = None
+    dry_run_param = 'dry_run'
+    change_versions = versions
+
+    def get_bulk_queryset(self):
+        """ filtered queryset, refused if filters add no conditions to the scoped one (including negated and grouped params) """
+        filterset = self.filter_class.for_request(self.request.query_params, self.request)
+        queryset = self.get_queryset()
+        filtered = filterset.filter_queryset(queryset)
+        scoped = filterset.simplify_queryset(filterset.apply_params(queryset, filterset.scope))
+        if not getattr(filtered, '_none', False) and filtered._query == scoped._query:
+            raise ValidationError({ api_settings.NON_FIELD_ERRORS_KEY: ["no filters given for bulk operation"] })
+        return filtered
+
+    def is_dry_run(self):
+        return self.request.query_params.get(self.dry_run_param, '').lower() in ('1', 'true', 'yes')
+
+    def check_bulk_limit(self, count):
+        if self.bulk_limit is not None and count > self.bulk_limit:
+            raise ValidationError({ api_settings.NON_FIELD_ERRORS_KEY: [
+                "bulk operation matches %d documents, limit is %d" % (count, self.bulk_limit) ] })
+
+    def dry_run(self, queryset):
+        """ response with number of matching documents, refused if it exceeds bulk_limit """
+        if self.bulk_limit is None:
+            count = queryset.count()
+        else:
+            count = queryset.limit(self.bulk_limit + 1).count(with_limit_and_skip=True)
+        self.check_bulk_limit(count)
+        return Response({ 'matched': count })
+
+    def checks_objects(self):
+        """ if any of permissions overrides has_object_permission """
+        return any(type(permission).has_object_permission is not BasePermission.has_object_permission
+                   for permission in self.get_permissions())
+
+    def select_bulk_targets(self, queryset):
+        """
+        select documents to operate on, checking bulk_limit and object permissions
+
+        returns (queryset restricted to selected documents, number of them)
+        """
+        checks_objects = self.checks_objects()
+        if self.bulk_limit is None and not checks_objects:
+            return queryset, queryset.count()
+
+        selected = queryset if self.bulk_limit is None else queryset.limit(self.bulk_limit + 1)
+        if checks_objects:
+            documents = list(selected)
+            ids = [ document.pk for document in documents ]
+        else:
+            ids = list(selected.scalar('pk'))
+        self.check_bulk_limit(len(ids))
+        if checks_objects:
+            for document in documents:
+                self.check_object_permissions(self.request, document)
+        return queryset.filter(pk__in=ids), len(ids)
+
+
+class FilteredBulkUpdateMixin(FilteredBulkMixin):
+    """ update all documents matching filterset with single update_many
+
+    Request data is validated by view's serializer as partial update, validated values are $set.
+    Fields of nested serializers (and fields with dotted sources) are set one by one,
+    so that other fields of embedded documents are kept.
+    """
+    def get_update_params(self, validated_data, fields=None):
+        """ $set params for validated data of serializer with given fields (default: of view's serializer) """
+        if fields is None:
+            fields = self.get_serializer().fields
+        params = {}
+        self.collect_update_params(params, validated_data, fields, [])
+        return params
+
+    def collect_update_params(self, params, data, fields, prefix):
+        for field in fields.values():
+            if field.read_only:
+                continue
+            value = data
+            for attr in field.source_attrs:
+                if not isinstance(value, dict) or attr not in value:
+                    break
+                value = value[attr]
+            else:
+                path = prefix + field.source_attrs
+                if isinstance(field, Serializer) and isinstance(value, dict):
+                    self.collect_update_params(params, value, field.fields, path)
+                elif path:
+                    params['set__' + '__'.join(path)] = value
+
+    def bulk_update(self, request, *args, **kwargs):
+        queryset = self.get_bulk_queryset()
+        serializer = self.get_serializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        if not serializer.validated_data:
+            raise ValidationError({ api_settings.NON_FIELD_ERRORS_KEY: ["no values given for bulk update"] })
+
+        if self.is_dry_run():
+            return self.dry_run(queryset)
+        queryset, count = self.select_bulk_targets(queryset)
+
+        updated = queryset.update(**self.get_update_params(serializer.validated_data, serializer.fields))
+        self.change_versions.bump(queryset._document)
+        return Response({ 'matched': count, 'updated': updated })
+
+
+class FilteredBulkDestroyMixin(FilteredBulkMixin):
+    """ delete all documents matching filterset
+
+    Deleted with single delete_many, unless document has delete rules or signals handlers.
+    """
+    def bulk_destroy(self, request, *args, **kwargs):
+        queryset = self.get_bulk_queryset()
+        if self.is_dry_run():
+            return self.dry_run(queryset)
+        queryset, count = self.select_bulk_targets(queryset)
+
+        deleted = queryset.delete()
+        self.change_versions.bump(queryset._document)
+        return Response({ 'matched': count, 'deleted': deleted })
+
+
+class ConditionalListMixin():
+    """ list documents with conditional GET
+
+    ETag is computed from fingerprint of filtered queryset, query params, accepted media type
+    and change version of the document, Last-Modified is time of the version.
+    Requests with matching If-None-Match, or with If-Modified-Since not older than the version,
+    get 304 before documents are queried or serialized.
+
+    class attrs:
+    - change_versions: ChangeVersions keeping versions of documents
+    """
+    change_versions = versions
+
+    def get_list_etag(self, queryset, version):
+        if hasattr(queryset, '_query'):
+            fingerprint = [ BaseFilterset.fingerprint(queryset), repr(queryset._ordering) ]
+        else:
+            # already evaluated, as by ColumnarFilterBackend, result is defined by scope and params
+            filterset = getattr(self, 'filterset', None)
+            fingerprint = repr(sorted(filterset.scope.items())) if filterset is not None else None
+        data = json_util.dumps([
+            fingerprint,
+            sorted(iter_params(self.request.query_params)),
+            getattr(self.request, 'accepted_media_type', None),
+            version[0] ])
+        return '"%s"' % hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def is_not_modified(self, request, etag, modified):
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', None)
+        if if_none_match is not None:
+            tags = [ tag.strip() for tag in if_none_match.split(',') ]
+            return '*' in tags or etag in tags or 'W/' + etag in tags
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return if_modified_since is not None and int(modified) <= if_modified_since
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        document = getattr(queryset, '_document', None) or self.get_queryset()._document
+        # version is taken before querying, so that concurrent changes make the next request to refetch
+        version = self.change_versions.get(document)
+        etag = self.get_list_etag(queryset, version)
+        headers = { 'ETag': etag, 'Last-Modified': http_date(version[1]) }
+        if self.is_not_modified(request, etag, version[1]):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            response = self.get_paginated_response(serializer.data)
+        else:
+            serializer = self.get_serializer(queryset, many=True)
+            response = Response(serializer.data)
+        for name, value in headers.items():
+            response[name] = value
+        return response
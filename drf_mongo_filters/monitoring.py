@@ -0,0 +1,270 @@
+import json
+import logging
+import re
+import threading
+import time
+
+from mongoengine import fields as mongo_fields
+
+from .cache import TTLCache
+
+WILDCARD = '$**'
+
+
+def value_shape(value):
+    """ placeholder for type of value """
+    if value is None:
+        return None
+    return "<%s>" % value.__class__.__name__
+
+def query_shape(query):
+    """ normalize query, replacing values with type placeholders
+
+    Lists of values are replaced with sorted distinct placeholders,
+    so queries differing only in values have the same shape.
+    """
+    if isinstance(query, dict):
+        return dict([ (key, query_shape(val)) for key, val in query.items() ])
+    if isinstance(query, (list, tuple)):
+        shapes = [ query_shape(val) for val in query ]
+        if all(isinstance(shape, str) or shape is None for shape in shapes):
+            return sorted(set(shapes), key=str)
+        return shapes
+    return value_shape(query)
+
+def shape_key(shape):
+    return json.dumps(shape, sort_keys=True)
+
+def is_targeted(queryset, filterset=None):
+    """ if query can be routed to single shard, as told by filterset (or Filterset) is_targeted """
+    if filterset is None:
+        from .filtersets import BaseFilterset as filterset
+    return filterset.is_targeted(queryset)
+
+def query_fields(query):
+    """ split fields of query into equality and range conditions
+
+    Conditions within $or and $nor are ignored, as they need indexes of their own.
+    """
+    equality, ranges = set(), set()
+    for key, cond in query.items():
+        if key == '$and':
+            for sub in cond:
+                sub_eq, sub_rng = query_fields(sub)
+                equality |= sub_eq
+                ranges |= sub_rng
+        elif key.startswith('$'):
+            continue
+        elif isinstance(cond, dict) and cond and all(op.startswith('$') for op in cond.keys()):
+            if set(cond.keys()) <= set(['$eq', '$in']):
+                equality.add(key)
+            else:
+                ranges.add(key)
+        elif isinstance(cond, re.Pattern):
+            ranges.add(key)
+        else:
+            equality.add(key)
+    return equality, ranges - equality
+
+
+class SlowQueryLog():
+    """ logs queries running longer than threshold
+
+    Logs filterset class, request path, active filters, normalized query shape and duration.
+    Each shape is logged at most once per interval.
+
+    Args:
+    - threshold: min duration in seconds to log
+    - interval: min seconds between records of the same shape
+    - logger: logger to use, default is 'drf_mongo_filters.slow_queries'
+    """
+    def __init__(self, threshold=0.1, interval=60, logger=None):
+        self.threshold = threshold
+        self.interval = interval
+        self.logger = logger or logging.getLogger('drf_mongo_filters.slow_queries')
+        self._logged = TTLCache(maxsize=1024, ttl=interval)
+
+    def record(self, queryset, duration, filterset=None, operation='fetch'):
+        if duration < self.threshold:
+            return False
+
+        shape = shape_key({ 'collection': queryset._collection.name, 'operation': operation, 'query': query_shape(queryset._query) })
+        if self._logged.get(shape, False):
+            return False
+        self._logged.set(shape, True)
+
+        request = getattr(filterset, 'request', None)
+        targeted = is_targeted(queryset, filterset)
+        self.logger.warning("slow query %.1fms: %s %s filters=%s targeted=%s shape=%s",
+            duration * 1000,
+            filterset.__class__.__qualname__ if filterset is not None else None,
+            request.path if request is not None else None,
+            sorted(filterset.values.keys()) if filterset is not None else None,
+            targeted,
+            shape,
+            extra={
+                'duration': duration,
+                'filterset': filterset.__class__.__qualname__ if filterset is not None else None,
+                'targeted': targeted,
+                'query_shape': shape,
+            })
+        return True
+
+    def timed(self, func, queryset, filterset=None, operation='fetch'):
+        """ call func, recording its duration """
+        started = time.perf_counter()
+        result = func()
+        self.record(queryset, time.perf_counter() - started, filterset, operation)
+        return result
+
+
+class QueryStats():
+    """ counts query shapes per filterset in process
+
+    Shape is document, filterset, fields with equality conditions, fields with range conditions, ordering
+    and if query is targeted to single shard.
+    Counts are exported to json files, to be analyzed with filter_index_report command.
+    """
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, queryset, filterset=None):
+        equality, ranges = query_fields(queryset._query)
+        document = queryset._document
+        key = (
+            document.__module__ + '.' + document.__qualname__,
+            filterset.__class__.__module__ + '.' + filterset.__class__.__qualname__ if filterset is not None else None,
+            tuple(sorted(equality)),
+            tuple(sorted(ranges)),
+            tuple(tuple(order) for order in (queryset._ordering or ())),
+            is_targeted(queryset, filterset))
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def entries(self):
+        """ list of shapes with counts, most frequent first """
+        with self._lock:
+            counts = list(self._counts.items())
+        return sorted([
+            { 'document': document, 'filterset': filterset, 'equality': list(equality), 'range': list(ranges), 'sort': [ list(order) for order in sort ],
+              'targeted': targeted, 'count': count }
+            for (document, filterset, equality, ranges, sort, targeted), count in counts ],
+            key=lambda entry: -entry['count'])
+
+    def export(self, path):
+        """ write entries to json file """
+        with open(path, 'w') as out:
+            json.dump(self.entries(), out, indent=1)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+def load_stats(paths):
+    """ read and merge entries exported from several processes """
+    merged = {}
+    for path in paths:
+        with open(path) as inp:
+            for entry in json.load(inp):
+                key = shape_key(dict([ (k, v) for k, v in entry.items() if k != 'count' ]))
+                if key in merged:
+                    merged[key]['count'] += entry['count']
+                else:
+                    merged[key] = dict(entry)
+    return sorted(merged.values(), key=lambda entry: -entry['count'])
+
+def document_indexes(document, live=False):
+    """ lists of db field names of indexes of document
+
+    declared in meta, or, with live, existing in database, including wildcard indexes which cannot be declared
+    """
+    if live:
+        return [ [ name for name, direction in index['key'] ] for index in document._get_collection().index_information().values() ]
+    return [ [ name for name, direction in spec['fields'] ] for spec in document._meta.get('index_specs', None) or [] ] + [ ['_id'] ]
+
+def dynamic_fields(document):
+    """ db names of top-level fields with dynamic keys (MapField, DictField) """
+    return [ field.db_field for field in document._fields.values() if isinstance(field, mongo_fields.DictField) ]
+
+def wildcard_prefix(key):
+    """ prefix of fields covered by wildcard index key, '' for all fields, None if key is not wildcard """
+    if key == WILDCARD:
+        return ''
+    if key.endswith('.' + WILDCARD):
+        return key[:-len(WILDCARD)]
+    return None
+
+def shape_index(entry, dynamic=()):
+    """ index for shape: equality fields, then sort fields, then range fields
+
+    For conditions on keys of dynamic fields, wildcard index of the field.
+    Returns list of (name, direction) pairs.
+    """
+    for name in sorted(entry['equality']) + sorted(entry['range']):
+        for field in dynamic:
+            if name.startswith(field + '.'):
+                return [ (field + '.' + WILDCARD, 1) ]
+
+    keys = [ (name, 1) for name in sorted(entry['equality']) ]
+    used = set(entry['equality'])
+    for name, direction in entry['sort']:
+        if name not in used:
+            keys.append((name, direction))
+            used.add(name)
+    keys += [ (name, 1) for name in sorted(entry['range']) if name not in used ]
+    return keys
+
+def index_covers(keys, entry):
+    """ check if index with given field names is usable for shape
+
+    Equality fields should form prefix of index, or, if there are none, index should start with range or sort field.
+    Wildcard index is usable if any of conditions is on field it covers.
+    """
+    equality = set(entry['equality'])
+    others = set(entry['range']) | set(name for name, direction in entry['sort'])
+    if not equality and not others:
+        return True
+    if keys and wildcard_prefix(keys[0]) is not None:
+        prefix = wildcard_prefix(keys[0])
+        return any(name.startswith(prefix) for name in (equality | set(entry['range'])))
+    if equality:
+        return set(keys[:len(equality)]) == equality
+    return bool(keys) and keys[0] in others
+
+def recommend_indexes(entries, indexes, coverage=0.9, dynamic=()):
+    """ choose indexes for most frequent shapes
+
+    Takes most frequent shapes making up coverage fraction of total count,
+    and greedily chooses indexes covering most of traffic of those not covered by existing indexes.
+
+    Args:
+    - entries: shapes of single document, as from QueryStats.entries
+    - indexes: lists of field names of existing indexes
+    - coverage: fraction of traffic to cover
+    - dynamic: db names of fields with dynamic keys, to use wildcard indexes for
+
+    Returns list of indexes, as lists of (name, direction) pairs.
+    """
+    total = sum(entry['count'] for entry in entries)
+    top, counted = [], 0
+    for entry in sorted(entries, key=lambda entry: -entry['count']):
+        if counted >= coverage * total:
+            break
+        top.append(entry)
+        counted += entry['count']
+
+    uncovered = [ entry for entry in top if not any(index_covers(keys, entry) for keys in indexes) ]
+    candidates = []
+    for entry in uncovered:
+        index = shape_index(entry, dynamic)
+        if index not in candidates:
+            candidates.append(index)
+
+    chosen = []
+    while uncovered:
+        best = max(candidates, key=lambda index: sum(entry['count'] for entry in uncovered if index_covers([ name for name, direction in index ], entry)))
+        chosen.append(best)
+        uncovered = [ entry for entry in uncovered if not index_covers([ name for name, direction in best ], entry) ]
+    return chosen
@@ -0,0 +1,63 @@
+from rest_framework.pagination import LimitOffsetPagination
+
+from .backend import MongoFilterBackend
+from .filtersets import BaseFilterset
+
+
+class FilteredLimitOffsetPagination(LimitOffsetPagination):
+    """ limit/offset pagination with fast counts, cached with filterset count_ttl
+
+    Counts with count_queryset of view's filter_class (or of BaseFilterset).
+    With count_limit set, counts no more than needed to display current page and count_limit,
+    and reports larger counts as 'N+'.
+    Pages and counts are fetched through view's MongoFilterBackend, to coalesce concurrent identical requests.
+    """
+    count_limit = None
+
+    def get_filter_backend(self, view):
+        for backend_class in getattr(view, 'filter_backends', ()):
+            if issubclass(backend_class, MongoFilterBackend):
+                return backend_class()
+        return MongoFilterBackend()
+
+    def get_filtered_count(self, queryset, view):
+        filter_class = getattr(view, 'filter_class', None)
+        if filter_class is None or not issubclass(filter_class, BaseFilterset):
+            filter_class = BaseFilterset
+
+        limit = None
+        if self.count_limit is not None:
+            limit = max(self.count_limit, self.offset + self.limit)
+        filterset = getattr(view, 'filterset', None)
+        count_func = lambda: filter_class.count_queryset(queryset, limit)
+        key = ('count', BaseFilterset.fingerprint(queryset), limit)
+        count = self.backend.coalesced(key, lambda: self.backend.timed(count_func, queryset, filterset, 'count'))
+        return count, limit is not None and count > limit
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_capped = False
+        if isinstance(queryset, (list, tuple)):
+            # already evaluated, as by ColumnarFilterBackend
+            return super().paginate_queryset(queryset, request, view)
+
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.offset = self.get_offset(request)
+        self.request = request
+        self.backend = self.get_filter_backend(view)
+        self.backend.record_stats(queryset, getattr(view, 'filterset', None))
+        self.count, self.count_capped = self.get_filtered_count(queryset, view)
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return self.backend.fetch(queryset, self.offset, self.limit, getattr(view, 'filterset', None))
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count_capped:
+            response.data['count'] = "%d+" % (self.count - 1)
+        return response
@@ -0,0 +1,97 @@
+import copy
+from collections import OrderedDict
+from bson import DBRef
+from mongoengine import fields as mongo_fields
+from mongoengine.base import BaseList
+
+from .cache import TTLCache
+
+
+class PrefetchMixin():
+    """ batch loading of referenced documents, for BaseFilterset
+
+    class attrs:
+    - prefetch: names of reference fields to load for fetched documents in batch,
+      or mapping of them to lists of fields to load (None for all)
+    - prefetch_ttl: seconds to cache prefetched documents, 0 to disable
+    """
+    prefetch = ()
+    prefetch_ttl = 0
+    prefetch_cache = TTLCache(maxsize=4096)
+
+    @classmethod
+    def load_references(cls, document, ids, only=None):
+        """
+        documents of class by ids, fetched with single $in query
+
+        Args:
+        - document: referenced document class
+        - ids: list of ids
+        - only: names of fields to load, None for all
+
+        Returns mapping of ids to documents, without missing ones.
+        Raw documents are cached by collection, projection and id for prefetch_ttl seconds.
+        """
+        projection = None
+        if only:
+            projection = dict.fromkeys([ document._db_field_map.get(name, name) for name in only ], 1)
+            if document._meta.get('allow_inheritance'):
+                projection['_cls'] = 1
+        collection = document._get_collection()
+        key = (collection.name, tuple(sorted(projection)) if projection else None)
+
+        sons = {}
+        missing = []
+        for id in ids:
+            son = cls.prefetch_cache.get(key + (id,), None) if cls.prefetch_ttl else None
+            if son is None:
+                missing.append(id)
+            else:
+                sons[id] = son
+        if missing:
+            for son in collection.find({ '_id': { '$in': missing } }, projection):
+                sons[son['_id']] = son
+                if cls.prefetch_ttl:
+                    cls.prefetch_cache.set(key + (son['_id'],), son, ttl=cls.prefetch_ttl)
+        return dict([ (id, document._from_son(copy.deepcopy(son))) for id, son in sons.items() ])
+
+    @classmethod
+    def prefetch_references(cls, documents):
+        """
+        attach documents referenced by fields listed in prefetch to documents
+
+        Referenced documents of each field are loaded with single query, for all documents at once,
+        so that serializing them makes no query per document.
+        Supports ReferenceField and ListField of ReferenceField, references to missing documents are left as DBRef.
+        Documents may be loaded with or without dereferencing, prefetched fields are not dereferenced again.
+        Returns documents.
+        """
+        prefetch = cls.prefetch if isinstance(cls.prefetch, dict) else dict.fromkeys(cls.prefetch)
+        for name, only in prefetch.items():
+            targets = [ doc for doc in documents if doc._data.get(name, None) is not None ]
+            if not targets:
+                continue
+            field = targets[0]._fields[name]
+            is_list = isinstance(field, mongo_fields.ListField)
+            ref_field = field.field if is_list else field
+            if not isinstance(ref_field, mongo_fields.ReferenceField):
+                raise TypeError("%s.prefetch expects reference fields: %s" % (cls.__qualname__, name))
+
+            ids = OrderedDict()
+            for doc in targets:
+                values = doc._data[name] if is_list else [ doc._data[name] ]
+                for value in values:
+                    if isinstance(value, DBRef):
+                        ids[value.id] = True
+            loaded = cls.load_references(ref_field.document_type, list(ids.keys()), only)
+
+            resolve = lambda value: loaded.get(value.id, value) if isinstance(value, DBRef) else value
+            for doc in targets:
+                if is_list:
+                    # marked as dereferenced, so that accessing the field does not query again
+                    resolved = BaseList([ resolve(value) for value in doc._data[name] ], doc, name)
+                    resolved._dereferenced = True
+                    doc._data[name] = resolved
+                else:
+                    doc._data[name] = resolve(doc._data[name])
+        return documents
@@ -0,0 +1,409 @@
+""" rewriting of raw mongodb queries
+
+Conditions are combined and negated with the most specific operators,
+like $in for alternatives of equalities and $ne/$nin for negated equalities,
+using $or and $nor only when nothing else fits, so that single-field indexes stay usable.
+"""
+import hashlib
+import re
+from datetime import datetime
+from bson import ObjectId, json_util
+from mongoengine import fields as mongo_fields
+
+
+# placeholder keeping position of field in merged query
+PENDING = object()
+
+# operators sorting by distance, which cannot be negated or used in $or
+GEO_NEAR = ('$near', '$nearSphere')
+
+def fingerprint(queryset):
+    """ canonical hash of database, collection, query and collation of queryset """
+    query = { 'collection': queryset._collection.full_name, 'query': queryset._query, 'none': getattr(queryset, '_none', False),
+              'collation': queryset._collation }
+    return hashlib.sha1(json_util.dumps(query, sort_keys=True).encode('utf-8')).hexdigest()
+
+def is_operators(cond):
+    """ if condition is a dict of operators, like { '$gt': 1 } """
+    return isinstance(cond, dict) and bool(cond) and all(key.startswith('$') for key in cond.keys())
+
+def is_equality(cond):
+    """ if field condition is a plain value to compare with """
+    return not isinstance(cond, (dict, list, tuple, re.Pattern))
+
+def uses_operators(query, operators):
+    """ if query uses any of operators, at any depth """
+    if isinstance(query, dict):
+        return any(key in operators or uses_operators(cond, operators) for key, cond in query.items())
+    if isinstance(query, (list, tuple)):
+        return any(uses_operators(item, operators) for item in query)
+    return False
+
+def kind_of(value):
+    """ type bracket of value, as compared by mongodb, None for unsupported """
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, float)):
+        return 'number'
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, datetime):
+        return 'date'
+    if isinstance(value, ObjectId):
+        return 'objectid'
+    return None
+
+def same(value, other):
+    """ if values are equal for mongodb, which does not match 1 with true """
+    return kind_of(value) == kind_of(other) and value == other
+
+def contains(values, value):
+    return any(same(value, val) for val in values)
+
+def unique(values):
+    result = []
+    for value in values:
+        if not contains(result, value):
+            result.append(value)
+    return result
+
+
+def equality_values(query):
+    """ (field, values) if query is equality of single field to any of values, or None """
+    if len(query) != 1:
+        return None
+    field, cond = next(iter(query.items()))
+    if field.startswith('$'):
+        return None
+    if is_equality(cond):
+        return field, [ cond ]
+    if is_operators(cond) and list(cond.keys()) == ['$eq'] and is_equality(cond['$eq']):
+        return field, [ cond['$eq'] ]
+    if is_operators(cond) and list(cond.keys()) == ['$in']:
+        return field, list(cond['$in'])
+    return None
+
+def inequality_values(query):
+    """ (field, values) if query is inequality of single field to all of values, or None """
+    if len(query) != 1:
+        return None
+    field, cond = next(iter(query.items()))
+    if field.startswith('$') or not is_operators(cond) or len(cond) != 1:
+        return None
+    op, arg = next(iter(cond.items()))
+    if op == '$ne' and is_equality(arg):
+        return field, [ arg ]
+    if op == '$nin':
+        return field, list(arg)
+    return None
+
+
+def negate_condition(cond):
+    """ negate condition of a field """
+    if isinstance(cond, re.Pattern):
+        return { '$not': cond }
+    if not is_operators(cond):
+        return { '$ne': cond }
+    if len(cond) == 1:
+        op, arg = next(iter(cond.items()))
+        if op == '$eq':
+            return { '$ne': arg }
+        if op == '$ne':
+            return { '$eq': arg }
+        if op == '$in':
+            return { '$nin': arg }
+        if op == '$nin':
+            return { '$in': arg }
+        if op == '$exists':
+            return { '$exists': not arg }
+        if op == '$not':
+            return arg
+    return { '$not': cond }
+
+def negate(query):
+    """ negate query
+
+    Single field conditions are negated in place, others are wrapped in $nor.
+    """
+    if len(query) == 1:
+        field, cond = next(iter(query.items()))
+        if not field.startswith('$'):
+            return { field: negate_condition(cond) }
+        if field == '$nor' and len(cond) == 1:
+            return cond[0]
+    return { '$nor': [ query ] }
+
+def any_of(queries):
+    """ combine alternative queries
+
+    Equalities of the same field are merged into single $in,
+    the rest is combined with $or.
+    Empty alternative matches everything and makes empty result.
+    """
+    merged = {}
+    alternatives = []
+    for query in queries:
+        if not query:
+            return {}
+        eq = equality_values(query)
+        if eq is None:
+            if query not in alternatives:
+                alternatives.append(query)
+            continue
+        field, values = eq
+        if field not in merged:
+            merged[field] = []
+            alternatives.append(field)
+        merged[field] = unique(merged[field] + values)
+
+    result = []
+    for alt in alternatives:
+        if isinstance(alt, str):
+            values = merged[alt]
+            result.append({ alt: values[0] } if len(values) == 1 else { alt: { '$in': values } })
+        else:
+            result.append(alt)
+
+    if len(result) == 1:
+        return result[0]
+    return { '$or': result }
+
+def all_of(queries):
+    """ combine required queries
+
+    Inequalities of the same field are merged into single $nin,
+    conditions of different fields are merged into single query, the rest is combined with $and.
+    """
+    excluded = {}
+    merged = {}
+    extra = []
+
+    def add(field, cond):
+        if merged.get(field, PENDING) is PENDING:
+            merged[field] = cond
+        elif is_operators(merged[field]) and is_operators(cond) and not set(merged[field].keys()) & set(cond.keys()):
+            merged[field] = dict(merged[field], **cond)
+        else:
+            extra.append({ field: cond })
+
+    for query in queries:
+        if not query:
+            continue
+        ne = inequality_values(query)
+        if ne is not None:
+            field, values = ne
+            if field not in excluded:
+                excluded[field] = []
+                merged.setdefault(field, PENDING)
+            excluded[field] = unique(excluded[field] + values)
+            continue
+        for field, cond in query.items():
+            add(field, cond)
+
+    for field, values in excluded.items():
+        add(field, { '$ne': values[0] } if len(values) == 1 else { '$nin': values })
+
+    if not extra:
+        return merged
+    return { '$and': [ merged ] + extra }
+
+
+# fields holding single value, where conditions can be merged
+SCALAR_FIELDS = (
+    mongo_fields.StringField, mongo_fields.IntField, mongo_fields.LongField, mongo_fields.FloatField,
+    mongo_fields.BooleanField, mongo_fields.DateTimeField, mongo_fields.ObjectIdField, mongo_fields.ReferenceField)
+
+BOUNDS = ('$gt', '$gte', '$lt', '$lte')
+
+class Unsatisfiable(Exception):
+    """ query cannot match any document """
+    pass
+
+def scalar_fields(document):
+    """ db names of top-level fields of document holding single values """
+    return set(field.db_field for field in document._fields.values()
+               if isinstance(field, SCALAR_FIELDS) and not isinstance(field, mongo_fields.ComplexBaseField))
+
+def conditions(query):
+    """ list of (field, condition) of query, with top-level $and flattened """
+    result = []
+    for key, cond in query.items():
+        if key == '$and':
+            for sub in cond:
+                result.extend(conditions(sub))
+        else:
+            result.append((key, cond))
+    return result
+
+def merge_field(field, conds):
+    """
+    merge conditions of single-valued field
+
+    Bounds are merged into tightest interval, equalities and $in are intersected and checked against bounds and exclusions.
+    Returns merged condition, or None if it cannot be merged, raises Unsatisfiable.
+    """
+    try:
+        return _merge_field(field, conds)
+    except TypeError:
+        # incomparable values, like naive and aware datetimes
+        return None
+
+def _merge_field(field, conds):
+    allowed = None
+    excluded = []
+    lower = upper = None
+    exists = None
+    others = {}
+
+    def kinds_match(value, bound):
+        return kind_of(value) is not None and kind_of(value) == kind_of(bound[1])
+
+    for cond in conds:
+        ops = cond if is_operators(cond) else { '$eq': cond }
+        for op, arg in ops.items():
+            if op in ('$eq', '$in'):
+                values = [ arg ] if op == '$eq' else list(arg)
+                if any(isinstance(val, (dict, list, tuple, re.Pattern)) for val in values):
+                    return None
+                allowed = unique(values) if allowed is None else [ val for val in allowed if contains(values, val) ]
+            elif op in ('$ne', '$nin'):
+                values = [ arg ] if op == '$ne' else list(arg)
+                if any(isinstance(val, (dict, list, tuple, re.Pattern)) for val in values):
+                    return None
+                excluded = unique(excluded + values)
+            elif op in BOUNDS:
+                if kind_of(arg) is None:
+                    return None
+                if op in ('$gt', '$gte'):
+                    if lower is not None and kind_of(arg) != kind_of(lower[1]):
+                        return None
+                    if lower is None or arg > lower[1] or (arg == lower[1] and op == '$gt'):
+                        lower = (op, arg)
+                else:
+                    if upper is not None and kind_of(arg) != kind_of(upper[1]):
+                        return None
+                    if upper is None or arg < upper[1] or (arg == upper[1] and op == '$lt'):
+                        upper = (op, arg)
+            elif op == '$exists':
+                arg = bool(arg)
+                if exists is not None and exists != arg:
+                    raise Unsatisfiable(field)
+                exists = arg
+            elif op in others:
+                return None
+            else:
+                others[op] = arg
+
+    if lower is not None and upper is not None:
+        if kind_of(lower[1]) != kind_of(upper[1]):
+            return None
+        if lower[1] > upper[1] or (lower[1] == upper[1] and (lower[0] == '$gt' or upper[0] == '$lt')):
+            raise Unsatisfiable(field)
+
+    if lower is not None and upper is not None and lower[1] == upper[1] and allowed is None:
+        allowed = [ lower[1] ]
+
+    if exists is False:
+        if None in excluded or lower is not None or upper is not None or (allowed is not None and [ val for val in allowed if val is not None ]):
+            raise Unsatisfiable(field)
+
+    merged = {}
+    if allowed is not None:
+        if lower is not None:
+            allowed = [ val for val in allowed if kinds_match(val, lower) and (val > lower[1] or (val == lower[1] and lower[0] == '$gte')) ]
+        if upper is not None:
+            allowed = [ val for val in allowed if kinds_match(val, upper) and (val < upper[1] or (val == upper[1] and upper[0] == '$lte')) ]
+        allowed = [ val for val in allowed if not contains(excluded, val) ]
+        if not allowed:
+            raise Unsatisfiable(field)
+        if len(allowed) == 1:
+            merged['$eq'] = allowed[0]
+        else:
+            merged['$in'] = allowed
+        if exists is not None and None in allowed:
+            merged['$exists'] = exists
+    else:
+        if lower is not None:
+            merged[lower[0]] = lower[1]
+        if upper is not None:
+            merged[upper[0]] = upper[1]
+        if lower is not None or upper is not None:
+            excluded = [ val for val in excluded if (lower is None or kinds_match(val, lower) and val >= lower[1])
+                                                 and (upper is None or kinds_match(val, upper) and val <= upper[1]) ]
+            exists = None
+        if None in excluded and exists is True:
+            exists = None
+        if len(excluded) == 1:
+            merged['$ne'] = excluded[0]
+        elif excluded:
+            merged['$nin'] = excluded
+        if exists is not None:
+            merged['$exists'] = exists
+    merged.update(others)
+
+    if list(merged.keys()) == ['$eq'] and is_equality(merged['$eq']):
+        return merged['$eq']
+    return merged
+
+def simplify(query, document):
+    """
+    normalize query
+
+    Conditions of single-valued top-level fields are merged per field,
+    alternatives of $or which cannot match are dropped.
+    Raises Unsatisfiable if query cannot match any document.
+    """
+    scalars = scalar_fields(document)
+    pending = [ (field, cond) for field, cond in conditions(query) if field != '$or' ]
+    context = [ { field: cond } for field, cond in pending ]
+
+    alternations = []
+    for field, cond in conditions(query):
+        if field != '$or':
+            continue
+        alternatives = []
+        for alt in cond:
+            try:
+                alt = simplify(alt, document)
+                if alt and context:
+                    # alternatives contradicting the rest of conditions cannot match
+                    simplify({ '$and': [ alt ] + context }, document)
+            except Unsatisfiable:
+                continue
+            if not alt:
+                alternatives = None
+                break
+            if alt not in alternatives:
+                alternatives.append(alt)
+        if alternatives is None:
+            continue
+        if not alternatives:
+            raise Unsatisfiable('$or')
+        if len(alternatives) == 1:
+            pending.extend(conditions(alternatives[0]))
+        else:
+            alternations.append(('$or', alternatives))
+
+    by_field = {}
+    order = []
+    for field, cond in pending + alternations:
+        if is_operators(cond) and '$in' in cond and not cond['$in']:
+            raise Unsatisfiable(field)
+        if field not in by_field:
+            by_field[field] = []
+            order.append(field)
+        by_field[field].append(cond)
+
+    result = {}
+    extra = []
+    for field in order:
+        conds = by_field[field]
+        merged = merge_field(field, conds) if field in scalars else None
+        if merged is not None:
+            result[field] = merged
+        else:
+            result[field] = conds[0]
+            extra.extend([ { field: cond } for cond in conds[1:] ])
+    if not extra:
+        return result
+    return { '$and': [ result ] + extra }
@@ -0,0 +1,34 @@
+import weakref
+from django.core.exceptions import ImproperlyConfigured
+
+
+class FiltersetRegistry():
+    """ collection of all declared filtersets
+
+    Filtersets are registered by metaclass on declaration.
+    Compiling them all at startup reports invalid config on boot instead of in request handling.
+    Classes are held by weak references, so dynamically created filtersets are not kept alive.
+    """
+    def __init__(self):
+        self._filtersets = weakref.WeakSet()
+
+    def register(self, filterset_class):
+        self._filtersets.add(filterset_class)
+
+    def __iter__(self):
+        return iter(sorted(self._filtersets, key=lambda cls: (cls.__module__, cls.__qualname__)))
+
+    def compile_all(self):
+        """ compile all concrete filtersets, raising ImproperlyConfigured listing all failures """
+        errors = []
+        for filterset_class in self:
+            if filterset_class.is_abstract():
+                continue
+            try:
+                filterset_class.compile()
+            except Exception as e:
+                errors.append("%s.%s: %s" % (filterset_class.__module__, filterset_class.__qualname__, e))
+        if errors:
+            raise ImproperlyConfigured("invalid filtersets:\n" + "\n".join(errors))
+
+registry = FiltersetRegistry()
@@ -0,0 +1,86 @@
+import math
+from statistics import NormalDist
+
+
+class SamplingMixin():
+    """ random sampling of filtered querysets with estimated counts, for BaseFilterset
+
+    class attrs:
+    - sample_size: number of documents to sample in sampling mode, None to disable it
+    - sample_strategy: 'match_first' to sample matching documents, 'sample_first' to match sampled documents
+    - sample_confidence: confidence level of estimated count interval
+    """
+    sample_size = None
+    sample_strategy = 'match_first'
+    sample_confidence = 0.95
+
+    @classmethod
+    def estimate_count(cls, matched, sampled, total):
+        """
+        estimated count of matching documents in collection of total documents,
+        from matched of sampled documents, with Wilson score interval at sample_confidence
+
+        Returns { 'count', 'low', 'high', 'confidence', 'exact' }
+        """
+        if sampled >= total:
+            return { 'count': matched, 'low': matched, 'high': matched, 'confidence': 1.0, 'exact': True }
+        z = NormalDist().inv_cdf((1 + cls.sample_confidence) / 2)
+        p = matched / sampled
+        center = (p + z * z / (2 * sampled)) / (1 + z * z / sampled)
+        spread = z * math.sqrt(p * (1 - p) / sampled + z * z / (4 * sampled * sampled)) / (1 + z * z / sampled)
+        return {
+            'count': int(round(p * total)),
+            'low': int(math.floor(max(center - spread, 0) * total)),
+            'high': int(math.ceil(min(center + spread, 1) * total)),
+            'confidence': cls.sample_confidence,
+            'exact': False }
+
+    @classmethod
+    def sample_queryset(cls, queryset, size=None, strategy=None):
+        """
+        random sample of documents of filtered queryset, with estimated count
+
+        With 'match_first' strategy runs $match then $sample, giving sample of size documents (or all matching),
+        the count is estimated by matching another $sample of collection, unless all matching documents are sampled.
+        With 'sample_first' strategy runs $sample of collection then $match, giving only matching ones of size documents,
+        and the count is estimated from their fraction.
+        Ordering, skip and limit of queryset are ignored.
+
+        Returns (documents, estimate), with estimate as in estimate_count
+        """
+        if size is None:
+            size = cls.sample_size
+        if strategy is None:
+            strategy = cls.sample_strategy
+        if strategy not in ('match_first', 'sample_first'):
+            raise ValueError("unknown sampling strategy: " + repr(strategy))
+        if getattr(queryset, '_none', False):
+            return [], cls.estimate_count(0, 0, 0)
+
+        document = queryset._document
+        collection = queryset._collection
+        query = queryset._query
+        if hasattr(collection, 'estimated_document_count'):
+            total = collection.estimated_document_count()
+        else:
+            total = collection.count()
+
+        if strategy == 'sample_first':
+            pipeline = [ { '$sample': { 'size': size } } ]
+            if query:
+                pipeline.append({ '$match': query })
+            docs = list(collection.aggregate(pipeline))
+            estimate = cls.estimate_count(len(docs), min(size, total), total)
+        else:
+            pipeline = [ { '$match': query } ] if query else []
+            pipeline.append({ '$sample': { 'size': size } })
+            docs = list(collection.aggregate(pipeline))
+            if len(docs) < size:
+                estimate = cls.estimate_count(len(docs), total, total)
+            elif not query:
+                estimate = cls.estimate_count(total, total, total)
+            else:
+                probe = [ { '$sample': { 'size': size } }, { '$match': query }, { '$count': 'count' } ]
+                matched = list(collection.aggregate(probe))
+                estimate = cls.estimate_count(matched[0]['count'] if matched else 0, min(size, total), total)
+        return [ document._from_son(son, _auto_dereference=queryset._auto_dereference) for son in docs ], estimate
@@ -0,0 +1,117 @@
+import asyncio
+import copy
+import threading
+
+
+class SharedCallError(Exception):
+    """ exception of shared call, raised in callers waiting for it if the exception can't be copied
+
+    - error: exception raised by the call, also set as __cause__
+    """
+    def __init__(self, error):
+        super().__init__("shared call failed: %r" % (error,))
+        self.error = error
+
+
+def _shared_error(error):
+    """ copy of exception raised by shared call, with its traceback, for each of waiting callers """
+    try:
+        shared = copy.copy(error)
+    except Exception:
+        shared = None
+    if type(shared) is not type(error):
+        shared = SharedCallError(error)
+        shared.__cause__ = error
+        return shared
+    return shared.with_traceback(error.__traceback__)
+
+
+class _Call():
+    def __init__(self, future=None):
+        self.event = threading.Event()
+        self.future = future
+        self.result = None
+        self.error = None
+        self.finished = False
+        self.waiters = 0
+
+
+class SingleFlight():
+    """ coalesces concurrent identical calls
+
+    The first caller for a key runs the function, concurrent callers with the same key wait for it
+    and get copies of its result, so that they can modify them independently.
+    If the function raises an exception, the first caller gets it, the waiting ones get copies of it of the same type
+    (or SharedCallError wrapping it, if it can't be copied).
+    If the first caller is interrupted (like by KeyboardInterrupt, greenlet kill or task cancellation), waiters run the function on their own.
+    Waiting is bounded by timeout, after which waiter runs the function on its own.
+    Results are not kept after the call completes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+
+    def do(self, key, func, timeout=None):
+        """ call func() or share result of the same call in progress in other thread """
+        with self._lock:
+            call = self._calls.get(key, None)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            if not call.event.wait(timeout) or not call.finished:
+                return func()
+            if call.error is not None:
+                raise _shared_error(call.error)
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = func()
+            call.finished = True
+        except Exception as e:
+            call.error = e
+            call.finished = True
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key, None) is call:
+                    del self._calls[key]
+            call.event.set()
+        # waiters copy the result concurrently, so it is kept intact
+        return copy.deepcopy(call.result) if call.waiters else call.result
+
+    async def do_async(self, key, func, timeout=None):
+        """ await func() or share result of the same call in progress in other task of the event loop """
+        loop = asyncio.get_running_loop()
+        async_key = (id(loop), key)
+        call = self._async_calls.get(async_key, None)
+
+        if call is not None:
+            call.waiters += 1
+            done, pending = await asyncio.wait([ call.future ], timeout=timeout)
+            if not done or call.future.cancelled():
+                return await func()
+            if call.future.exception() is not None:
+                raise _shared_error(call.future.exception())
+            return copy.deepcopy(call.future.result())
+
+        call = self._async_calls[async_key] = _Call(loop.create_future())
+        try:
+            result = await func()
+        except Exception as e:
+            call.future.set_exception(e)
+            call.future.exception() # retrieved by leader
+            raise
+        else:
+            call.future.set_result(result)
+        finally:
+            if not call.future.done():
+                call.future.cancel()
+            if self._async_calls.get(async_key, None) is call:
+                del self._async_calls[async_key]
+        # waiters resume after the leader returns, so the result is kept intact
+        return copy.deepcopy(result) if call.waiters else result
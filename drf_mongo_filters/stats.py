@@ -0,0 +1,145 @@
+from mongoengine import fields as mongo_fields
+from mongoengine.errors import LookUpError
+from rest_framework.exceptions import ValidationError
+
+from . import filters
+from . import monitoring
+from . import queries
+from .cache import TTLCache
+
+
+class StatsMixin():
+    """ distinct values and range statistics of filter targets under other active filters, for BaseFilterset
+
+    class attrs:
+    - distinct_limit: max number of distinct values to return
+    - distinct_ttl: seconds to cache distinct values, 0 (default) to disable
+    - stats_buckets: default number of histogram buckets of range statistics
+    - stats_ttl: seconds to cache range statistics, 0 (default) to disable
+    """
+    distinct_limit = 100
+    distinct_ttl = 0
+    distinct_cache = TTLCache(maxsize=1024)
+    stats_buckets = 10
+    stats_ttl = 0
+    stats_cache = TTLCache(maxsize=1024)
+
+    def target_path(self, document, name):
+        """
+        db path of target of filter, and if any field on the path is a list
+
+        raises ValidationError for unknown filters and filters without single target
+        """
+        filt = self.filters.get(name, None)
+        if filt is None:
+            raise ValidationError("unknown filter: " + name)
+        if not isinstance(filt.target, str) or isinstance(filt, (filters.EmbeddedFilter, filters.MapFilter, filters.GeoFilter)):
+            raise ValidationError("filter has no single target: " + name)
+        try:
+            path = document._lookup_field(filt.target.replace('.', '__').split('__'))
+        except LookUpError:
+            raise ValidationError("filter target is not a field: " + name)
+        db_path = ".".join([ part if isinstance(part, str) else part.db_field for part in path ])
+        return db_path, any(isinstance(part, mongo_fields.ListField) for part in path)
+
+    def distinct_values(self, queryset, name, limit=None):
+        """
+        distinct values of target of filter, under all other active filters
+
+        Uses distinct command for fields leading some index of the document,
+        aggregation with $group, sorting groups and returning first of them, otherwise.
+        Returns (values, capped), with no more than limit (default distinct_limit) lowest values, excluding null,
+        cached by fingerprint of filtered queryset for distinct_ttl seconds, if set.
+        """
+        if limit is None:
+            limit = self.distinct_limit
+        document = queryset._document
+        path, is_list = self.target_path(document, name)
+        queryset = self.filter_queryset(queryset, exclude=(name,))
+        if getattr(queryset, '_none', False):
+            return [], False
+
+        key = (self.fingerprint(queryset), path, limit)
+        if self.distinct_ttl:
+            cached = self.distinct_cache.get(key, None)
+            if cached is not None:
+                return cached
+
+        if any(keys[0] == path for keys in monitoring.document_indexes(document)):
+            # served by index, result is limited by max size of document only
+            kwargs = { 'collation': queryset._collation } if queryset._collation else {}
+            values = [ val for val in queryset._collection.distinct(path, queryset._query, **kwargs) if val is not None ]
+            try:
+                values.sort()
+            except TypeError:
+                values.sort(key=lambda val: (queries.kind_of(val) or '', str(val)))
+        else:
+            pipeline = [ { '$match': queryset._query }, { '$project': { '_id': 0, 'value': '$' + path } } ]
+            if is_list:
+                pipeline.append({ '$unwind': '$value' })
+            pipeline += [
+                { '$match': { 'value': { '$ne': None } } },
+                { '$group': { '_id': '$value' } },
+                { '$sort': { '_id': 1 } },
+                { '$limit': limit + 1 }
+            ]
+            values = [ doc['_id'] for doc in queryset._collection.aggregate(pipeline) ]
+        capped = len(values) > limit
+        values = values[:limit]
+
+        if self.distinct_ttl:
+            self.distinct_cache.set(key, (values, capped), ttl=self.distinct_ttl)
+        return values, capped
+
+    def range_stats_pipeline(self, queryset, name, buckets):
+        """ aggregation pipeline for range_stats, with queryset filtered by other filters """
+        filt = self.filters.get(name, None)
+        if filt is not None and not isinstance(filt, filters.RANGE_FILTERS):
+            raise ValidationError("filter is not a range filter: " + name)
+        path, is_list = self.target_path(queryset._document, name)
+        query = queryset._query
+
+        pipeline = [ { '$match': query } ] if query else []
+        pipeline.append({ '$project': { '_id': 0, 'value': '$' + path } })
+        if is_list:
+            pipeline.append({ '$unwind': '$value' })
+        pipeline += [
+            { '$match': { 'value': { '$ne': None } } },
+            { '$facet': {
+                'bounds': [ { '$group': { '_id': None, 'min': { '$min': '$value' }, 'max': { '$max': '$value' }, 'count': { '$sum': 1 } } } ],
+                'buckets': [ { '$bucketAuto': { 'groupBy': '$value', 'buckets': buckets } } ] } }
+        ]
+        return pipeline
+
+    def range_stats(self, queryset, name, buckets=None):
+        """
+        bounds and histogram of target of range filter, under all other active filters
+
+        Runs single aggregation, with $group for bounds and $bucketAuto for histogram in $facet.
+        Returns { 'min', 'max', 'count', 'buckets': [ { 'min', 'max', 'count' } ] }, bucket max is exclusive except for the last one.
+        Cached by fingerprint of filtered queryset for stats_ttl seconds, if set.
+        """
+        if buckets is None:
+            buckets = self.stats_buckets
+        filtered = self.filter_queryset(queryset, exclude=(name,))
+        pipeline = self.range_stats_pipeline(filtered, name, buckets)
+        stats = { 'min': None, 'max': None, 'count': 0, 'buckets': [] }
+        if getattr(filtered, '_none', False):
+            return stats
+
+        key = (self.fingerprint(filtered), self.target_path(queryset._document, name)[0], buckets)
+        if self.stats_ttl:
+            cached = self.stats_cache.get(key, None)
+            if cached is not None:
+                return cached
+
+        result = list(filtered._collection.aggregate(pipeline))
+        if result and result[0]['bounds']:
+            bounds = result[0]['bounds'][0]
+            stats.update(min=bounds['min'], max=bounds['max'], count=bounds['count'])
+            stats['buckets'] = [ { 'min': bucket['_id']['min'], 'max': bucket['_id']['max'], 'count': bucket['count'] }
+                                 for bucket in result[0]['buckets'] ]
+
+        if self.stats_ttl:
+            self.stats_cache.set(key, stats, ttl=self.stats_ttl)
+        return stats
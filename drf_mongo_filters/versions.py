@@ -0,0 +1,73 @@
+import time
+import uuid
+from django.conf import settings
+from mongoengine import signals
+
+
+class ChangeVersions():
+    """ versions of collections, changed on every save or delete
+
+    Version is a random token with time of change, stored in cache under collection name for ttl seconds.
+    Missing and expired versions are created on access, so that changes not seen by the cache
+    are seen by clients after ttl at most.
+
+    Bumped by mongoengine post_save, post_delete and post_bulk_insert signals of all documents (if blinker is installed),
+    in the process handling the change only. Signals are connected on first get (as by ConditionalListMixin) or explicit connect,
+    so that importing the module has no side effects. Not seen are:
+    - changes made before the signals are connected, so processes only writing documents should call connect at startup
+    - updates and deletes bypassing signals, like QuerySet.update, QuerySet.delete or writes of other applications,
+      which should call bump explicitly
+    - changes of referenced documents, which are not part of the collection
+    - with cache not shared between processes, changes made by other processes
+
+    Args:
+    - cache: object with get(key, default) and set(key, value, timeout), like django cache or TTLCache;
+      by default, django cache named in settings.MONGO_FILTERS_VERSIONS_CACHE ('default'),
+      which should be shared (like memcached or redis) to see changes made by all processes
+    - prefix: prefix of cache keys
+    - ttl: max age of versions in seconds, bounding staleness of changes not seen
+    """
+    def __init__(self, cache=None, prefix='drf_mongo_filters.version.', ttl=30):
+        self._cache = cache
+        self.prefix = prefix
+        self.ttl = ttl
+        self.connected = False
+
+    def connect(self):
+        """ connect to signals of all documents, once """
+        if self.connected or not signals.signals_available:
+            return
+        for signal in (signals.post_save, signals.post_delete, signals.post_bulk_insert):
+            signal.connect(self.changed)
+        self.connected = True
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            from django.core.cache import caches
+            self._cache = caches[getattr(settings, 'MONGO_FILTERS_VERSIONS_CACHE', 'default')]
+        return self._cache
+
+    def key(self, document):
+        return self.prefix + document._get_collection_name()
+
+    def changed(self, sender, **kwargs):
+        if hasattr(sender, '_get_collection_name'):
+            self.bump(sender)
+
+    def bump(self, document):
+        """ set new version of document collection """
+        version = (uuid.uuid4().hex, time.time())
+        self.cache.set(self.key(document), version, self.ttl)
+        return version
+
+    def get(self, document):
+        """ return (token, timestamp) of current version of document collection """
+        self.connect()
+        version = self.cache.get(self.key(document), None)
+        if version is None:
+            version = self.bump(document)
+        return version
+
+
+versions = ChangeVersions()
@@ -8,6 +8,9 @@ setup(
     install_requires=["Django == 1.7",
                       "mongoengine >= 0.8, < 0.9",
                       "djangorestframework >= 3.0, < 3.1"],
+    extras_require={
+        "columnar": ["numpy"],
+    },
     # metadata for upload to PyPI
     author="Maxim Vasiliev",
     author_email="qwiglydee@gmail.com",
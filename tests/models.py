@@ -1,7 +1,8 @@
 from mongoengine import fields, Document, EmbeddedDocument
 
 class RefDoc(Document):
-    pass
+    name = fields.StringField()
+    rank = fields.IntField()
 
 class SimpleDoc(Document):
     f_str = fields.StringField()
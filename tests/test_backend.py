@@ -8,6 +8,8 @@ from mongoengine import Document, fields
 from drf_mongo_filters.filtersets import filters, Filterset, ModelFilterset
 from drf_mongo_filters.backend import MongoFilterBackend
 
+from .models import SimpleDoc
+
 class Tests(TestCase):
     def test_view(self):
         class TestFilter(Filterset):
@@ -22,6 +24,28 @@ class Tests(TestCase):
         TestView.as_view()(APIRequestFactory().get("/?foo=Foo"))
         TestView.queryset.filter.assert_called_once_with(foo="Foo")
 
+    def test_own_init(self):
+        class TestFilter(Filterset):
+            foo = filters.CharFilter()
+
+            class Meta:
+                scope = { 'owner': 'user.username' }
+
+            def __init__(self, query):
+                super().__init__(query)
+
+        class TestView(ListAPIView):
+            filter_backends = (MongoFilterBackend,)
+            filter_class = TestFilter
+            serializer_class = mock.Mock()
+            queryset = mock.Mock()
+
+        request = APIRequestFactory().get("/?foo=Foo")
+        request.user = mock.Mock(username="alice")
+        TestView.as_view()(request)
+        TestView.queryset.filter.assert_any_call(owner="alice")
+        TestView.queryset.filter.return_value.filter.assert_called_once_with(foo="Foo")
+
     def test_unknown_class(self):
         """ filter_class should be our Filterset """
         class Dumb():
@@ -77,3 +101,18 @@ class Tests(TestCase):
             queryset = BarDoc.objects
 
         BarView.as_view()(APIRequestFactory().get("/?foo=Foo"))
+
+    def test_fetch_key(self):
+        class Backend(MongoFilterBackend):
+            coalesce = True
+        keys = []
+        def do(key, func, timeout=None):
+            keys.append(key)
+            return func()
+        backend = Backend()
+        queryset = SimpleDoc.objects.all()
+        with mock.patch.object(Backend.single_flight, 'do', side_effect=do):
+            for qs in (queryset, queryset.scalar('f_int'), queryset.as_pymongo(), queryset.no_dereference(), queryset):
+                backend.fetch(qs, 0, 10)
+        self.assertEqual(len(set(keys)), 4)
+        self.assertEqual(keys[0], keys[-1])
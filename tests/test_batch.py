@@ -0,0 +1,129 @@
+from unittest import TestCase
+from unittest import mock
+from django.http import QueryDict
+from mongoengine import Document, fields as db_fields
+from pymongo.errors import OperationFailure
+from rest_framework import serializers, fields
+from rest_framework.test import APIRequestFactory
+
+from drf_mongo_filters import filters, Filterset
+from drf_mongo_filters.generics import FilteredBatchAPIView
+
+class WidgetDoc(Document):
+    kind = db_fields.StringField()
+    size = db_fields.IntField()
+
+class WidgetFS(Filterset):
+    kind = filters.CharFilter()
+    kinds = filters.AnyFilter(source='kind')
+    size = filters.RangeFilter(child=fields.IntegerField())
+
+class MakerDoc(Document):
+    name = db_fields.StringField()
+
+class PartDoc(Document):
+    maker = db_fields.ReferenceField(MakerDoc)
+    size = db_fields.IntField()
+
+class PartFS(Filterset):
+    maker = filters.ReferenceAttrFilter(MakerDoc, valid_keys=('name',), max_ids=1)
+    size = filters.RangeFilter(child=fields.IntegerField())
+
+class WidgetSerializer(serializers.Serializer):
+    kind = serializers.CharField()
+    size = serializers.IntegerField()
+
+class TestView(FilteredBatchAPIView):
+    filter_class = WidgetFS
+    serializer_class = WidgetSerializer
+    batch_limit = 4
+
+    def get_queryset(self):
+        return WidgetDoc.objects.order_by('size')
+
+class BatchTests(TestCase):
+    def setUp(self):
+        for i in range(6):
+            WidgetDoc.objects.create(kind="a" if i % 2 else "b", size=i)
+
+    def tearDown(self):
+        WidgetDoc.objects.delete()
+
+    def post(self, data):
+        return TestView.as_view()(APIRequestFactory().post("/", data, format='json'))
+
+    def test_batch(self):
+        collection = type(WidgetDoc._get_collection())
+        with mock.patch.object(collection, 'aggregate', autospec=True, side_effect=collection.aggregate) as aggregate:
+            response = self.post({
+                'small': { 'size.max': 2 },
+                'odd': { 'kind': "a", 'offset': 1, 'limit': 1 },
+                'lists': { 'kinds': ["a", "b"], 'size.min': "4" },
+            })
+        self.assertEqual(aggregate.call_count, 1)
+        pipeline = aggregate.call_args[0][1]
+        self.assertEqual(pipeline[0], { '$match': { '$or': [
+            { 'size': { '$lte': 2 } },
+            { 'kind': "a" },
+            { 'kind': { '$in': ["a", "b"] }, 'size': { '$gte': 4 } } ] } })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.data.keys()), ['small', 'odd', 'lists'])
+        self.assertEqual(response.data['small']['count'], 3)
+        self.assertEqual([ w['size'] for w in response.data['small']['results'] ], [0, 1, 2])
+        self.assertEqual(response.data['odd'], { 'count': 3, 'results': [ { 'kind': "a", 'size': 3 } ] })
+        self.assertEqual(response.data['lists']['count'], 2)
+
+    def test_errors(self):
+        response = self.post({
+            'good': { 'kind': "a" },
+            'bad': { 'size.min': "foo" },
+            'page': { 'limit': 0 },
+            'params': "kind=a",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['good']['count'], 3)
+        self.assertIn('errors', response.data['bad'])
+        self.assertIn('limit', response.data['page']['errors'])
+        self.assertIn('errors', response.data['params'])
+
+    def test_unsatisfiable(self):
+        collection = type(WidgetDoc._get_collection())
+        with mock.patch.object(collection, 'aggregate', autospec=True) as aggregate:
+            response = self.post({ 'none': { 'size.min': 5, 'size.max': 1 } })
+        aggregate.assert_not_called()
+        self.assertEqual(response.data['none'], { 'count': 0, 'results': [] })
+
+    def test_limits(self):
+        self.assertEqual(self.post({ 'a': {}, 'b': {}, 'c': {}, 'd': {}, 'e': {} }).status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+
+    def test_too_large(self):
+        collection = type(WidgetDoc._get_collection())
+        aggregate = collection.aggregate
+
+        def facet_too_large(self, pipeline, *args, **kwargs):
+            if 'results1' in pipeline[-1].get('$facet', {}):
+                raise OperationFailure("document constructed by $facet is too large", code=4031700)
+            return aggregate(self, pipeline, *args, **kwargs)
+
+        with mock.patch.object(collection, 'aggregate', autospec=True, side_effect=facet_too_large) as mocked:
+            response = self.post({ 'small': { 'size.max': 2 }, 'odd': { 'kind': "a", 'limit': 1 } })
+        self.assertEqual(mocked.call_count, 3)
+        self.assertEqual(response.data['small']['count'], 3)
+        self.assertEqual(response.data['odd'], { 'count': 3, 'results': [ { 'kind': "a", 'size': 1 } ] })
+
+    def test_references(self):
+        acme = [ MakerDoc.objects.create(name="acme") for i in range(2) ]
+        other = MakerDoc.objects.create(name="other")
+        parts = [ PartDoc.objects.create(maker=maker, size=i) for i, maker in enumerate(acme + [ other ]) ]
+        try:
+            results = PartFS.batch_queries(PartDoc.objects.order_by('size'), {
+                'acme': (QueryDict("maker.name=acme"), 0, 10),
+                'none': (QueryDict("maker.name=acme&size.min=5&size.max=1"), 0, 10),
+            })
+        finally:
+            PartDoc.objects.delete()
+            MakerDoc.objects.delete()
+        self.assertEqual(results['acme']['count'], 2)
+        self.assertEqual([ part.id for part in results['acme']['results'] ], [ part.id for part in parts[:2] ])
+        self.assertEqual(results['none'], { 'results': [], 'count': 0 })
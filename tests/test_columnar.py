@@ -0,0 +1,123 @@
+import gc
+import weakref
+from unittest import TestCase, skipIf
+from unittest import mock
+from datetime import datetime
+from bson import ObjectId
+from rest_framework import fields
+from rest_framework.filters import OrderingFilter
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from drf_mongo_filters import filters, Filterset
+from drf_mongo_filters import columnar
+from drf_mongo_filters.columnar import ColumnarFilterBackend, ColumnarSnapshot, Unsupported
+
+from .models import SimpleDoc
+
+@skipIf(columnar.np is None, "numpy is not installed")
+class ColumnarTests(TestCase):
+    def setUp(self):
+        ColumnarFilterBackend.snapshots.clear()
+        self.objects = [
+            SimpleDoc.objects.create(f_str="foo", f_int=1, f_flt=0.5, f_bool=True, f_dt=datetime(2015, 1, 1)),
+            SimpleDoc.objects.create(f_str="bar", f_int=2, f_flt=1.5, f_bool=False, f_dt=datetime(2015, 1, 2)),
+            SimpleDoc.objects.create(f_str="baz", f_int=3, f_bool=True, f_dt=datetime(2015, 1, 3)),
+            SimpleDoc.objects.create(f_str="quz", f_int=None),
+            SimpleDoc.objects.create(),
+        ]
+
+    def tearDown(self):
+        SimpleDoc.objects.delete()
+
+    def filter(self, query, documents=True, queryset=None, backends=None):
+        class FS(Filterset):
+            s = filters.CharFilter(source='f_str')
+            s_in = filters.AnyFilter(source='f_str')
+            s_nin = filters.NoneFilter(source='f_str')
+            i_gte = filters.IntegerFilter('gte', source='f_int')
+            i_ne = filters.IntegerFilter('ne', source='f_int')
+            f = filters.RangeFilter(child=fields.FloatField(), source='f_flt')
+            b = filters.BooleanFilter(source='f_bool')
+            dt = filters.DateTimeFilter('lt', source='f_dt')
+            ex = filters.ExistsFilter(source='f_int')
+            sw = filters.CharFilter('startswith', source='f_str')
+
+        class Backend(ColumnarFilterBackend):
+            columnar_documents = documents
+
+        if queryset is None:
+            queryset = SimpleDoc.objects.all()
+        view = mock.Mock(filter_class=FS, filter_backends=(Backend,) + tuple(backends or ()))
+        request = Request(APIRequestFactory().get("/?" + query))
+        result = Backend().filter_queryset(request, queryset, view)
+        expected = FS(request.query_params).filter_queryset(SimpleDoc.objects.all())
+        return result, expected
+
+    def assertSameResults(self, query, documents=True):
+        result, expected = self.filter(query, documents)
+        if documents:
+            self.assertIsInstance(result, list)
+        self.assertEqual(set(doc.id for doc in result), set(doc.id for doc in expected))
+
+    def test_equality(self):
+        for query in ("s=foo", "s_in=foo&s_in=bar", "s_nin=foo&s_nin=bar", "b=true", "b=false", "i_ne=2"):
+            self.assertSameResults(query)
+
+    def test_comparision(self):
+        for query in ("i_gte=2", "f.min=0&f.max=1", "f.min=1", "dt=2015-01-02T00:00:00", "i_gte=2&s_nin=baz"):
+            self.assertSameResults(query)
+
+    def test_exists(self):
+        self.assertSameResults("ex=true")
+        self.assertSameResults("ex=false")
+
+    def test_ids(self):
+        self.assertSameResults("i_gte=2", documents=False)
+
+    def test_queryset_kept(self):
+        for queryset, backends in (
+                (SimpleDoc.objects.all(), [OrderingFilter]),
+                (SimpleDoc.objects.only('f_str'), []),
+                (SimpleDoc.objects.hint([('_id', 1)]), [])):
+            result, expected = self.filter("i_gte=2", queryset=queryset, backends=backends)
+            self.assertNotIsInstance(result, list)
+            self.assertEqual(result._query, { '_id': { '$in': [ doc.id for doc in self.objects[1:3] ] } })
+        result, expected = self.filter("i_gte=2", queryset=SimpleDoc.objects.only('f_str'))
+        self.assertIsNone(list(result)[0].f_int)
+
+    def test_collation(self):
+        result, expected = self.filter("s=FOO", queryset=SimpleDoc.objects.collation({ 'locale': 'en', 'strength': 2 }))
+        self.assertNotIsInstance(result, list)
+        self.assertEqual(result._query, { 'f_str': "FOO" })
+
+    def test_snapshots_weak(self):
+        self.assertSameResults("s=foo")
+        self.assertIsInstance(ColumnarFilterBackend.snapshots, weakref.WeakKeyDictionary)
+        gc.collect()
+        self.assertEqual(len(ColumnarFilterBackend.snapshots), 0)
+
+    def test_unsupported(self):
+        result, expected = self.filter("sw=ba")
+        self.assertNotIsInstance(result, list)
+        self.assertEqual(set(doc.id for doc in result), set(doc.id for doc in self.objects[1:3]))
+
+    def test_invalidated(self):
+        self.assertSameResults("s=new")
+        SimpleDoc.objects.create(f_str="new")
+        self.assertSameResults("s=new")
+
+    def test_ttl(self):
+        now = [0]
+        snapshot = ColumnarSnapshot(SimpleDoc, ['f_int'], ttl=10, timer=lambda: now[0])
+        self.assertEqual(len(snapshot.filter({'f_int': 1})), 1)
+        SimpleDoc._get_collection().insert_one({'f_int': 1})
+        self.assertEqual(len(snapshot.filter({'f_int': 1})), 1)
+        now[0] = 10
+        self.assertEqual(len(snapshot.filter({'f_int': 1})), 2)
+
+    def test_mixed_types(self):
+        SimpleDoc._get_collection().insert_one({'f_int': "1"})
+        snapshot = ColumnarSnapshot(SimpleDoc, ['f_int'])
+        with self.assertRaises(Unsupported):
+            snapshot.filter({'f_int': 1})
@@ -0,0 +1,120 @@
+from unittest import TestCase
+from unittest import mock
+from django.utils.http import http_date
+from rest_framework import serializers
+from rest_framework.test import APIRequestFactory
+
+from drf_mongo_filters import filters, Filterset, MongoFilterBackend
+from drf_mongo_filters.cache import TTLCache
+from drf_mongo_filters.generics import ConditionalListAPIView, FilteredBulkAPIView
+from drf_mongo_filters.versions import ChangeVersions
+
+from .models import SimpleDoc
+
+class TestSerializer(serializers.Serializer):
+    f_str = serializers.CharField()
+    f_int = serializers.IntegerField()
+
+class TestFilter(Filterset):
+    foo = filters.CharFilter(source='f_str')
+
+versions = ChangeVersions(TTLCache())
+
+class TestView(ConditionalListAPIView):
+    filter_backends = (MongoFilterBackend,)
+    filter_class = TestFilter
+    serializer_class = TestSerializer
+    change_versions = versions
+
+    def get_queryset(self):
+        return SimpleDoc.objects.all()
+
+class BulkView(FilteredBulkAPIView):
+    filter_class = TestFilter
+    serializer_class = TestSerializer
+    change_versions = versions
+
+    def get_queryset(self):
+        return SimpleDoc.objects.all()
+
+class VersionsTests(TestCase):
+    def tearDown(self):
+        SimpleDoc.objects.delete()
+
+    def test_versions(self):
+        version = versions.get(SimpleDoc)
+        self.assertEqual(versions.get(SimpleDoc), version)
+        doc = SimpleDoc.objects.create(f_str="foo")
+        self.assertNotEqual(versions.get(SimpleDoc), version)
+        version = versions.get(SimpleDoc)
+        doc.delete()
+        self.assertNotEqual(versions.get(SimpleDoc), version)
+
+    def test_versions_connect(self):
+        lazy = ChangeVersions(TTLCache())
+        version = lazy.bump(SimpleDoc)
+        SimpleDoc.objects.create(f_str="foo")
+        self.assertFalse(lazy.connected)
+        self.assertEqual(lazy.get(SimpleDoc), version)
+        self.assertTrue(lazy.connected)
+        SimpleDoc.objects.create(f_str="foo")
+        self.assertNotEqual(lazy.get(SimpleDoc), version)
+
+    def test_versions_expire(self):
+        now = [0]
+        expiring = ChangeVersions(TTLCache(timer=lambda: now[0]), ttl=30)
+        version = expiring.get(SimpleDoc)
+        now[0] = 29
+        self.assertEqual(expiring.get(SimpleDoc), version)
+        now[0] = 31
+        self.assertNotEqual(expiring.get(SimpleDoc), version)
+
+    def test_versions_django_cache(self):
+        from django.core.cache import caches
+        default = ChangeVersions()
+        self.assertIs(default.cache, caches['default'])
+        version = default.bump(SimpleDoc)
+        self.assertEqual(caches['default'].get(default.key(SimpleDoc)), version)
+
+class ConditionalTests(TestCase):
+    def setUp(self):
+        self.objects = [
+            SimpleDoc.objects.create(f_str="foo", f_int=1),
+            SimpleDoc.objects.create(f_str="bar", f_int=2),
+        ]
+
+    def tearDown(self):
+        SimpleDoc.objects.delete()
+
+    def get(self, url, **headers):
+        return TestView.as_view()(APIRequestFactory().get(url, **headers))
+
+    def test_etag(self):
+        response = self.get("/?foo=foo")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+        etag = response['ETag']
+        self.assertEqual(self.get("/?foo=foo")['ETag'], etag)
+        self.assertNotEqual(self.get("/?foo=bar")['ETag'], etag)
+
+        with mock.patch.object(TestView, 'get_serializer') as get_serializer:
+            response = self.get("/?foo=foo", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(get_serializer.called)
+
+        SimpleDoc.objects.create(f_str="foo", f_int=3)
+        response = self.get("/?foo=foo", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+
+    def test_modified_since(self):
+        response = self.get("/")
+        modified = response['Last-Modified']
+        self.assertEqual(self.get("/", HTTP_IF_MODIFIED_SINCE=modified).status_code, 304)
+        self.assertEqual(self.get("/", HTTP_IF_MODIFIED_SINCE=http_date(0)).status_code, 200)
+
+    def test_bulk(self):
+        etag = self.get("/?foo=foo")['ETag']
+        BulkView.as_view()(APIRequestFactory().patch("/?foo=foo", { 'f_int': 5 }, format='json'))
+        self.assertEqual(self.get("/?foo=foo", HTTP_IF_NONE_MATCH=etag).status_code, 200)
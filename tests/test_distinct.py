@@ -0,0 +1,84 @@
+from unittest import TestCase
+from unittest import mock
+from mongoengine import Document, fields as db_fields
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIRequestFactory
+
+from drf_mongo_filters import filters, Filterset
+from drf_mongo_filters.generics import FilterValuesAPIView
+
+class ValuesDoc(Document):
+    kind = db_fields.StringField()
+    color = db_fields.StringField()
+    tags = db_fields.ListField(db_fields.StringField())
+    meta = { 'indexes': [ 'kind' ] }
+
+class TestFS(Filterset):
+    kind = filters.AnyFilter()
+    color = filters.CharFilter()
+    tags = filters.CharFilter()
+    not_field = filters.IntersectRangeFilter(sources=('kind', 'color'))
+
+class TestView(FilterValuesAPIView):
+    filter_class = TestFS
+
+    def get_queryset(self):
+        return ValuesDoc.objects.all()
+
+class DistinctTests(TestCase):
+    def setUp(self):
+        TestFS.distinct_cache.clear()
+        ValuesDoc.objects.create(kind="a", color="red", tags=["x", "y"])
+        ValuesDoc.objects.create(kind="b", color="red", tags=["y", "z"])
+        ValuesDoc.objects.create(kind="c", color="blue")
+        ValuesDoc.objects.create(color="blue")
+
+    def tearDown(self):
+        ValuesDoc.objects.delete()
+
+    def test_indexed(self):
+        fs = TestFS({ 'color': "red", 'kind': ["a"] })
+        with mock.patch.object(type(ValuesDoc._get_collection()), 'aggregate') as aggregate:
+            self.assertEqual(fs.distinct_values(ValuesDoc.objects.all(), 'kind'), (["a", "b"], False))
+            ValuesDoc.objects.create(kind="0")
+            self.assertEqual(TestFS({}).distinct_values(ValuesDoc.objects.all(), 'kind', limit=2), (["0", "a"], True))
+        self.assertFalse(aggregate.called)
+
+    def test_pipeline(self):
+        fs = TestFS({ 'color': "red", 'kind': ["a"] })
+        with mock.patch.object(type(ValuesDoc._get_collection()), 'aggregate', return_value=[]) as aggregate:
+            fs.distinct_values(ValuesDoc.objects.all(), 'color', limit=5)
+        pipeline = aggregate.call_args[0][0]
+        self.assertEqual(pipeline[0], { '$match': { 'kind': "a" } })
+        self.assertEqual(pipeline[-2:], [ { '$sort': { '_id': 1 } }, { '$limit': 6 } ])
+
+    def test_aggregated(self):
+        fs = TestFS({ 'kind': ["a", "c"] })
+        self.assertEqual(fs.distinct_values(ValuesDoc.objects.all(), 'color'), (["blue", "red"], False))
+        self.assertEqual(fs.distinct_values(ValuesDoc.objects.all(), 'tags'), (["x", "y"], False))
+
+    def test_capped(self):
+        self.assertEqual(TestFS({}).distinct_values(ValuesDoc.objects.all(), 'tags', limit=2), (["x", "y"], True))
+        self.assertEqual(TestFS({}).distinct_values(ValuesDoc.objects.all(), 'color', limit=1), (["blue"], True))
+
+    def test_cached(self):
+        class CachedFS(TestFS):
+            distinct_ttl = 60
+        fs = CachedFS({})
+        self.assertEqual(fs.distinct_values(ValuesDoc.objects.all(), 'color'), (["blue", "red"], False))
+        ValuesDoc.objects.create(color="green")
+        self.assertEqual(fs.distinct_values(ValuesDoc.objects.all(), 'color'), (["blue", "red"], False))
+        self.assertEqual(TestFS({}).distinct_values(ValuesDoc.objects.all(), 'color'), (["blue", "green", "red"], False))
+
+    def test_invalid(self):
+        fs = TestFS({})
+        with self.assertRaises(ValidationError):
+            fs.distinct_values(ValuesDoc.objects.all(), 'unknown')
+        with self.assertRaises(ValidationError):
+            fs.distinct_values(ValuesDoc.objects.all(), 'not_field')
+
+    def test_view(self):
+        response = TestView.as_view()(APIRequestFactory().get("/?field=kind&color=blue"))
+        self.assertEqual(response.data, { 'values': ["c"], 'capped': False })
+        response = TestView.as_view()(APIRequestFactory().get("/"))
+        self.assertEqual(response.status_code, 400)
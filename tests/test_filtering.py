@@ -1,12 +1,15 @@
 from unittest import TestCase
+from unittest import mock
 from datetime import date, datetime, timedelta
 from uuid import uuid4
 from bson import ObjectId
+from django.http import QueryDict
 
 from rest_framework import fields
+from rest_framework.exceptions import ValidationError
 from drf_mongo_filters import filters, Filterset, ModelFilterset
 
-from .models import SimpleDoc, DeepDoc, EmbDoc
+from .models import SimpleDoc, DeepDoc, EmbDoc, RefDoc
 
 class QuerysetTesting():
     def assertQuerysetDocs(self, qs, docs):
@@ -164,6 +167,26 @@ class BasicTests(QuerysetTesting, TestCase):
         qs = fs.filter_queryset(SimpleDoc.objects.all())
         self.assertQuerysetDocs(qs, objects[1:3])
 
+    def test_date(self):
+        objects = [
+            SimpleDoc.objects.create(f_dt=datetime(2015, 1, 1, 23, 59)),
+            SimpleDoc.objects.create(f_dt=datetime(2015, 1, 2, 0, 0)),
+            SimpleDoc.objects.create(f_dt=datetime(2015, 1, 2, 23, 59)),
+            SimpleDoc.objects.create(f_dt=datetime(2015, 1, 3, 0, 0)),
+        ]
+
+        class FS(Filterset):
+            foo = filters.DateFilter(source='f_dt')
+            bar = filters.DateRangeFilter(source='f_dt')
+
+        fs = FS({'foo': "2015-01-02"})
+        qs = fs.filter_queryset(SimpleDoc.objects.all())
+        self.assertQuerysetDocs(qs, objects[1:3])
+
+        fs = FS({'bar': {'min': "2015-01-01T23:59", 'max': "2015-01-02"}})
+        qs = fs.filter_queryset(SimpleDoc.objects.all())
+        self.assertQuerysetDocs(qs, objects[0:3])
+
     def test_oid(self):
         oid = ObjectId()
         objects = [
@@ -271,6 +294,127 @@ class CompoundTests(QuerysetTesting, TestCase):
         qs = fs.filter_queryset(SimpleDoc.objects.all())
         self.assertQuerysetDocs(qs, objects[1:-1])
 
+    def test_range_intersect_sentinels(self):
+        low, high = -2**63, 2**63-1
+        objects = [
+            SimpleDoc.objects.create(f_rng_beg=1, f_rng_end=3),
+            SimpleDoc.objects.create(f_rng_beg=2, f_rng_end=None), # 4-6
+            SimpleDoc.objects.create(f_rng_end=5), # 4-6
+            SimpleDoc.objects.create(f_rng_beg=low, f_rng_end=high), # 4-6
+            SimpleDoc.objects.create(f_rng_beg=7, f_rng_end=9)
+        ]
+
+        class FS(Filterset):
+            foo = filters.IntersectRangeFilter(('f_rng_beg','f_rng_end'), sentinels=(low, high), child=fields.IntegerField())
+
+        self.assertEqual(FS.compile()['foo'].fill_sentinels(SimpleDoc.objects.all()), (1, 1))
+        self.assertEqual(SimpleDoc.objects.filter(f_rng_beg=low).count(), 2)
+
+        fs = FS({'foo': {'min':4, 'max':6}})
+        qs = fs.filter_queryset(SimpleDoc.objects.all())
+        self.assertEqual(qs._query, { 'f_rng_beg': { '$lte': 6 }, 'f_rng_end': { '$gte': 4 } })
+        self.assertQuerysetDocs(qs, objects[1:-1])
+
+        fs = FS({'foo': {'min':8}})
+        qs = fs.filter_queryset(SimpleDoc.objects.all())
+        self.assertEqual(qs._query, { 'f_rng_end': { '$gte': 8 } })
+
+
+class ReferenceAttrTests(QuerysetTesting, TestCase):
+    def setUp(self):
+        filters.ReferenceAttrFilter.cache.clear()
+
+    def tearDown(self):
+        SimpleDoc.objects.delete()
+        RefDoc.objects.delete()
+
+    def test_ref_attr(self):
+        refs = [
+            RefDoc.objects.create(name="foo", rank=1),
+            RefDoc.objects.create(name="bar", rank=1),
+            RefDoc.objects.create(name="bar", rank=2),
+        ]
+        objects = [ SimpleDoc.objects.create(f_ref=ref) for ref in refs ]
+
+        class FS(Filterset):
+            foo = filters.ReferenceAttrFilter(RefDoc, valid_keys=('name', 'rank'), source='f_ref')
+
+        fs = FS({'foo': {'name': "bar"}})
+        qs = fs.filter_queryset(SimpleDoc.objects.all())
+        self.assertQuerysetDocs(qs, objects[1:3])
+
+        fs = FS({'foo': {'name': "bar", 'rank': "2"}})
+        qs = fs.filter_queryset(SimpleDoc.objects.all())
+        self.assertQuerysetDocs(qs, objects[2:3])
+
+    def test_ref_attr_cached(self):
+        ref = RefDoc.objects.create(name="foo")
+        obj = SimpleDoc.objects.create(f_ref=ref)
+
+        class FS(Filterset):
+            foo = filters.ReferenceAttrFilter(RefDoc, valid_keys=('name', 'rank'), source='f_ref', cache_ttl=60)
+            bar = filters.ReferenceAttrFilter(RefDoc, valid_keys=('name', 'rank'), source='f_ref')
+
+        fs = FS({'foo': {'name': "foo"}})
+        self.assertQuerysetDocs(fs.filter_queryset(SimpleDoc.objects.all()), [obj])
+
+        ref2 = RefDoc.objects.create(name="foo")
+        fs = FS({'foo': {'name': "foo"}, 'bar': {'name': "foo"}})
+        self.assertEqual(fs.filters['foo'].filter_params(fs.values['foo']), {'f_ref__in': [ref.id]})
+        self.assertEqual(fs.filters['bar'].filter_params(fs.values['bar']), {'f_ref__in': [ref.id, ref2.id]})
+
+        # keyed by database of referenced collection
+        collection = type(RefDoc._get_collection())
+        with mock.patch.object(collection, 'full_name', new_callable=mock.PropertyMock, return_value='other_db.ref_doc'):
+            self.assertEqual(fs.filters['foo'].filter_params(fs.values['foo']), {'f_ref__in': [ref.id, ref2.id]})
+
+    def test_ref_attr_keys(self):
+        class FS(Filterset):
+            foo = filters.ReferenceAttrFilter(RefDoc, valid_keys=('name', 'rank__gte'), source='f_ref')
+
+        for key in ('name__regex', 'rank', '__raw__'):
+            fs = FS({'foo': {key: "a"}})
+            with self.assertRaises(ValidationError):
+                fs.filter_queryset(SimpleDoc.objects.all())
+
+        fs = FS({'foo': {'rank__gte': "2"}})
+        self.assertEqual(fs.filters['foo'].filter_params(fs.values['foo']), {'f_ref__in': []})
+
+        with self.assertRaises(TypeError):
+            filters.ReferenceAttrFilter(RefDoc, source='f_ref')
+        with self.assertRaises(TypeError):
+            filters.ReferenceAttrFilter(RefDoc, valid_keys=('name__where',), source='f_ref')
+        with self.assertRaises(TypeError):
+            filters.ReferenceAttrFilter(RefDoc, valid_keys=('__raw__',), source='f_ref')
+        with self.assertRaises(TypeError):
+            filters.ReferenceAttrFilter(RefDoc, valid_keys=('password',), source='f_ref')
+
+    def test_ref_attr_cache_key(self):
+        ref = RefDoc.objects.create(name="foo")
+
+        class FS(Filterset):
+            foo = filters.ReferenceAttrFilter(RefDoc, valid_keys=('name',), child=fields.ListField(), source='f_ref')
+
+        self.assertEqual(FS.compile()['foo'].resolve_ids({'name': ["foo"]}), [])
+
+    def test_ref_attr_lookup(self):
+        refs = [ RefDoc.objects.create(name="foo") for i in range(3) ]
+        refs.append(RefDoc.objects.create(name="bar"))
+        objects = [ SimpleDoc.objects.create(f_ref=ref, f_int=i) for i, ref in enumerate(refs) ]
+
+        class FS(Filterset):
+            foo = filters.ReferenceAttrFilter(RefDoc, max_ids=2, valid_keys=('name',), source='f_ref')
+            bar = filters.IntegerFilter('gte', source='f_int')
+
+        fs = FS({'foo': {'name': "foo"}, 'bar': 1})
+        with self.assertRaises(ValidationError):
+            fs.filter_queryset(SimpleDoc.objects.all())
+
+        pipeline = fs.filter_pipeline(SimpleDoc.objects.all())
+        self.assertEqual([list(stage.keys())[0] for stage in pipeline], ['$match', '$lookup', '$match', '$project'])
+        ids = [ doc['_id'] for doc in SimpleDoc._get_collection().aggregate(pipeline) ]
+        self.assertEqual(set(ids), set([ objects[1].id, objects[2].id ]))
+
 
 class DeepFieldsTests(QuerysetTesting, TestCase):
     def tearDown(self):
@@ -312,6 +456,38 @@ class DeepFieldsTests(QuerysetTesting, TestCase):
         qs = fs.filter_queryset(DeepDoc.objects.all())
         self.assertQuerysetDocs(qs, objects[1:])
 
+    def test_map_keys(self):
+        objects = [
+            DeepDoc.objects.create(f_map={'foo':1, 'bar':1}),
+            DeepDoc.objects.create(f_map={'foo':2, 'bar':3}),
+            DeepDoc.objects.create(f_map={'foo':3})
+        ]
+        class FS(Filterset):
+            m = filters.MapFilter('gte', source='f_map', child=fields.IntegerField())
+        fs = FS(QueryDict("m.foo=2&m.bar=2"))
+        self.assertEqual(fs.filters['m'].filter_params(fs.values['m']), { '__raw__': { 'f_map.foo': { '$gte': 2 }, 'f_map.bar': { '$gte': 2 } } })
+        qs = fs.filter_queryset(DeepDoc.objects.all())
+        self.assertQuerysetDocs(qs, objects[1:2])
+
+    def test_dict_keys(self):
+        objects = [
+            DeepDoc.objects.create(f_dict={'foo':"foo1", 'bar':"bar1"}),
+            DeepDoc.objects.create(f_dict={'foo':"foo2", 'bar':"bar2"}),
+        ]
+        class FS(Filterset):
+            d = filters.MapFilter(source='f_dict', valid_keys=['foo'])
+        qs = FS(QueryDict("d.foo=foo2")).filter_queryset(DeepDoc.objects.all())
+        self.assertQuerysetDocs(qs, objects[1:])
+        with self.assertRaises(ValidationError):
+            FS(QueryDict("d.bar=bar1")).values
+
+    def test_map_invalid_keys(self):
+        class FS(Filterset):
+            m = filters.MapFilter(source='f_map')
+        for params in ("m.foo.bar=1", "m.$where=1", "m.a%20b=1"):
+            with self.assertRaises(ValidationError):
+                FS(QueryDict(params)).values
+
     def test_emb(self):
         objects = [
             DeepDoc.objects.create(f_emb=EmbDoc(foo="foo1", bar="bar1")),
@@ -335,3 +511,172 @@ class DeepFieldsTests(QuerysetTesting, TestCase):
         fs = FS({'foo': "foo20"})
         qs = fs.filter_queryset(DeepDoc.objects.all())
         self.assertQuerysetDocs(qs, objects[1:])
+
+    def test_emblist_match(self):
+        objects = [
+            DeepDoc.objects.create(f_emblist=[EmbDoc(foo="foo1", bar="bar1"),EmbDoc(foo="foo2", bar="bar2")]),
+            DeepDoc.objects.create(f_emblist=[EmbDoc(foo="foo1", bar="bar2"),EmbDoc(foo="foo2", bar="bar1")]),
+        ]
+        class FS(ModelFilterset):
+            class Meta:
+                model = DeepDoc
+                fields = ['f_emblist']
+        fs = FS({'f_emblist.foo': "foo1", 'f_emblist.bar': "bar2"})
+        qs = fs.filter_queryset(DeepDoc.objects.all())
+        self.assertQuerysetDocs(qs, objects[1:])
+
+    def test_emblist_match_raw(self):
+        objects = [
+            DeepDoc.objects.create(f_emblist=[EmbDoc(foo="foo1", bar="bar1"),EmbDoc(foo="foo2", bar="bar2")]),
+            DeepDoc.objects.create(f_emblist=[EmbDoc(foo="foo1", bar="bar2"),EmbDoc(foo="foo2", bar="bar1")]),
+        ]
+        class RawFilter(filters.CharFilter):
+            def filter_params(self, value):
+                return { '__raw__': { self.target: value } }
+
+        class FS(Filterset):
+            emb = filters.ElemMatchFilter(source='f_emblist', document=EmbDoc, subfilters={
+                'foo': filters.CharFilter(source='foo'),
+                'bar': RawFilter(source='bar') })
+        fs = FS({'emb.foo': "foo1", 'emb.bar': "bar2"})
+        qs = fs.filter_queryset(DeepDoc.objects.all())
+        self.assertEqual(qs._query, { 'f_emblist': { '$elemMatch': { 'foo': "foo1", 'bar': "bar2" } } })
+        self.assertQuerysetDocs(qs, objects[1:])
+
+class LogicalTests(QuerysetTesting, TestCase):
+    class FS(Filterset):
+        foo = filters.CharFilter(source='f_str')
+        bar = filters.IntegerFilter(source='f_int')
+        baz = filters.IntegerFilter('gt', source='f_int')
+        tags = filters.AnyFilter(source='f_str')
+        price = filters.RangeFilter(source='f_int', child=fields.IntegerField())
+
+    def setUp(self):
+        self.objects = [
+            SimpleDoc.objects.create(f_str="a", f_int=1),
+            SimpleDoc.objects.create(f_str="b", f_int=2),
+            SimpleDoc.objects.create(f_str="c", f_int=3),
+            SimpleDoc.objects.create(f_int=4)
+        ]
+
+    def tearDown(self):
+        SimpleDoc.objects.delete()
+
+    def query(self, params):
+        return self.FS(QueryDict(params)).logical_query(SimpleDoc)
+
+    def test_or_same_field(self):
+        self.assertEqual(self.query("or.g.foo=a&or.g.foo=b"), { 'f_str': { '$in': ["a", "b"] } })
+        self.assertEqual(self.query("or.g.foo=a&or.g.tags=b&or.g.tags=c"), { 'f_str': { '$in': ["a", "b", "c"] } })
+        qs = self.FS(QueryDict("or.g.foo=a&or.g.foo=b")).filter_queryset(SimpleDoc.objects.all())
+        self.assertQuerysetDocs(qs, self.objects[0:2])
+
+    def test_or_fields(self):
+        self.assertEqual(self.query("or.g.foo=a&or.g.bar=3"), { '$or': [ { 'f_str': "a" }, { 'f_int': 3 } ] })
+        qs = self.FS(QueryDict("or.g.foo=a&or.g.bar=3")).filter_queryset(SimpleDoc.objects.all())
+        self.assertQuerysetDocs(qs, [ self.objects[0], self.objects[2] ])
+
+    def test_or_groups(self):
+        qs = self.FS(QueryDict("or.x.foo=a&or.x.foo=b&or.y.bar=2&or.y.baz=3")).filter_queryset(SimpleDoc.objects.all())
+        self.assertQuerysetDocs(qs, self.objects[1:2])
+
+    def test_negation(self):
+        self.assertEqual(self.query("foo!=a"), { 'f_str': { '$ne': "a" } })
+        self.assertEqual(self.query("foo!=a&foo!=b"), { 'f_str': { '$nin': ["a", "b"] } })
+        self.assertEqual(self.query("tags!=a&tags!=b"), { 'f_str': { '$nin': ["a", "b"] } })
+        self.assertEqual(self.query("baz!=2"), { 'f_int': { '$not': { '$gt': 2 } } })
+        qs = self.FS(QueryDict("foo!=a&foo!=b")).filter_queryset(SimpleDoc.objects.all())
+        self.assertQuerysetDocs(qs, self.objects[2:])
+        qs = self.FS(QueryDict("baz!=2&bar!=1")).filter_queryset(SimpleDoc.objects.all())
+        self.assertQuerysetDocs(qs, self.objects[1:2])
+
+    def test_negated_range(self):
+        qs = self.FS(QueryDict("price.min!=3")).filter_queryset(SimpleDoc.objects.all())
+        self.assertQuerysetDocs(qs, self.objects[0:2])
+        qs = self.FS(QueryDict("price.max=3&price.min!=2")).filter_queryset(SimpleDoc.objects.all())
+        self.assertQuerysetDocs(qs, self.objects[0:1])
+        qs = self.FS(QueryDict("or.g.price.min=4&or.g.foo=a")).filter_queryset(SimpleDoc.objects.all())
+        self.assertQuerysetDocs(qs, [ self.objects[0], self.objects[3] ])
+
+    def test_combined(self):
+        qs = self.FS(QueryDict("foo!=c&or.g.bar=1&or.g.bar=3&or.g.bar=4")).filter_queryset(SimpleDoc.objects.all())
+        self.assertQuerysetDocs(qs, [ self.objects[0], self.objects[3] ])
+
+    def test_empty(self):
+        self.assertEqual(self.query("foo!=&or.g.foo="), {})
+
+    def test_invalid(self):
+        with self.assertRaises(ValidationError):
+            self.query("qux!=1")
+        with self.assertRaises(ValidationError):
+            self.query("or.g=1")
+        with self.assertRaises(ValidationError):
+            self.query("or.g.bar=x")
+
+class SimplifyTests(QuerysetTesting, TestCase):
+    class FS(Filterset):
+        price = filters.RangeFilter(source='f_int')
+        above = filters.IntegerFilter('gt', source='f_int')
+        exact = filters.IntegerFilter(source='f_int')
+        within = filters.AnyFilter(source='f_int')
+        has = filters.ExistsFilter(source='f_int')
+        name = filters.CharFilter(source='f_str')
+
+    def setUp(self):
+        self.objects = [ SimpleDoc.objects.create(f_int=i) for i in range(1, 6) ] + [ SimpleDoc.objects.create() ]
+
+    def tearDown(self):
+        SimpleDoc.objects.delete()
+
+    def filtered(self, params):
+        return self.FS(QueryDict(params)).filter_queryset(SimpleDoc.objects.all())
+
+    def test_bounds(self):
+        qs = self.filtered("price.min=2&price.max=4&above=2")
+        self.assertEqual(qs._query, { 'f_int': { '$gt': 2, '$lte': 4 } })
+        self.assertQuerysetDocs(qs, self.objects[2:4])
+
+    def test_point(self):
+        qs = self.filtered("price.min=2&above=1&price.max=2")
+        self.assertEqual(qs._query, { 'f_int': 2 })
+
+    def test_values(self):
+        qs = self.filtered("within=1&within=3&within=5&price.max=3&has=true")
+        self.assertEqual(qs._query, { 'f_int': { '$in': [1, 3] } })
+        self.assertQuerysetDocs(qs, [ self.objects[0], self.objects[2] ])
+
+    def test_negated(self):
+        qs = self.filtered("exact!=1&exact!=5&price.min=2&price.max=4")
+        self.assertEqual(qs._query, { 'f_int': { '$gte': 2, '$lte': 4 } })
+
+    def test_contradiction(self):
+        qs = self.FS({ 'within': [] }).filter_queryset(SimpleDoc.objects.all())
+        self.assertTrue(qs._none)
+        for params in ("price.min=10&price.max=5", "above=5&price.max=5", "has=false&exact=1",
+                       "exact=1&exact!=1", "within=1&within=2&price.min=3", "or.g.exact=1&or.g.exact=2&above=2"):
+            qs = self.filtered(params)
+            self.assertTrue(qs._none, params)
+            self.assertEqual(list(qs), [])
+
+    def test_alternatives(self):
+        qs = self.filtered("or.g.exact=1&or.g.exact=4&or.g.has=false&above=2")
+        self.assertEqual(qs._query, { 'f_int': 4 })
+        qs = self.filtered("or.g.exact=1&or.g.has=false&above=2")
+        self.assertTrue(qs._none)
+
+    def test_collation(self):
+        queryset = SimpleDoc.objects.collation({ 'locale': 'en', 'strength': 2 })
+        qs = self.FS(QueryDict("name=Foo&name!=foo")).filter_queryset(queryset)
+        self.assertFalse(qs._none)
+        self.assertEqual(qs._query, { '$and': [ { 'f_str': "Foo" }, { 'f_str': { '$ne': "foo" } } ] })
+        qs = self.FS(QueryDict("name=Foo&name!=foo")).filter_queryset(SimpleDoc.objects.all())
+        self.assertEqual(qs._query, { 'f_str': "Foo" })
+        qs = self.FS(QueryDict("name=Foo&name!=Foo")).filter_queryset(SimpleDoc.objects.all())
+        self.assertTrue(qs._none)
+
+    def test_disabled(self):
+        class FS(self.FS):
+            simplify_queries = False
+        qs = FS(QueryDict("price.min=10&price.max=5")).filter_queryset(SimpleDoc.objects.all())
+        self.assertFalse(qs._none)
+        self.assertEqual(list(qs), [])
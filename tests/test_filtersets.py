@@ -1,13 +1,16 @@
 from collections import OrderedDict
+from datetime import datetime
 from unittest import TestCase
 from unittest import mock
+from django.core.exceptions import ImproperlyConfigured
 from django.http import QueryDict
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import ValidationError, PermissionDenied
 from mongoengine import Document, fields
 
 
 from drf_mongo_filters import filters
 from drf_mongo_filters import Filterset, ModelFilterset
+from drf_mongo_filters.registry import FiltersetRegistry
 
 from .models import SimpleDoc, DeepDoc
 
@@ -98,6 +101,96 @@ class BaseTests(TestCase):
             mock.call(babar=123)
         ])
 
+    def test_dispatch(self):
+        class TestFS(Filterset):
+            foo = filters.CharFilter()
+            bar = filters.RangeFilter()
+            baz = filters.IntegerFilter(name='qux')
+        self.assertEqual(TestFS().dispatch, { 'foo': ['foo'], 'bar': ['bar'], 'qux': ['baz'] })
+        with mock.patch.object(filters.CharFilter, 'parse_value') as parse_value:
+            self.assertEqual(TestFS(QueryDict("bar.min=1&qux=2")).values, { 'bar': { 'min': "1" }, 'baz': 2 })
+        self.assertFalse(parse_value.called)
+
+class FastParsingTests(TestCase):
+    def assertParsedSame(self, flt, data):
+        flt.bind('foo', None)
+        self.assertIsNotNone(flt.fast_parser)
+        self.assertEqual(flt.parse_value({'foo': data}), flt.field.to_internal_value(data))
+
+    def assertFailedSame(self, flt, data):
+        flt.bind('foo', None)
+        with self.assertRaises(ValidationError) as fast:
+            flt.parse_value({'foo': data})
+        with self.assertRaises(ValidationError) as slow:
+            flt.field.to_internal_value(data)
+        self.assertEqual(fast.exception.detail, slow.exception.detail)
+
+    def test_integer(self):
+        for data in ("123", " 123 ", "-1", "1.0", 123):
+            self.assertParsedSame(filters.IntegerFilter(), data)
+        for data in ("xxx", "1.5", "1" * 2000):
+            self.assertFailedSame(filters.IntegerFilter(), data)
+
+    def test_float(self):
+        for data in ("1.5", "1e3", "-0", 2):
+            self.assertParsedSame(filters.FloatFilter(), data)
+        self.assertFailedSame(filters.FloatFilter(), "xxx")
+
+    def test_datetime(self):
+        for data in ("2015-01-02T03:04:05.123456", "2015-01-02 03:04", "2015-01-02T03:04:05Z"):
+            self.assertParsedSame(filters.DateTimeFilter(), data)
+        self.assertFailedSame(filters.DateTimeFilter(), "2015-13-02")
+
+    def test_objectid(self):
+        self.assertParsedSame(filters.ObjectIdFilter(), "5497d7ae6e955201e54b45e6")
+        self.assertFailedSame(filters.ObjectIdFilter(), "xxx")
+
+    def test_uuid(self):
+        self.assertParsedSame(filters.UUIDFilter(), "12345678-1234-5678-1234-567812345678")
+        self.assertFailedSame(filters.UUIDFilter(), "xxx")
+
+    def test_customized(self):
+        self.assertIsNotNone(filters.IntegerFilter(source='bar').fast_parser)
+        self.assertIsNone(filters.IntegerFilter(max_value=10).fast_parser)
+        self.assertIsNone(filters.DateTimeFilter(input_formats=['%Y']).fast_parser)
+        self.assertIsNone(filters.CharFilter().fast_parser)
+
+class DateRangeParsingTests(TestCase):
+    now = datetime(2015, 1, 10, 12, 34, 56, 789)
+
+    def parse(self, query, **kwargs):
+        class TestFS(Filterset):
+            foo = filters.DateRangeFilter(**kwargs)
+        with mock.patch('django.utils.timezone.now', return_value=self.now):
+            return TestFS(QueryDict(query)).values.get('foo', None)
+
+    def test_named(self):
+        self.assertEqual(self.parse("foo=today"), { 'min': datetime(2015, 1, 10), 'max': datetime(2015, 1, 11) })
+        self.assertEqual(self.parse("foo=yesterday"), { 'min': datetime(2015, 1, 9), 'max': datetime(2015, 1, 10) })
+        self.assertEqual(self.parse("foo=2015-01-02"), { 'min': datetime(2015, 1, 2), 'max': datetime(2015, 1, 3) })
+
+    def test_last(self):
+        self.assertEqual(self.parse("foo.last=7d"), { 'min': datetime(2015, 1, 3, 12, 34) })
+        self.assertEqual(self.parse("foo.last=2h", bucket='hour'), { 'min': datetime(2015, 1, 10, 10) })
+        self.assertEqual(self.parse("foo.last=1w", bucket='day'), { 'min': datetime(2015, 1, 3) })
+
+    def test_bounds(self):
+        self.assertEqual(self.parse("foo.min=2015-01-01&foo.max=2015-01-05"), { 'min': datetime(2015, 1, 1), 'max': datetime(2015, 1, 6) })
+        self.assertEqual(self.parse("foo.min=2015-01-01T10:00"), { 'min': datetime(2015, 1, 1, 10) })
+        self.assertEqual(self.parse("foo=today&foo.min=2015-01-10T10:00"), { 'min': datetime(2015, 1, 10, 10), 'max': datetime(2015, 1, 11) })
+
+    def test_invalid(self):
+        with self.assertRaises(ValidationError):
+            self.parse("foo.last=7y")
+        with self.assertRaises(ValidationError):
+            self.parse("foo=someday")
+
+    def test_params(self):
+        flt = filters.DateRangeFilter(source='bar')
+        flt.bind('foo', None)
+        self.assertEqual(flt.filter_params({ 'min': datetime(2015, 1, 1), 'max': datetime(2015, 1, 2) }),
+            { 'bar__gte': datetime(2015, 1, 1), 'bar__lt': datetime(2015, 1, 2) })
+
 class ModelTests(TestCase):
     def test_auto_types(self):
 
@@ -142,6 +235,72 @@ class ModelTests(TestCase):
         fs = TestFS()
         self.assertIsInstance(fs.filters['f_list'], filters.IntegerFilter)
 
+    def test_auto_lookups(self):
+        class TestFS(ModelFilterset):
+            class Meta:
+                model = SimpleDoc
+                fields = { 'f_int': ['exact', 'gte', 'lte', 'in'], 'f_str': ['icontains'] }
+        fs = TestFS(QueryDict("f_int__gte=1&f_int__lte=5&f_int__in=2&f_int__in=3&f_str__icontains=Foo"))
+        self.assertEqual(set(fs.filters.keys()), set(['id', 'f_int', 'f_int__gte', 'f_int__lte', 'f_int__in', 'f_str__icontains']))
+        self.assertIsInstance(fs.filters['f_int__in'], filters.AnyFilter)
+        self.assertEqual(fs.values, { 'f_int__gte': 1, 'f_int__lte': 5, 'f_int__in': [2, 3], 'f_str__icontains': "Foo" })
+
+        qs = mock.Mock()
+        qs.filter = mock.Mock(return_value=qs)
+        fs.filter_queryset(qs)
+        qs.filter.assert_has_calls([
+            mock.call(f_int__gte=1),
+            mock.call(f_int__lte=5),
+            mock.call(f_int__in=[2, 3]),
+            mock.call(f_str__icontains="Foo")
+        ], any_order=True)
+
+    def test_auto_lookups_invalid(self):
+        class TestFS(ModelFilterset):
+            class Meta:
+                model = SimpleDoc
+                fields = { 'f_int': ['icontains'] }
+        with self.assertRaises(TypeError):
+            TestFS.compile()
+
+    def test_auto_map(self):
+        class TestFS(ModelFilterset):
+            class Meta:
+                model = DeepDoc
+                fields = ['f_map', 'f_dict']
+                kwargs = { 'f_dict': { 'valid_keys': ['foo'] } }
+        fs = TestFS(QueryDict("f_map.foo=1&f_dict.foo=Foo"))
+        self.assertIsInstance(fs.filters['f_map'], filters.MapFilter)
+        self.assertIsInstance(fs.filters['f_dict'], filters.MapFilter)
+        self.assertEqual(fs.values, { 'f_map': { 'foo': 1 }, 'f_dict': { 'foo': "Foo" } })
+
+    def test_auto_embedded(self):
+        class TestFS(ModelFilterset):
+            class Meta:
+                model = DeepDoc
+                fields = ['f_emb', 'f_emblist']
+        fs = TestFS()
+        self.assertIsInstance(fs.filters['f_emb'], filters.EmbeddedFilter)
+        self.assertIsInstance(fs.filters['f_emblist'], filters.ElemMatchFilter)
+        self.assertEqual(list(fs.filters['f_emblist'].subfilters.keys()), ['foo', 'bar'])
+        self.assertIsInstance(fs.filters['f_emblist'].subfilters['foo'], filters.CharFilter)
+
+    def test_auto_embedded_parsing(self):
+        class TestFS(ModelFilterset):
+            class Meta:
+                model = DeepDoc
+                fields = ['f_emb', 'f_emblist']
+        fs = TestFS(QueryDict("f_emb.foo=Foo&f_emblist.foo=Foo&f_emblist.bar=Bar"))
+        self.assertEqual(fs.values, { 'f_emb': {'foo': "Foo"}, 'f_emblist': {'foo': "Foo", 'bar': "Bar"} })
+
+        qs = mock.Mock()
+        qs.filter = mock.Mock(return_value=qs)
+        fs.filter_queryset(qs)
+        qs.filter.assert_has_calls([
+            mock.call(f_emb__foo="Foo"),
+            mock.call(f_emblist__match={'foo': "Foo", 'bar': "Bar"})
+        ], any_order=True)
+
     def test_custom_type(self):
         class FooField(fields.BaseField):
             pass
@@ -239,3 +398,152 @@ class ModelTests(TestCase):
                 }
         fs = TestFS()
         self.assertEqual(fs.filters['foo'].lookup_type, 'gte')
+
+
+class MixinsTests(TestCase):
+    def test_features(self):
+        from drf_mongo_filters.counting import CountingMixin
+        from drf_mongo_filters.stats import StatsMixin
+        from drf_mongo_filters.batching import BatchMixin
+
+        class TestFS(Filterset):
+            foo = filters.CharFilter(source='f_str')
+            count_ttl = 60
+
+        self.assertIsInstance(TestFS(), CountingMixin)
+        self.assertIs(TestFS.count_cache, CountingMixin.count_cache)
+        self.assertNotIn('count_queryset', Filterset.__dict__)
+        self.assertEqual(TestFS({}).distinct_values(SimpleDoc.objects.none(), 'foo'), ([], False))
+        self.assertTrue(issubclass(Filterset, StatsMixin) and issubclass(Filterset, BatchMixin))
+
+class CompilingTests(TestCase):
+    def test_shared_filters(self):
+        class MockModel(Document):
+            foo = fields.StringField()
+
+        class TestFS(ModelFilterset):
+            shared_filters = True
+            class Meta:
+                model = MockModel
+
+        with mock.patch.object(TestFS, 'get_filters', wraps=TestFS().get_filters) as get_filters:
+            fs1 = TestFS()
+            fs2 = TestFS()
+            self.assertIsInstance(fs1.filters['foo'], filters.CharFilter)
+            self.assertIsNot(fs1.filters['foo'], fs2.filters['foo'])
+            self.assertEqual(get_filters.call_count, 1)
+
+    def test_instance_filters(self):
+        class TestFS(Filterset):
+            foo = filters.CharFilter()
+
+            def get_filters(self):
+                filters = super().get_filters()
+                if self.request is None or not getattr(self.request, 'staff', False):
+                    del filters['foo']
+                return filters
+
+        TestFS.compile()
+        self.assertEqual(TestFS(QueryDict("foo=Foo")).values, {})
+        staff = mock.Mock(staff=True)
+        self.assertEqual(TestFS(QueryDict("foo=Foo"), request=staff).values, { 'foo': "Foo" })
+
+    def test_strict(self):
+        class MockModel(Document):
+            foo = fields.StringField()
+
+        class TestFS(ModelFilterset):
+            class Meta:
+                model = MockModel
+                strict = True
+            bar = filters.CharFilter(source='baz')
+
+        with self.assertRaises(TypeError):
+            TestFS.compile()
+
+    def test_registry(self):
+        class MockModel(Document):
+            foo = fields.StringField()
+
+        class GoodFS(ModelFilterset):
+            class Meta:
+                model = MockModel
+
+        class BadFS(ModelFilterset):
+            class Meta:
+                model = MockModel
+                fields = ('bar',)
+
+        class AbstractFS(ModelFilterset):
+            foo = filters.CharFilter()
+
+        registry = FiltersetRegistry()
+        for cls in (GoodFS, BadFS, AbstractFS):
+            registry.register(cls)
+
+        with self.assertRaisesRegex(ImproperlyConfigured, 'BadFS'):
+            registry.compile_all()
+        self.assertIn('_compiled_filters', GoodFS.__dict__)
+        self.assertNotIn('_compiled_filters', AbstractFS.__dict__)
+
+
+class ScopeTests(TestCase):
+    class ShardedDoc(Document):
+        meta = { 'shard_key': ('tenant', 'region') }
+        tenant = fields.StringField(db_field='t')
+        region = fields.StringField()
+        foo = fields.StringField()
+
+    def filterset_class(self, scope):
+        class TestFS(Filterset):
+            class Meta:
+                pass
+            foo = filters.CharFilter()
+            tenant = filters.CharFilter()
+        TestFS.Meta.scope = scope
+        return TestFS
+
+    def test_scope_from_request(self):
+        TestFS = self.filterset_class({ 'tenant': 'user.tenant' })
+        request = mock.Mock()
+        request.user.tenant = "acme"
+
+        qs = mock.Mock()
+        qs.filter = mock.Mock(return_value=qs)
+        TestFS({ 'foo': "Foo", 'tenant': "other" }, request=request).filter_queryset(qs)
+        self.assertEqual(qs.filter.call_args_list, [
+            mock.call(tenant="acme"),
+            mock.call(foo="Foo"),
+            mock.call(tenant="other")
+        ])
+
+    def test_scope_callable(self):
+        TestFS = self.filterset_class({ 'tenant': lambda request: request.tenant })
+        fs = TestFS({}, request=mock.Mock(tenant="acme"))
+        self.assertEqual(fs.scope, { 'tenant': "acme" })
+
+    def test_scope_missing(self):
+        TestFS = self.filterset_class({ 'tenant': 'user.tenant' })
+        qs = mock.Mock()
+        with self.assertRaises(PermissionDenied):
+            TestFS({ 'foo': "Foo" }).filter_queryset(qs)
+        with self.assertRaises(PermissionDenied):
+            TestFS({ 'foo': "Foo" }, request=mock.Mock(user=None)).filter_queryset(qs)
+        self.assertFalse(qs.filter.called)
+
+    def test_targeted(self):
+        TestFS = self.filterset_class({ 'tenant': 'tenant' })
+        request = mock.Mock(tenant="acme")
+        qs = TestFS(QueryDict("foo=Foo"), request=request).filter_queryset(self.ShardedDoc.objects.all())
+        self.assertFalse(Filterset.is_targeted(qs))
+        qs = qs.filter(region="eu")
+        self.assertTrue(Filterset.is_targeted(qs))
+        qs = TestFS(QueryDict(""), request=request).filter_queryset(self.ShardedDoc.objects.filter(region__in=["eu", "us"]))
+        self.assertTrue(Filterset.is_targeted(qs))
+        qs = self.ShardedDoc.objects.filter(tenant="acme", region__in=["r%d" % i for i in range(11)])
+        self.assertFalse(Filterset.is_targeted(qs))
+        qs = self.ShardedDoc.objects.filter(tenant="acme", region__iexact="eu")
+        self.assertFalse(Filterset.is_targeted(qs))
+        qs = self.ShardedDoc.objects.filter(tenant="acme", region=["eu", "us"])
+        self.assertFalse(Filterset.is_targeted(qs))
+        self.assertTrue(Filterset.is_targeted(SimpleDoc.objects.all()))
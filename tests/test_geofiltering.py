@@ -1,6 +1,10 @@
 from unittest import TestCase
+from bson import ObjectId
+from django.http import QueryDict
+from rest_framework.exceptions import ValidationError
 
 from drf_mongo_filters import filters
+from drf_mongo_filters.fields import ObjectIdField
 from drf_mongo_filters.filtersets import Filterset
 
 from .models import GeoDoc
@@ -37,6 +41,15 @@ class GeoTests(QuerysetTesting, TestCase):
         qs = fs.filter_queryset(GeoDoc.objects.all())
         self.assertQuerysetDocsOrdered(qs, objects)
 
+    def test_near_logical(self):
+        class FS(Filterset):
+            loc = filters.GeoNearFilter(source='location')
+
+        for key in ('or.g.loc', 'loc!'):
+            fs = FS({ key: { 'lng': 60.0, 'lat': 80.0 } })
+            with self.assertRaises(ValidationError):
+                fs.filter_queryset(GeoDoc.objects.all())
+
     def test_near_distance(self):
         objects = [
             GeoDoc.objects.create(location=(54.830956, 83.087933)), #0 ~800m
@@ -54,3 +67,92 @@ class GeoTests(QuerysetTesting, TestCase):
         qs = fs.filter_queryset(GeoDoc.objects.all())
 
         self.assertQuerysetDocsOrdered(qs, [ objects[2], objects[3], objects[1] ])
+
+    def test_near_max_distance(self):
+        objects = [
+            GeoDoc.objects.create(location=(54.830956, 83.087933)), #0 ~800m
+            GeoDoc.objects.create(location=(54.833693, 83.094477)), #1 ~300m
+            GeoDoc.objects.create(location=(54.835314, 83.098243)), #2 0
+            GeoDoc.objects.create(location=(54.836246, 83.100283)), #3 ~170m
+            GeoDoc.objects.create(location=(54.838594, 83.105564)), #4 ~600m
+        ]
+
+        class FS(Filterset):
+            loc = filters.GeoNearFilter(source='location')
+
+        fs = FS(QueryDict("loc.lng=54.8353&loc.lat=83.0982&loc.max_distance=500"))
+        self.assertEqual(fs.filters['loc'].filter_params(fs.values['loc']), {
+            'location__near': { 'type': 'Point', 'coordinates': [54.8353, 83.0982] },
+            'location__max_distance': 500.0 })
+        qs = fs.filter_queryset(GeoDoc.objects.all())
+        self.assertQuerysetDocsOrdered(qs, [ objects[2], objects[3], objects[1] ])
+
+class GeoWithinTests(QuerysetTesting, TestCase):
+    def setUp(self):
+        self.objects = [
+            GeoDoc.objects.create(location=(10.0, 10.0)),
+            GeoDoc.objects.create(location=(10.5, 10.5)),
+            GeoDoc.objects.create(location=(12.0, 12.0)),
+        ]
+
+    def tearDown(self):
+        GeoDoc.objects.delete()
+
+    def test_circle(self):
+        class FS(Filterset):
+            foo = filters.GeoWithinCircleFilter(source='location')
+
+        fs = FS(QueryDict("foo.lng=10.0&foo.lat=10.0&foo.radius=100000"))
+        qs = fs.filter_queryset(GeoDoc.objects.all())
+        self.assertQuerysetDocs(qs, self.objects[0:2])
+
+    def test_box(self):
+        class FS(Filterset):
+            foo = filters.GeoWithinBoxFilter(source='location')
+
+        fs = FS(QueryDict("foo.west=9&foo.south=9&foo.east=11&foo.north=11"))
+        qs = fs.filter_queryset(GeoDoc.objects.all())
+        self.assertQuerysetDocs(qs, self.objects[0:2])
+
+        fs = FS(QueryDict("foo.west=11&foo.south=9&foo.east=9&foo.north=11"))
+        with self.assertRaises(ValidationError):
+            fs.values
+
+    def test_polygon(self):
+        class FS(Filterset):
+            foo = filters.GeoWithinPolygonFilter(source='location')
+
+        fs = FS(QueryDict("foo.0=9,9&foo.1=13,9&foo.2=9,13"))
+        self.assertEqual(fs.values['foo'], { 'type': 'Polygon', 'coordinates': [[ [9.0,9.0], [13.0,9.0], [9.0,13.0], [9.0,9.0] ]] })
+        qs = fs.filter_queryset(GeoDoc.objects.all())
+        self.assertQuerysetDocs(qs, self.objects[0:2])
+
+class GeoNearPipelineTests(TestCase):
+    def test_pipeline(self):
+        class FS(Filterset):
+            loc = filters.GeoNearFilter(source='location', distance_field='dist')
+            ids = filters.AnyFilter(source='id', child=ObjectIdField())
+
+        oid = ObjectId()
+        fs = FS(QueryDict("loc.lng=10&loc.lat=20&loc.max_distance=500&ids=" + str(oid)))
+        pipeline = fs.filter_pipeline(GeoDoc.objects.all()) + fs.page_stages(20, 10)
+        self.assertEqual(pipeline, [
+            { '$geoNear': {
+                'near': { 'type': 'Point', 'coordinates': [10.0, 20.0] },
+                'distanceField': 'dist',
+                'key': 'location',
+                'spherical': True,
+                'maxDistance': 500.0,
+                'query': { '_id': { '$in': [oid] } } } },
+            { '$facet': {
+                'results': [ { '$skip': 20 }, { '$limit': 10 } ],
+                'count': [ { '$count': 'count' } ] } }
+        ])
+
+    def test_queryset(self):
+        class FS(Filterset):
+            loc = filters.GeoNearFilter(source='location', distance_field='dist')
+
+        fs = FS(QueryDict("loc.lng=10&loc.lat=20"))
+        self.assertEqual(fs.filters['loc'].filter_params(fs.values['loc']), {
+            'location__near': { 'type': 'Point', 'coordinates': [10.0, 20.0] } })
@@ -0,0 +1,141 @@
+from unittest import TestCase
+from rest_framework import permissions, serializers
+from rest_framework.test import APIRequestFactory
+
+from drf_mongo_filters import filters, Filterset, MongoFilterBackend
+from drf_mongo_filters.generics import FilteredBulkAPIView
+
+from .models import SimpleDoc, DeepDoc, EmbDoc
+
+class TestSerializer(serializers.Serializer):
+    f_str = serializers.CharField()
+    f_int = serializers.IntegerField()
+
+class TestFilter(Filterset):
+    foo = filters.CharFilter(source='f_str')
+    bar = filters.IntegerFilter('gte', source='f_int')
+
+class TestView(FilteredBulkAPIView):
+    filter_backends = (MongoFilterBackend,)
+    filter_class = TestFilter
+    serializer_class = TestSerializer
+    bulk_limit = 2
+
+    def get_queryset(self):
+        return SimpleDoc.objects.all()
+
+class BulkTests(TestCase):
+    def setUp(self):
+        self.objects = [
+            SimpleDoc.objects.create(f_str="foo", f_int=1),
+            SimpleDoc.objects.create(f_str="foo", f_int=2),
+            SimpleDoc.objects.create(f_str="bar", f_int=3),
+        ]
+
+    def tearDown(self):
+        SimpleDoc.objects.delete()
+
+    def request(self, method, url, data=None):
+        factory = APIRequestFactory()
+        return TestView.as_view()(getattr(factory, method)(url, data, format='json'))
+
+    def test_update(self):
+        response = self.request('patch', "/?bar=2", { 'f_str': "baz" })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, { 'matched': 2, 'updated': 2 })
+        self.assertEqual(SimpleDoc.objects.filter(f_str="baz").count(), 2)
+
+    def test_update_invalid(self):
+        response = self.request('patch', "/?bar=2", { 'f_int': "xxx" })
+        self.assertEqual(response.status_code, 400)
+        response = self.request('patch', "/?bar=xxx", { 'f_str': "baz" })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(SimpleDoc.objects.filter(f_str="baz").count(), 0)
+
+    def test_unfiltered(self):
+        response = self.request('delete', "/")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(SimpleDoc.objects.count(), 3)
+
+    def test_unfiltered_params(self):
+        response = self.request('delete', "/?foo!=bar")
+        self.assertEqual(response.data, { 'matched': 2, 'deleted': 2 })
+        response = self.request('delete', "/?or.g.foo=bar&or.g.bar=3")
+        self.assertEqual(response.data, { 'matched': 1, 'deleted': 1 })
+        response = self.request('delete', "/?baz=1")
+        self.assertEqual(response.status_code, 400)
+
+    def test_limit(self):
+        response = self.request('delete', "/?bar=1")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(SimpleDoc.objects.count(), 3)
+
+    def test_dry_run(self):
+        response = self.request('delete', "/?foo=foo&dry_run=1")
+        self.assertEqual(response.data, { 'matched': 2 })
+        self.assertEqual(SimpleDoc.objects.count(), 3)
+        response = self.request('delete', "/?bar=1&dry_run=1")
+        self.assertEqual(response.status_code, 400)
+
+    def test_delete(self):
+        response = self.request('delete', "/?foo=foo")
+        self.assertEqual(response.data, { 'matched': 2, 'deleted': 2 })
+        self.assertEqual(SimpleDoc.objects.count(), 1)
+
+    def test_concurrent_match(self):
+        def create_matching(count):
+            SimpleDoc.objects.create(f_str="foo", f_int=5)
+        view = TestView.as_view(check_bulk_limit=create_matching)
+        response = view(APIRequestFactory().delete("/?bar=2"))
+        self.assertEqual(response.data, { 'matched': 2, 'deleted': 2 })
+        self.assertEqual(SimpleDoc.objects.filter(f_int=5).count(), 1)
+
+    def test_object_permissions(self):
+        class NotThree(permissions.BasePermission):
+            def has_object_permission(self, request, view, obj):
+                return obj.f_int != 3
+        view = TestView.as_view(permission_classes=(NotThree,))
+        response = view(APIRequestFactory().delete("/?bar=2"))
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(SimpleDoc.objects.count(), 3)
+        response = view(APIRequestFactory().delete("/?foo=foo"))
+        self.assertEqual(response.data, { 'matched': 2, 'deleted': 2 })
+
+
+class EmbSerializer(serializers.Serializer):
+    foo = serializers.CharField()
+    bar = serializers.CharField()
+
+class DeepSerializer(serializers.Serializer):
+    f_emb = EmbSerializer()
+    emb_bar = serializers.CharField(source='f_emb.bar')
+    f_list = serializers.ListField(child=serializers.IntegerField())
+
+class DeepFilter(Filterset):
+    foo = filters.CharFilter(source='f_emb.foo')
+
+class DeepView(FilteredBulkAPIView):
+    filter_class = DeepFilter
+    serializer_class = DeepSerializer
+
+    def get_queryset(self):
+        return DeepDoc.objects.all()
+
+class NestedBulkTests(TestCase):
+    def setUp(self):
+        self.obj = DeepDoc.objects.create(f_emb=EmbDoc(foo="foo", bar="bar"), f_list=[1])
+
+    def tearDown(self):
+        DeepDoc.objects.delete()
+
+    def test_nested(self):
+        response = DeepView.as_view()(APIRequestFactory().patch("/?foo=foo", { 'f_emb': { 'foo': "baz" }, 'f_list': [2] }, format='json'))
+        self.assertEqual(response.data, { 'matched': 1, 'updated': 1 })
+        self.obj.reload()
+        self.assertEqual((self.obj.f_emb.foo, self.obj.f_emb.bar, self.obj.f_list), ("baz", "bar", [2]))
+
+    def test_dotted_source(self):
+        response = DeepView.as_view()(APIRequestFactory().patch("/?foo=foo", { 'emb_bar': "qux" }, format='json'))
+        self.assertEqual(response.data, { 'matched': 1, 'updated': 1 })
+        self.obj.reload()
+        self.assertEqual((self.obj.f_emb.foo, self.obj.f_emb.bar), ("foo", "qux"))
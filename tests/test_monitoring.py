@@ -0,0 +1,171 @@
+import json
+import os
+import tempfile
+from datetime import datetime
+from io import StringIO
+from unittest import TestCase
+from unittest import mock
+from bson import ObjectId
+from django.core.management import call_command
+from mongoengine import Document, fields as db_fields
+from rest_framework import serializers
+from rest_framework.filters import OrderingFilter
+from rest_framework.generics import ListAPIView
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from drf_mongo_filters import filters, Filterset, MongoFilterBackend
+from drf_mongo_filters.pagination import FilteredLimitOffsetPagination
+from drf_mongo_filters.monitoring import query_shape, query_fields, SlowQueryLog, QueryStats, recommend_indexes, document_indexes
+from drf_mongo_filters.management.commands.filter_index_report import Command as IndexReportCommand
+
+from .models import SimpleDoc
+
+class ShapeTests(TestCase):
+    def test_shape(self):
+        query = { 'a': 1, 'b': { '$gte': 1.5, '$lt': datetime.now() }, 'c': { '$in': [ "x", "y", 1 ] },
+                  '$or': [ { 'd': ObjectId() }, { 'e': None } ] }
+        self.assertEqual(query_shape(query), {
+            'a': "<int>",
+            'b': { '$gte': "<float>", '$lt': "<datetime>" },
+            'c': { '$in': [ "<int>", "<str>" ] },
+            '$or': [ { 'd': "<ObjectId>" }, { 'e': None } ] })
+
+    def test_same_shape(self):
+        self.assertEqual(query_shape({ 'a': { '$in': [1, 2] } }), query_shape({ 'a': { '$in': [3] } }))
+
+class SlowLogTests(TestCase):
+    class TestFS(Filterset):
+        foo = filters.CharFilter(source='f_str')
+
+    def test_threshold(self):
+        log = SlowQueryLog(threshold=0.5, logger=mock.Mock())
+        qs = SimpleDoc.objects.filter(f_str="foo")
+        self.assertFalse(log.record(qs, 0.1))
+        self.assertTrue(log.record(qs, 0.6))
+        self.assertTrue(log.logger.warning.called)
+
+    def test_rate_limited(self):
+        log = SlowQueryLog(threshold=0, interval=60, logger=mock.Mock())
+        self.assertTrue(log.record(SimpleDoc.objects.filter(f_str="foo"), 1))
+        self.assertFalse(log.record(SimpleDoc.objects.filter(f_str="bar"), 1))
+        self.assertTrue(log.record(SimpleDoc.objects.filter(f_int=1), 1))
+
+    def test_backend(self):
+        class Backend(MongoFilterBackend):
+            slow_query_log = SlowQueryLog(threshold=0)
+
+        view = mock.Mock(filter_class=self.TestFS)
+        request = Request(APIRequestFactory().get("/items/?foo=Foo"))
+        backend = Backend()
+        qs = backend.filter_queryset(request, SimpleDoc.objects.all(), view)
+        with self.assertLogs('drf_mongo_filters.slow_queries') as logs:
+            self.assertEqual(backend.fetch(qs, 0, 10, view.filterset), [])
+        self.assertIn("TestFS /items/ filters=['foo']", logs.output[0])
+        self.assertIn('"f_str": "<str>"', logs.output[0])
+        self.assertIn("targeted=True", logs.output[0])
+
+
+class IndexedDoc(Document):
+    foo = db_fields.StringField()
+    bar = db_fields.IntField()
+    baz = db_fields.DateTimeField()
+    attrs = db_fields.MapField(db_fields.StringField())
+    meta = { 'indexes': [ ('foo', 'bar') ] }
+
+class StatsTests(TestCase):
+    def entry(self, count, equality=(), ranges=(), sort=(), targeted=True):
+        return { 'document': 'tests.test_monitoring.IndexedDoc', 'filterset': None,
+                 'equality': list(equality), 'range': list(ranges), 'sort': [ list(order) for order in sort ], 'targeted': targeted, 'count': count }
+
+    def test_fields(self):
+        self.assertEqual(
+            query_fields({ 'a': 1, 'b': { '$in': [1, 2] }, 'c': { '$gt': 1 }, '$and': [ { 'd': { '$ne': 1 } } ], '$or': [ { 'e': 1 } ] }),
+            (set(['a', 'b']), set(['c', 'd'])))
+
+    def test_counting(self):
+        stats = QueryStats()
+        stats.record(IndexedDoc.objects.filter(foo="x", bar__gte=1))
+        stats.record(IndexedDoc.objects.filter(foo="y", bar__gte=2))
+        stats.record(IndexedDoc.objects.filter(baz__lt=datetime.now()).order_by('-foo'))
+        self.assertEqual(stats.entries(), [
+            self.entry(2, equality=['foo'], ranges=['bar']),
+            self.entry(1, ranges=['baz'], sort=[('foo', -1)]) ])
+
+    def test_backend(self):
+        class TestFS(Filterset):
+            foo = filters.CharFilter()
+
+        class Backend(MongoFilterBackend):
+            query_stats = QueryStats()
+
+        view = mock.Mock(filter_class=TestFS, filter_backends=(Backend,))
+        request = Request(APIRequestFactory().get("/?foo=x"))
+        Backend().filter_queryset(request, IndexedDoc.objects.all(), view)
+        entries = Backend.query_stats.entries()
+        self.assertEqual(entries[0]['filterset'], 'tests.test_monitoring.StatsTests.test_backend.<locals>.TestFS')
+        self.assertEqual(entries[0]['equality'], ['foo'])
+
+    def test_backend_ordering(self):
+        class TestFS(Filterset):
+            foo = filters.CharFilter()
+
+        class Backend(MongoFilterBackend):
+            query_stats = QueryStats()
+
+        class TestView(ListAPIView):
+            filter_backends = (Backend, OrderingFilter)
+            filter_class = TestFS
+            ordering_fields = ('bar',)
+            pagination_class = FilteredLimitOffsetPagination
+            serializer_class = serializers.Serializer
+
+            def get_queryset(self):
+                return IndexedDoc.objects.all()
+
+        response = TestView.as_view()(APIRequestFactory().get("/?foo=x&ordering=-bar&limit=10"))
+        self.assertEqual(response.status_code, 200)
+        entries = Backend.query_stats.entries()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['sort'], [ ['bar', -1] ])
+        self.assertEqual(entries[0]['count'], 1)
+
+    def test_recommend(self):
+        indexes = document_indexes(IndexedDoc)
+        self.assertEqual(indexes, [ ['foo', 'bar'], ['_id'] ])
+        entries = [
+            self.entry(50, equality=['foo'], ranges=['bar']),
+            self.entry(30, equality=['bar'], ranges=['baz']),
+            self.entry(15, equality=['bar'], sort=[('baz', -1)]),
+            self.entry(5, ranges=['baz']) ]
+        self.assertEqual(recommend_indexes(entries, indexes, 0.8), [ [('bar', 1), ('baz', 1)] ])
+        self.assertEqual(recommend_indexes(entries, indexes, 1), [ [('bar', 1), ('baz', 1)], [('baz', 1)] ])
+        self.assertEqual(recommend_indexes(entries[:1], indexes), [])
+
+    def test_wildcard(self):
+        entries = [
+            self.entry(50, equality=['attrs.color', 'foo']),
+            self.entry(30, ranges=['attrs.size']),
+            self.entry(20, equality=['bar']) ]
+        self.assertEqual(recommend_indexes(entries, [ ['_id'] ], 0.8, ['attrs']), [ [('attrs.$**', 1)] ])
+        self.assertEqual(recommend_indexes(entries, [ ['attrs.$**'] ], 0.8, ['attrs']), [])
+        self.assertEqual(recommend_indexes(entries, [ ['attrs.$**'] ], 1, ['attrs']), [ [('bar', 1)] ])
+
+    def test_live_indexes(self):
+        IndexedDoc._get_collection().create_index([ ('attrs.$**', 1) ])
+        self.addCleanup(IndexedDoc._get_collection().drop)
+        self.assertIn([ 'attrs.$**' ], document_indexes(IndexedDoc, live=True))
+
+    def test_command(self):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        with open(path, 'w') as out:
+            json.dump([ self.entry(50, equality=['foo'], targeted=False), self.entry(50, ranges=['baz'], sort=[('baz', -1)]) ], out)
+        output = StringIO()
+        call_command(IndexReportCommand(), path, path, coverage=100, stdout=output)
+        report = output.getvalue()
+        self.assertIn("tests.test_monitoring.IndexedDoc (indexed_doc):", report)
+        self.assertIn("100  50.0% None eq=[] range=['baz'] sort=['-baz']  NOT COVERED\n", report)
+        self.assertIn("100  50.0% None eq=['foo'] range=[] sort=[]  UNTARGETED", report)
+        self.assertIn("    ['-baz']", report)
@@ -0,0 +1,106 @@
+from unittest import TestCase
+from unittest import mock
+from rest_framework import serializers
+from rest_framework.generics import ListAPIView
+from rest_framework.test import APIRequestFactory
+
+from drf_mongo_filters import filters, Filterset, MongoFilterBackend
+from drf_mongo_filters.pagination import FilteredLimitOffsetPagination
+
+from .models import SimpleDoc
+
+class TestSerializer(serializers.Serializer):
+    f_int = serializers.IntegerField()
+
+class TestFilter(Filterset):
+    foo = filters.IntegerFilter('gte', source='f_int')
+
+class CountTests(TestCase):
+    def setUp(self):
+        Filterset.count_cache.clear()
+        self.objects = [ SimpleDoc.objects.create(f_int=i) for i in range(10) ]
+
+    def tearDown(self):
+        SimpleDoc.objects.delete()
+
+    def test_count(self):
+        qs = TestFilter({'foo': 5}).filter_queryset(SimpleDoc.objects.all())
+        self.assertEqual(TestFilter.count_queryset(qs), 5)
+        self.assertEqual(TestFilter.count_queryset(qs, limit=3), 4)
+
+    def test_cached(self):
+        class CachedFilter(TestFilter):
+            count_ttl = 10
+        qs = CachedFilter({'foo': 5}).filter_queryset(SimpleDoc.objects.all())
+        self.assertEqual(CachedFilter.count_queryset(qs), 5)
+        SimpleDoc.objects.create(f_int=5)
+        self.assertEqual(CachedFilter.count_queryset(qs), 5)
+        self.assertEqual(CachedFilter.count_queryset(qs.hint([('_id', 1)])), 6)
+        qs = CachedFilter({'foo': 4}).filter_queryset(SimpleDoc.objects.all())
+        self.assertEqual(CachedFilter.count_queryset(qs), 7)
+
+    def test_not_cached(self):
+        qs = TestFilter({'foo': 5}).filter_queryset(SimpleDoc.objects.all())
+        self.assertEqual(TestFilter.count_queryset(qs), 5)
+        SimpleDoc.objects.create(f_int=5)
+        self.assertEqual(TestFilter.count_queryset(qs), 6)
+
+    def test_estimated(self):
+        qs = TestFilter({}).filter_queryset(SimpleDoc.objects.all())
+        with mock.patch.object(type(qs), 'count') as count:
+            self.assertEqual(TestFilter.count_queryset(qs), 10)
+            self.assertFalse(count.called)
+
+    def test_fingerprint(self):
+        qs1 = TestFilter({'foo': 5}).filter_queryset(SimpleDoc.objects.all())
+        qs2 = TestFilter({'foo': "5"}).filter_queryset(SimpleDoc.objects.all())
+        qs3 = TestFilter({'foo': 6}).filter_queryset(SimpleDoc.objects.all())
+        self.assertEqual(TestFilter.fingerprint(qs1), TestFilter.fingerprint(qs2))
+        self.assertNotEqual(TestFilter.fingerprint(qs1), TestFilter.fingerprint(qs3))
+        qs4 = qs1.collation({ 'locale': 'en', 'strength': 2 })
+        self.assertNotEqual(TestFilter.fingerprint(qs1), TestFilter.fingerprint(qs4))
+        fingerprint = TestFilter.fingerprint(qs1)
+        with mock.patch.object(type(qs1._collection), 'full_name', new_callable=mock.PropertyMock, return_value='other_db.simple_doc'):
+            self.assertNotEqual(TestFilter.fingerprint(qs1), fingerprint)
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        Filterset.count_cache.clear()
+        self.objects = [ SimpleDoc.objects.create(f_int=i) for i in range(10) ]
+
+    def tearDown(self):
+        SimpleDoc.objects.delete()
+
+    def get(self, url, count_limit=None):
+        class Pagination(FilteredLimitOffsetPagination):
+            default_limit = 2
+        Pagination.count_limit = count_limit
+
+        class TestView(ListAPIView):
+            filter_backends = (MongoFilterBackend,)
+            filter_class = TestFilter
+            serializer_class = TestSerializer
+            pagination_class = Pagination
+
+            def get_queryset(self):
+                return SimpleDoc.objects.order_by('f_int')
+
+        return TestView.as_view()(APIRequestFactory().get(url)).data
+
+    def test_exact(self):
+        data = self.get("/?foo=3")
+        self.assertEqual(data['count'], 7)
+        self.assertEqual([ item['f_int'] for item in data['results'] ], [3, 4])
+
+    def test_capped(self):
+        data = self.get("/?foo=3", count_limit=4)
+        self.assertEqual(data['count'], "4+")
+        self.assertIsNotNone(data['next'])
+
+        data = self.get("/?foo=3&offset=4", count_limit=4)
+        self.assertEqual(data['count'], "6+")
+        self.assertEqual([ item['f_int'] for item in data['results'] ], [7, 8])
+        self.assertIsNotNone(data['next'])
+
+        data = self.get("/?foo=3", count_limit=10)
+        self.assertEqual(data['count'], 7)
@@ -0,0 +1,125 @@
+from unittest import TestCase
+from unittest import mock
+from bson import DBRef
+from mongoengine import Document, fields as db_fields
+from rest_framework import serializers
+from rest_framework.generics import ListAPIView
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.test import APIRequestFactory
+
+from drf_mongo_filters import filters, Filterset
+from drf_mongo_filters.backend import MongoFilterBackend
+
+class AuthorDoc(Document):
+    name = db_fields.StringField()
+    bio = db_fields.StringField()
+
+class BookDoc(Document):
+    title = db_fields.StringField()
+    author = db_fields.ReferenceField(AuthorDoc)
+    editor = db_fields.ReferenceField(AuthorDoc)
+    reviewers = db_fields.ListField(db_fields.ReferenceField(AuthorDoc))
+
+class BookFS(Filterset):
+    title = filters.CharFilter()
+    prefetch = ('author', 'reviewers')
+
+class PrefetchTests(TestCase):
+    def setUp(self):
+        BookFS.prefetch_cache.clear()
+        self.alice = AuthorDoc.objects.create(name="Alice", bio="...")
+        self.bob = AuthorDoc.objects.create(name="Bob", bio="...")
+        BookDoc.objects.create(title="A", author=self.alice, editor=self.bob, reviewers=[self.bob])
+        BookDoc.objects.create(title="B", author=self.bob, reviewers=[self.alice, self.bob])
+        BookDoc.objects.create(title="C", author=self.alice)
+
+    def tearDown(self):
+        BookDoc.objects.delete()
+        AuthorDoc.objects.delete()
+
+    def find_calls(self, func):
+        collection = type(AuthorDoc._get_collection())
+        with mock.patch.object(collection, 'find', autospec=True, side_effect=collection.find) as find:
+            result = func()
+        return result, [ call for call in find.call_args_list if call[0][0].name == AuthorDoc._get_collection_name() ]
+
+    def test_prefetch(self):
+        books = list(BookDoc.objects.no_dereference().order_by('title'))
+        books, calls = self.find_calls(lambda: BookFS.prefetch_references(books))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(books[0].author.name, "Alice")
+        self.assertEqual(books[1].author.name, "Bob")
+        self.assertEqual([ author.name for author in books[1].reviewers ], ["Alice", "Bob"])
+        self.assertEqual(books[2].reviewers, [])
+        self.assertIsInstance(books[0].editor, DBRef)
+
+    def test_projection(self):
+        class ProjectedFS(BookFS):
+            prefetch = { 'author': ['name'] }
+
+        books = ProjectedFS.prefetch_references(list(BookDoc.objects.no_dereference()))
+        self.assertEqual(books[0].author.name, "Alice")
+        self.assertIsNone(books[0].author.bio)
+        self.assertIsInstance(books[0].reviewers[0], DBRef)
+
+    def test_cache(self):
+        class CachedFS(BookFS):
+            prefetch = ('author',)
+            prefetch_ttl = 60
+
+        first = CachedFS.prefetch_references(list(BookDoc.objects.no_dereference()))
+        books, calls = self.find_calls(lambda: CachedFS.prefetch_references(list(BookDoc.objects.no_dereference())))
+        self.assertEqual(calls, [])
+        self.assertEqual(books[0].author.name, "Alice")
+        self.assertIsNot(books[0].author, first[0].author)
+
+    def test_missing(self):
+        ghost = AuthorDoc.objects.create(name="Ghost")
+        BookDoc.objects.create(title="D", author=ghost)
+        ghost.delete()
+        books = BookFS.prefetch_references(list(BookDoc.objects(title="D").no_dereference()))
+        self.assertIsInstance(books[0].author, DBRef)
+
+    def test_invalid(self):
+        class InvalidFS(BookFS):
+            prefetch = ('title',)
+
+        with self.assertRaises(TypeError):
+            InvalidFS.prefetch_references(list(BookDoc.objects.all()))
+
+    def test_backend(self):
+        class TestView(ListAPIView):
+            filter_backends = (MongoFilterBackend,)
+            filter_class = BookFS
+            queryset = BookDoc.objects.all()
+
+        view = TestView()
+        view.request = view.initialize_request(APIRequestFactory().get("/?title=B"))
+        queryset = view.filter_queryset(view.get_queryset())
+        books, calls = self.find_calls(lambda: MongoFilterBackend().fetch(queryset, 0, 10, view.filterset))
+        self.assertEqual(len(calls), 2)
+        books, calls = self.find_calls(lambda: (books[0].author.name, [ author.name for author in books[0].reviewers ]))
+        self.assertEqual(books, ("Bob", ["Alice", "Bob"]))
+        self.assertEqual(calls, [])
+
+    def test_stock_view(self):
+        class BookSerializer(serializers.Serializer):
+            title = serializers.CharField()
+            author = serializers.CharField(source='author.name')
+            editor = serializers.CharField(source='editor.name', allow_null=True)
+
+        class TestView(ListAPIView):
+            filter_backends = (MongoFilterBackend,)
+            filter_class = BookFS
+            serializer_class = BookSerializer
+            pagination_class = LimitOffsetPagination
+            queryset = BookDoc.objects.all()
+
+        response = TestView.as_view()(APIRequestFactory().get("/?title=A&limit=10"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [ { 'title': "A", 'author': "Alice", 'editor': "Bob" } ])
+
+        view = TestView()
+        view.request = view.initialize_request(APIRequestFactory().get("/?title=A"))
+        books = list(view.filter_queryset(view.get_queryset()))
+        self.assertIsInstance(books[0].author, AuthorDoc)
@@ -0,0 +1,212 @@
+import asyncio
+import threading
+import time
+from unittest import TestCase
+from rest_framework.exceptions import ValidationError
+
+from drf_mongo_filters.singleflight import SingleFlight, SharedCallError
+
+class ThreadsTests(TestCase):
+    def run_concurrently(self, flight, func, count=5, key='foo', timeout=None):
+        results = []
+        errors = []
+        def worker():
+            try:
+                results.append(flight.do(key, func, timeout))
+            except Exception as e:
+                errors.append(e)
+        threads = [ threading.Thread(target=worker) for i in range(count) ]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    def test_shared(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+        def func():
+            calls.append(1)
+            release.wait(5)
+            return "result"
+
+        threads, results, errors = self.run_concurrently(flight, func)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["result"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight._calls, {})
+
+    def test_error(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        def func():
+            release.wait(5)
+            raise ValueError("failed")
+
+        threads, results, errors = self.run_concurrently(flight, func)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 5)
+        self.assertTrue(all(type(e) is ValueError and e.args == ("failed",) for e in errors))
+        self.assertEqual(len(set(id(e) for e in errors)), 5)
+
+    def test_validation_error(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        def func():
+            release.wait(5)
+            raise ValidationError({ 'foo': ["invalid"] })
+
+        threads, results, errors = self.run_concurrently(flight, func, count=3)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+        self.assertTrue(all(isinstance(e, ValidationError) and e.detail == { 'foo': ["invalid"] } for e in errors))
+
+    def test_uncopyable_error(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        class Uncopyable(Exception):
+            def __init__(self, message, code):
+                super().__init__(message)
+        def func():
+            release.wait(5)
+            raise Uncopyable("failed", 1)
+
+        threads, results, errors = self.run_concurrently(flight, func, count=3)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len([ e for e in errors if isinstance(e, Uncopyable) ]), 1)
+        shared = [ e for e in errors if isinstance(e, SharedCallError) ]
+        self.assertEqual(len(shared), 2)
+        self.assertTrue(all(isinstance(e.error, Uncopyable) and e.__cause__ is e.error for e in shared))
+
+    def test_copies(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        def func():
+            release.wait(5)
+            return [ { 'foo': 1 } ]
+
+        threads, results, errors = self.run_concurrently(flight, func, count=3)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [ [ { 'foo': 1 } ] ] * 3)
+        results[0][0]['foo'] = 2
+        self.assertEqual(results[1], [ { 'foo': 1 } ])
+        self.assertEqual(len(set(id(result[0]) for result in results)), 3)
+
+    def test_interrupted(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        started = threading.Event()
+        class Interrupted(BaseException):
+            pass
+        def interrupted():
+            started.set()
+            release.wait(5)
+            raise Interrupted()
+
+        def leader_worker():
+            try:
+                flight.do('foo', interrupted)
+            except Interrupted:
+                pass
+        leader = threading.Thread(target=leader_worker)
+        leader.start()
+        started.wait(5)
+        threads, results, errors = self.run_concurrently(flight, lambda: "own", count=2)
+        time.sleep(0.1)
+        release.set()
+        leader.join()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["own", "own"])
+        self.assertEqual(errors, [])
+
+    def test_timeout(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        started = threading.Event()
+        def slow():
+            started.set()
+            release.wait(5)
+            return "slow"
+
+        leader = threading.Thread(target=lambda: flight.do('foo', slow))
+        leader.start()
+        started.wait(5)
+        self.assertEqual(flight.do('foo', lambda: "own", timeout=0.01), "own")
+        release.set()
+        leader.join()
+
+class AsyncTests(TestCase):
+    def test_shared(self):
+        flight = SingleFlight()
+        calls = []
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return [ { 'foo': 1 } ]
+
+        async def main():
+            return await asyncio.gather(*[ flight.do_async('foo', func) for i in range(3) ])
+
+        results = asyncio.run(main())
+        self.assertEqual(results, [ [ { 'foo': 1 } ] ] * 3)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(id(result[0]) for result in results)), 3)
+        self.assertEqual(flight._async_calls, {})
+
+    def test_error(self):
+        flight = SingleFlight()
+        async def func():
+            await asyncio.sleep(0.01)
+            raise ValidationError("invalid")
+
+        async def main():
+            return await asyncio.gather(*[ flight.do_async('foo', func) for i in range(3) ], return_exceptions=True)
+
+        errors = asyncio.run(main())
+        self.assertTrue(all(isinstance(e, ValidationError) for e in errors))
+        self.assertEqual(len(set(id(e) for e in errors)), 3)
+
+    def test_cancelled(self):
+        flight = SingleFlight()
+        async def slow():
+            await asyncio.sleep(5)
+
+        async def main():
+            leader = asyncio.ensure_future(flight.do_async('foo', slow))
+            await asyncio.sleep(0)
+            waiter = asyncio.ensure_future(flight.do_async('foo', lambda: asyncio.sleep(0, "own")))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await waiter
+
+        self.assertEqual(asyncio.run(main()), "own")
+
+    def test_timeout(self):
+        flight = SingleFlight()
+        async def slow():
+            await asyncio.sleep(0.5)
+            return "slow"
+
+        async def main():
+            leader = asyncio.ensure_future(flight.do_async('foo', slow))
+            await asyncio.sleep(0)
+            own = await flight.do_async('foo', lambda: asyncio.sleep(0, "own"), timeout=0.01)
+            return own, await leader
+
+        self.assertEqual(asyncio.run(main()), ("own", "slow"))
@@ -0,0 +1,150 @@
+from datetime import datetime
+from unittest import TestCase
+from unittest import mock
+from mongoengine import Document, fields as db_fields
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import ListAPIView
+from rest_framework.test import APIRequestFactory
+
+from drf_mongo_filters import filters, Filterset
+from drf_mongo_filters.backend import SamplingFilterBackend
+
+from .models import SimpleDoc
+
+class TestFS(Filterset):
+    price = filters.RangeFilter(source='f_int')
+    since = filters.DateTimeFilter('gte', source='f_dt')
+    foo = filters.CharFilter(source='f_str')
+
+class CachedFS(TestFS):
+    stats_ttl = 60
+
+class StatsTests(TestCase):
+    def setUp(self):
+        TestFS.stats_cache.clear()
+
+    def test_pipeline(self):
+        fs = TestFS({ 'price.min': 1, 'foo': "Foo" })
+        qs = fs.filter_queryset(SimpleDoc.objects.all(), exclude=('price',))
+        self.assertEqual(fs.range_stats_pipeline(qs, 'price', 5), [
+            { '$match': { 'f_str': "Foo" } },
+            { '$project': { '_id': 0, 'value': '$f_int' } },
+            { '$match': { 'value': { '$ne': None } } },
+            { '$facet': {
+                'bounds': [ { '$group': { '_id': None, 'min': { '$min': '$value' }, 'max': { '$max': '$value' }, 'count': { '$sum': 1 } } } ],
+                'buckets': [ { '$bucketAuto': { 'groupBy': '$value', 'buckets': 5 } } ] } }
+        ])
+
+    def test_stats(self):
+        result = [ {
+            'bounds': [ { '_id': None, 'min': 1, 'max': 9, 'count': 5 } ],
+            'buckets': [ { '_id': { 'min': 1, 'max': 5 }, 'count': 3 }, { '_id': { 'min': 5, 'max': 9 }, 'count': 2 } ]
+        } ]
+        collection = type(SimpleDoc._get_collection())
+        with mock.patch.object(collection, 'aggregate', return_value=iter(result)) as aggregate:
+            stats = CachedFS({ 'foo': "Foo" }).range_stats(SimpleDoc.objects.all(), 'price', 2)
+            self.assertEqual(CachedFS({ 'foo': "Foo" }).range_stats(SimpleDoc.objects.all(), 'price', 2), stats)
+        self.assertEqual(aggregate.call_count, 1)
+        self.assertEqual(stats, { 'min': 1, 'max': 9, 'count': 5, 'buckets': [
+            { 'min': 1, 'max': 5, 'count': 3 }, { 'min': 5, 'max': 9, 'count': 2 } ] })
+
+    def test_not_cached(self):
+        collection = type(SimpleDoc._get_collection())
+        with mock.patch.object(collection, 'aggregate', side_effect=lambda *a, **kw: iter([ { 'bounds': [], 'buckets': [] } ])) as aggregate:
+            TestFS({}).range_stats(SimpleDoc.objects.all(), 'price')
+            TestFS({}).range_stats(SimpleDoc.objects.all(), 'price')
+        self.assertEqual(aggregate.call_count, 2)
+
+    def test_empty(self):
+        with mock.patch.object(type(SimpleDoc._get_collection()), 'aggregate', return_value=iter([ { 'bounds': [], 'buckets': [] } ])):
+            stats = TestFS({}).range_stats(SimpleDoc.objects.all(), 'since')
+        self.assertEqual(stats, { 'min': None, 'max': None, 'count': 0, 'buckets': [] })
+
+    def test_invalid(self):
+        with self.assertRaises(ValidationError):
+            TestFS({}).range_stats(SimpleDoc.objects.all(), 'foo')
+        with self.assertRaises(ValidationError):
+            TestFS({}).range_stats(SimpleDoc.objects.all(), 'bar')
+
+
+class SampledDoc(Document):
+    kind = db_fields.StringField()
+
+class SampleFS(Filterset):
+    kind = filters.CharFilter()
+    sample_size = 5
+
+class SamplingTests(TestCase):
+    def setUp(self):
+        SampledDoc.objects.insert([ SampledDoc(kind="a" if i % 4 else "b") for i in range(20) ])
+
+    def tearDown(self):
+        SampledDoc.objects.delete()
+
+    def test_estimate(self):
+        self.assertEqual(SampleFS.estimate_count(3, 10, 10), { 'count': 3, 'low': 3, 'high': 3, 'confidence': 1.0, 'exact': True })
+        estimate = SampleFS.estimate_count(50, 100, 1000)
+        self.assertEqual(estimate['count'], 500)
+        self.assertEqual((estimate['low'], estimate['high']), (403, 597))
+        self.assertFalse(estimate['exact'])
+        estimate = SampleFS.estimate_count(0, 100, 1000)
+        self.assertEqual((estimate['count'], estimate['low']), (0, 0))
+        self.assertGreater(estimate['high'], 0)
+
+    def test_match_first(self):
+        docs, estimate = SampleFS.sample_queryset(SampledDoc.objects.filter(kind="a"))
+        self.assertEqual(len(docs), 5)
+        self.assertTrue(all(isinstance(doc, SampledDoc) and doc.kind == "a" for doc in docs))
+        self.assertFalse(estimate['exact'])
+        self.assertLessEqual(estimate['low'], estimate['count'])
+        self.assertLessEqual(estimate['count'], estimate['high'])
+
+    def test_match_first_all(self):
+        docs, estimate = SampleFS.sample_queryset(SampledDoc.objects.filter(kind="b"), size=10)
+        self.assertEqual(len(docs), 5)
+        self.assertEqual(estimate['count'], 5)
+        self.assertTrue(estimate['exact'])
+
+    def test_sample_first(self):
+        docs, estimate = SampleFS.sample_queryset(SampledDoc.objects.filter(kind="a"), strategy='sample_first')
+        self.assertTrue(all(doc.kind == "a" for doc in docs))
+        self.assertEqual(estimate['count'], len(docs) * 4)
+        docs, estimate = SampleFS.sample_queryset(SampledDoc.objects.filter(kind="a"), size=50, strategy='sample_first')
+        self.assertEqual(len(docs), 15)
+        self.assertTrue(estimate['exact'])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            SampleFS.sample_queryset(SampledDoc.objects.all(), strategy='foo')
+
+    def test_none(self):
+        docs, estimate = SampleFS.sample_queryset(SampledDoc.objects.none())
+        self.assertEqual(docs, [])
+        self.assertEqual(estimate['count'], 0)
+
+    def test_backend(self):
+        class TestView(ListAPIView):
+            filter_backends = (SamplingFilterBackend,)
+            filter_class = SampleFS
+            queryset = SampledDoc.objects.all()
+
+        view = TestView()
+        view.request = view.initialize_request(APIRequestFactory().get("/?kind=a"))
+        docs = view.filter_queryset(view.get_queryset())
+        self.assertEqual(len(docs), 5)
+        self.assertEqual(view.sample_estimate['confidence'], 0.95)
+
+    def test_backend_param(self):
+        class Backend(SamplingFilterBackend):
+            sample_param = 'sample'
+
+        class TestView(ListAPIView):
+            filter_backends = (Backend,)
+            filter_class = SampleFS
+            queryset = SampledDoc.objects.all()
+
+        view = TestView()
+        view.request = view.initialize_request(APIRequestFactory().get("/?kind=a"))
+        self.assertEqual(view.filter_queryset(view.get_queryset()).count(), 15)
+        view.request = view.initialize_request(APIRequestFactory().get("/?kind=a&sample=1"))
+        self.assertEqual(len(view.filter_queryset(view.get_queryset())), 5)